@@ -15,12 +15,24 @@ WRIST_MASK_FOLDER = 'wrist_mask'
 FRONT_RGB_FOLDER = 'front_rgb'
 FRONT_DEPTH_FOLDER = 'front_depth'
 FRONT_MASK_FOLDER = 'front_mask'
+
+CAMERAS = ['left_shoulder', 'right_shoulder', 'overhead', 'wrist', 'front']
+# Folder (or episode file column) of a downsampled image level,
+# e.g. 'front_rgb_64x64'.
+IMAGE_LEVEL_FORMAT = '%s_%dx%d'
+
 EPISODES_FOLDER = 'episodes'
 EPISODE_FOLDER = 'episode%d'
 VARIATIONS_FOLDER = 'variation%d'
 
 LOW_DIM_PICKLE = 'low_dim_obs.pkl'
+LOW_DIM_FILE = 'low_dim_obs.rlb'
+EPISODE_FILE = 'episode_data.rlb'
+# Written last into each episode folder: the size and checksum of its files.
+EPISODE_FOOTER = 'episode_footer.json'
+POINT_CLOUD_CACHE_FOLDER = 'point_cloud_cache'
 VARIATION_DESCRIPTIONS = 'variation_descriptions.pkl'
+VARIATION_MANIFEST = 'manifest.json'
 
 TTT_FILE = 'task_design.ttt'
 
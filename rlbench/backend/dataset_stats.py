@@ -0,0 +1,138 @@
+"""Normalisation statistics gathered while a dataset is written.
+
+Every episode gets per-dimension count, mean, sum of squared differences,
+min and max of its low-dim fields, and per-camera statistics of its depth.
+These merge exactly (Chan et al.'s parallel form of Welford's algorithm),
+so the statistics of a variation, a task or a whole dataset are merged
+from those of its episodes without reading the data again.
+"""
+from typing import Dict, List
+
+import numpy as np
+
+from rlbench.backend.const import CAMERAS
+from rlbench.demo import Demo
+
+STATS_FIELDS = ['joint_velocities', 'joint_positions', 'gripper_pose',
+                'task_low_dim_state']
+# Depth as stored (0 to 1 between the near and far planes) and in meters.
+DEPTH_STATS = '%s_depth'
+DEPTH_METERS_STATS = '%s_depth_m'
+
+
+class RunningStats(object):
+    """Mergeable per-dimension statistics of a set of samples."""
+
+    def __init__(self, count: int = 0, mean=0.0, m2=0.0,
+                 minimum=np.inf, maximum=-np.inf):
+        self.count = count
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.m2 = np.asarray(m2, dtype=np.float64)
+        self.min = np.asarray(minimum, dtype=np.float64)
+        self.max = np.asarray(maximum, dtype=np.float64)
+
+    @classmethod
+    def from_array(cls, values) -> 'RunningStats':
+        """Statistics of the samples along the first axis of values."""
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return cls()
+        mean = values.mean(axis=0)
+        return cls(len(values), mean, np.square(values - mean).sum(axis=0),
+                   values.min(axis=0), values.max(axis=0))
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'RunningStats':
+        return cls(d['count'], d['mean'], d['m2'], d['min'], d['max'])
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'mean': self.mean.tolist(),
+                'm2': self.m2.tolist(), 'min': self.min.tolist(),
+                'max': self.max.tolist()}
+
+    def update(self, values) -> None:
+        self.merge(RunningStats.from_array(values))
+
+    def merge(self, other: 'RunningStats') -> None:
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count = other.count
+            self.mean, self.m2 = other.mean.copy(), other.m2.copy()
+            self.min, self.max = other.min.copy(), other.max.copy()
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + np.square(delta) * (
+            self.count * other.count / count)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.count = count
+
+    @property
+    def var(self) -> np.ndarray:
+        return self.m2 / max(self.count, 1)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.var)
+
+    def __repr__(self):
+        return 'RunningStats(count=%d, mean=%s, std=%s)' % (
+            self.count, self.mean, self.std)
+
+
+def episode_stats(demo: Demo, depths: Dict[str, np.ndarray] = None
+                  ) -> Dict[str, RunningStats]:
+    """The statistics of a single episode.
+
+    :param demo: The demo, for its low-dim fields and camera near/far planes.
+    :param depths: Camera name to the (T, H, W) stored depth of the episode.
+        By default, the depth of the observations is used.
+    """
+    stats = {}
+    for field in STATS_FIELDS:
+        values = [getattr(obs, field) for obs in demo]
+        if any(v is None for v in values):
+            continue
+        try:
+            stats[field] = RunningStats.from_array(np.stack(values))
+        except ValueError:
+            # E.g. task low-dim states that change size during the episode.
+            continue
+    for camera in CAMERAS:
+        if depths is not None:
+            depth = depths.get(camera)
+        else:
+            depth = [getattr(obs, '%s_depth' % camera) for obs in demo]
+            depth = None if any(d is None for d in depth) else np.stack(depth)
+        if depth is None:
+            continue
+        stats[DEPTH_STATS % camera] = RunningStats.from_array(
+            depth.reshape(-1))
+        meters = RunningStats()
+        for obs, d in zip(demo, depth):
+            near = obs.misc['%s_camera_near' % camera]
+            far = obs.misc['%s_camera_far' % camera]
+            meters.update((near + d * (far - near)).reshape(-1))
+        stats[DEPTH_METERS_STATS % camera] = meters
+    return stats
+
+
+def merge_stats(stats: List[Dict[str, RunningStats]]
+                ) -> Dict[str, RunningStats]:
+    """Merges the statistics of several episodes, variations or tasks."""
+    merged = {}
+    for s in stats:
+        for name, value in s.items():
+            merged.setdefault(name, RunningStats()).merge(value)
+    return merged
+
+
+def stats_to_dict(stats: Dict[str, RunningStats]) -> dict:
+    return {name: value.to_dict() for name, value in stats.items()}
+
+
+def stats_from_dict(d: dict) -> Dict[str, RunningStats]:
+    return {name: RunningStats.from_dict(value) for name, value in d.items()}
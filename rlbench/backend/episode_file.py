@@ -0,0 +1,481 @@
+"""Single-file, columnar storage for a whole episode.
+
+Rather than one PNG per frame per camera, an episode file holds one
+contiguous array per modality (e.g. 'front_rgb' with shape (T, H, W, 3))
+plus one column per low-dimensional observation field. Images are stored
+with exactly the same pixel encoding as the PNG layout (depth as 24-bit RGB
+encoded values, masks as RGB coded handles), so both layouts decode through
+the same code path.
+
+File layout:
+  8 bytes   magic
+  8 bytes   little-endian uint64 header length
+  N bytes   utf-8 JSON header (columns, num_steps, attrs)
+  ...       column data, each column starting on an aligned offset
+
+Image columns can optionally be stored with the lossless 'delta_zlib'
+codec. Steps are grouped into chunks of keyframe_interval frames; within a
+chunk the first frame is stored as is and every other frame as its
+(wrapping) difference to the previous frame, and each chunk is zlib
+compressed. Static parts of the scene difference to zeros, which compress
+to almost nothing, and a single frame only needs its own chunk decoded.
+
+Image columns can also be deduplicated: frames with identical content (e.g.
+while the gripper actuates and nothing else moves) are stored once, and the
+header maps every step to its stored frame. Reading expands the column back
+to one frame per step, so deduplication is invisible to the loaders.
+"""
+import hashlib
+import inspect
+import json
+import mmap
+import os
+import struct
+import zlib
+from typing import Dict, List
+
+import numpy as np
+
+from rlbench.backend.observation import Observation
+from rlbench.demo import Demo
+
+MAGIC = b'RLBEPI\x00\x01'
+# Version 2 adds compressed columns and version 3 deduplicated columns.
+# Files are written with the lowest version that can hold them, so older
+# readers can still read them.
+VERSION = 3
+ALIGNMENT = 64
+
+DELTA_ZLIB = 'delta_zlib'
+DEFAULT_KEYFRAME_INTERVAL = 10
+
+LOW_DIM_FIELDS = ['joint_velocities', 'joint_positions', 'joint_forces',
+                  'gripper_open', 'gripper_pose', 'gripper_matrix',
+                  'gripper_joint_positions', 'gripper_touch_forces',
+                  'task_low_dim_state']
+
+MISC_PREFIX = 'misc/'
+# Misc values that are the same at every step (e.g. the intrinsics of a
+# fixed camera) are stored once, without the step dimension.
+MISC_STATIC_PREFIX = 'misc_static/'
+RANDOM_STATE_KEYS = 'random_state/keys'
+KEYFRAMES = 'keyframes'
+
+_OBSERVATION_FIELDS = list(inspect.signature(Observation).parameters.keys())
+
+
+class EpisodeFileError(Exception):
+    """Raised when an episode file is malformed or cannot be written."""
+    pass
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _stack(name: str, values: list) -> np.ndarray:
+    try:
+        column = np.stack([np.asarray(v) for v in values])
+    except ValueError as e:
+        raise EpisodeFileError(
+            "Column '%s' does not have a constant shape across the episode."
+            % name) from e
+    if column.dtype == object:
+        raise EpisodeFileError(
+            "Column '%s' is not numeric and cannot be stored." % name)
+    return column
+
+
+def _delta_zlib_chunks(name: str, array: np.ndarray,
+                       keyframe_interval: int) -> List[bytes]:
+    if array.dtype.kind != 'u' or array.ndim < 2:
+        raise EpisodeFileError(
+            "Column '%s' must be a per-step unsigned integer array to be "
+            "delta compressed." % name)
+    chunks = []
+    for start in range(0, len(array), keyframe_interval):
+        frames = array[start:start + keyframe_interval]
+        deltas = np.empty_like(frames)
+        deltas[0] = frames[0]
+        # Unsigned subtraction wraps around, so adding back is exact.
+        np.subtract(frames[1:], frames[:-1], out=deltas[1:])
+        chunks.append(zlib.compress(deltas.data))
+    return chunks
+
+
+def _deduplicate(name: str, array: np.ndarray) -> (np.ndarray, List[int]):
+    """Splits a per-step column into its unique frames and a step index."""
+    if array.ndim < 2:
+        raise EpisodeFileError(
+            "Column '%s' must be a per-step array to be deduplicated." % name)
+    unique = []
+    by_hash = {}
+    index = []
+    for frame in array:
+        digest = hashlib.blake2b(frame.data, digest_size=16).digest()
+        # Hash matches are confirmed, so a collision can never merge frames.
+        for j in by_hash.setdefault(digest, []):
+            if np.array_equal(array[unique[j]], frame):
+                index.append(j)
+                break
+        else:
+            by_hash[digest].append(len(unique))
+            index.append(len(unique))
+            unique.append(len(index) - 1)
+    return array[unique], index
+
+
+def _stored_shape(info: dict) -> list:
+    """The shape of a column as stored, i.e. before expanding repeats."""
+    if 'index' in info:
+        return [info['frames']] + info['shape'][1:]
+    return info['shape']
+
+
+def _undelta(deltas: np.ndarray) -> np.ndarray:
+    return np.cumsum(deltas, axis=0, dtype=deltas.dtype)
+
+
+def write_episode_file(path: str, num_steps: int,
+                       columns: Dict[str, np.ndarray],
+                       attrs: dict = None,
+                       compress: List[str] = (),
+                       keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL,
+                       deduplicate: List[str] = ()) -> int:
+    """Writes a set of columns to a single episode file.
+
+    :param path: Where to write the file.
+    :param num_steps: The number of steps in the episode.
+    :param columns: Name to array mapping. The first dimension of every
+        per-step column is the step index.
+    :param attrs: JSON serialisable metadata stored in the header.
+    :param compress: Names of (unsigned integer, per-step) columns to store
+        with the delta_zlib codec.
+    :param keyframe_interval: Frames per independently decodable chunk of
+        the compressed columns.
+    :param deduplicate: Names of per-step columns whose repeated frames are
+        stored only once.
+    :return: The CRC32 of the written file.
+    """
+    header_columns = {}
+    offset = 0
+    arrays = []
+    for name, array in columns.items():
+        array = np.require(array, requirements='C')
+        offset = _align(offset)
+        header_columns[name] = {
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': offset,
+        }
+        if name in deduplicate:
+            array, index = _deduplicate(name, array)
+            header_columns[name].update({
+                'frames': len(array),
+                'index': index,
+            })
+        header_columns[name]['nbytes'] = array.nbytes
+        if name in compress:
+            chunks = _delta_zlib_chunks(name, array, keyframe_interval)
+            header_columns[name].update({
+                'codec': DELTA_ZLIB,
+                'keyframe_interval': keyframe_interval,
+                'chunks': [len(chunk) for chunk in chunks],
+                'nbytes': sum(len(chunk) for chunk in chunks),
+            })
+            for chunk in chunks:
+                arrays.append((offset, chunk))
+                offset += len(chunk)
+        else:
+            arrays.append((offset, array.data))
+            offset += array.nbytes
+    header = json.dumps({
+        'version': 3 if len(deduplicate) > 0 else
+        2 if len(compress) > 0 else 1,
+        'num_steps': num_steps,
+        'columns': header_columns,
+        'attrs': attrs or {},
+    }).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+    crc = 0
+    position = 0
+    with open(path, 'wb') as f:
+        for start, data in [(0, MAGIC),
+                            (len(MAGIC), struct.pack('<Q', len(header))),
+                            (len(MAGIC) + 8, header)] + [
+                (data_start + column_offset, data)
+                for column_offset, data in arrays]:
+            # Padding is written explicitly so the checksum covers the file.
+            padding = bytes(start - position)
+            f.write(padding)
+            f.write(data)
+            crc = zlib.crc32(data, zlib.crc32(padding, crc))
+            position = start + memoryview(data).nbytes
+    return crc
+
+
+class EpisodeFile(object):
+    """Reads columns back out of an episode file.
+
+    With memory_map=True the file is mapped once and every column is
+    returned as a read-only view into the mapping, so only the pages that
+    are actually touched get read, and processes reading the same file share
+    them through the page cache. With preload=True the whole file is read
+    with a single read, and columns are (writeable) views of that buffer.
+    """
+
+    def __init__(self, path: str, memory_map: bool = False,
+                 preload: bool = False):
+        self.path = path
+        with open(path, 'rb') as f:
+            if preload:
+                buffer = bytearray(os.fstat(f.fileno()).st_size)
+                f.readinto(buffer)
+                f.seek(0)
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise EpisodeFileError('Not an episode file: %s' % path)
+            header_len, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_len).decode('utf-8'))
+            if memory_map:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._map = buffer if preload else None
+        if header['version'] > VERSION:
+            raise EpisodeFileError(
+                'Episode file %s has version %d, but only versions up to %d '
+                'are supported.' % (path, header['version'], VERSION))
+        self._columns = header['columns']
+        self._data_start = _align(len(MAGIC) + 8 + header_len)
+        self.num_steps = header['num_steps']
+        self.attrs = header['attrs']
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._columns
+
+    @property
+    def memory_mapped(self) -> bool:
+        return isinstance(self._map, mmap.mmap)
+
+    def columns(self) -> List[str]:
+        return list(self._columns.keys())
+
+    def shape(self, name: str) -> tuple:
+        """The shape of a column, without reading it."""
+        return tuple(self._columns[name]['shape'])
+
+    def compressed(self, name: str) -> bool:
+        return 'codec' in self._columns[name]
+
+    def read(self, name: str) -> np.ndarray:
+        """Reads a whole column.
+
+        Without memory mapping this is a single contiguous read, otherwise
+        a zero-copy view of the mapped file. Compressed and deduplicated
+        columns are always decoded into a new array.
+        """
+        info = self._info(name)
+        if 'codec' in info:
+            frames = self._read_compressed(name, info, len(info['chunks']))
+        else:
+            frames = self._read_raw(name, info)
+        if 'index' in info:
+            return frames[np.asarray(info['index'], dtype=np.intp)]
+        return frames
+
+    def read_step(self, name: str, i: int) -> np.ndarray:
+        """Reads the value of a per-step column at a single step.
+
+        For compressed columns only the chunk holding the step is decoded.
+        """
+        info = self._info(name)
+        if 'index' in info:
+            i = info['index'][i]
+        if 'codec' not in info:
+            return self._read_raw(name, info)[i]
+        i = range(_stored_shape(info)[0])[i]
+        interval = info['keyframe_interval']
+        chunk = self._read_compressed(name, info, i // interval + 1,
+                                      i // interval)
+        return chunk[i % interval]
+
+    def _info(self, name: str) -> dict:
+        if name not in self._columns:
+            raise KeyError("No column '%s' in %s." % (name, self.path))
+        return self._columns[name]
+
+    def _read_bytes(self, name: str, start: int, nbytes: int):
+        if self._map is not None:
+            data = memoryview(self._map)[start:start + nbytes]
+        else:
+            with open(self.path, 'rb') as f:
+                f.seek(start)
+                data = f.read(nbytes)
+        if len(data) != nbytes:
+            raise EpisodeFileError(
+                "Column '%s' in %s is truncated." % (name, self.path))
+        return data
+
+    def _read_compressed(self, name: str, info: dict, end: int,
+                         begin: int = 0) -> np.ndarray:
+        """Decodes chunks [begin, end) of a delta_zlib column."""
+        if info['codec'] != DELTA_ZLIB:
+            raise EpisodeFileError("Column '%s' in %s uses the unknown codec "
+                                   "'%s'." % (name, self.path, info['codec']))
+        dtype = np.dtype(info['dtype'])
+        frame_shape = info['shape'][1:]
+        sizes = info['chunks']
+        start = self._data_start + info['offset'] + sum(sizes[:begin])
+        data = self._read_bytes(name, start, sum(sizes[begin:end]))
+        chunks = []
+        position = 0
+        for size in sizes[begin:end]:
+            deltas = np.frombuffer(
+                zlib.decompress(data[position:position + size]), dtype=dtype)
+            chunks.append(_undelta(deltas.reshape([-1] + frame_shape)))
+            position += size
+        if len(chunks) == 0:
+            return np.empty(_stored_shape(info), dtype=dtype)
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+    def _read_raw(self, name: str, info: dict) -> np.ndarray:
+        dtype = np.dtype(info['dtype'])
+        count = info['nbytes'] // dtype.itemsize
+        start = self._data_start + info['offset']
+        if self._map is not None:
+            if start + info['nbytes'] > len(self._map):
+                raise EpisodeFileError(
+                    "Column '%s' in %s is truncated." % (name, self.path))
+            data = np.frombuffer(self._map, dtype=dtype, count=count,
+                                 offset=start)
+        else:
+            with open(self.path, 'rb') as f:
+                f.seek(start)
+                data = np.fromfile(f, dtype=dtype, count=count)
+            if data.nbytes != info['nbytes']:
+                raise EpisodeFileError(
+                    "Column '%s' in %s is truncated." % (name, self.path))
+        return data.reshape(_stored_shape(info))
+
+
+def demo_to_columns(demo: Demo) -> (Dict[str, np.ndarray], dict):
+    """Converts the low-dimensional part of a demo into columns and attrs.
+
+    Image data is left to the caller, as its encoding depends on the storage
+    layout.
+    """
+    columns = {}
+    for field in LOW_DIM_FIELDS:
+        values = [getattr(obs, field) for obs in demo]
+        if all(v is None for v in values):
+            continue
+        if any(v is None for v in values):
+            raise EpisodeFileError(
+                "Column '%s' is only present for part of the episode."
+                % field)
+        columns[field] = _stack(field, values)
+    misc_keys = set()
+    for obs in demo:
+        misc_keys.update((obs.misc or {}).keys())
+    for key in sorted(misc_keys):
+        name = MISC_PREFIX + key
+        column = _stack(name, [obs.misc.get(key) for obs in demo])
+        if all(np.array_equal(column[0], value) for value in column[1:]):
+            columns[MISC_STATIC_PREFIX + key] = column[0]
+        else:
+            columns[name] = column
+
+    attrs = {}
+    random_seed = getattr(demo, 'random_seed', None)
+    if isinstance(random_seed, (int, np.integer)):
+        attrs['random_seed'] = int(random_seed)
+    elif random_seed is not None:
+        kind, keys, pos, has_gauss, cached_gaussian = random_seed
+        columns[RANDOM_STATE_KEYS] = np.asarray(keys)
+        attrs['random_state'] = [kind, int(pos), int(has_gauss),
+                                 float(cached_gaussian)]
+    keyframes = getattr(demo, 'keyframes', None)
+    if keyframes is not None:
+        columns[KEYFRAMES] = np.asarray(keyframes, dtype=np.int64)
+    return columns, attrs
+
+
+def _step_values(column: np.ndarray) -> list:
+    # 1-D columns hold one scalar per step, given back as Python scalars.
+    return column.tolist() if column.ndim == 1 else list(column)
+
+
+def observations_from_episode_file(episode: EpisodeFile) -> List[Observation]:
+    """Builds observations holding the low-dimensional data of an episode.
+
+    All image fields are left as None.
+    """
+    num_steps = episode.num_steps
+    low_dim = {field: _step_values(episode.read(field))
+               for field in LOW_DIM_FIELDS if field in episode}
+    misc = {}
+    for name in episode.columns():
+        if name.startswith(MISC_PREFIX):
+            misc[name[len(MISC_PREFIX):]] = _step_values(episode.read(name))
+        elif name.startswith(MISC_STATIC_PREFIX):
+            value = episode.read(name)
+            # Repeated, so that steps do not share (mutable) arrays.
+            misc[name[len(MISC_STATIC_PREFIX):]] = (
+                [value.item()] * num_steps if value.ndim == 0 else
+                list(np.repeat(value[np.newaxis], num_steps, axis=0)))
+    observations = []
+    for i in range(num_steps):
+        kwargs = dict.fromkeys(_OBSERVATION_FIELDS)
+        kwargs.update({field: values[i] for field, values in low_dim.items()})
+        kwargs['misc'] = {key: values[i] for key, values in misc.items()}
+        observations.append(Observation(**kwargs))
+    return observations
+
+
+def observation_from_episode_file(episode: EpisodeFile,
+                                  i: int) -> Observation:
+    """Builds the low-dimensional observation of a single step.
+
+    Only step i of each per-step column is read. All image fields are left
+    as None.
+    """
+    kwargs = dict.fromkeys(_OBSERVATION_FIELDS)
+    misc = {}
+    for name in episode.columns():
+        if name in LOW_DIM_FIELDS:
+            kwargs[name] = _step_value(episode.read_step(name, i))
+        elif name.startswith(MISC_PREFIX):
+            misc[name[len(MISC_PREFIX):]] = _step_value(
+                episode.read_step(name, i))
+        elif name.startswith(MISC_STATIC_PREFIX):
+            misc[name[len(MISC_STATIC_PREFIX):]] = _step_value(
+                episode.read(name))
+    kwargs['misc'] = misc
+    return Observation(**kwargs)
+
+
+def _step_value(value: np.ndarray):
+    # Matches _step_values: scalars as Python scalars, arrays as copies.
+    return value.item() if value.ndim == 0 else np.array(value)
+
+
+def random_state_from_episode_file(episode: EpisodeFile):
+    """Recovers the seed the episode was collected with.
+
+    Episodes collected before seeds were recorded give back the whole numpy
+    random state instead.
+    """
+    if 'random_seed' in episode.attrs:
+        return episode.attrs['random_seed']
+    if 'random_state' not in episode.attrs:
+        return None
+    kind, pos, has_gauss, cached_gaussian = episode.attrs['random_state']
+    return (kind, episode.read(RANDOM_STATE_KEYS), pos, has_gauss,
+            cached_gaussian)
+
+
+def keyframes_from_episode_file(episode: EpisodeFile) -> List[int]:
+    """The keyframe steps of the episode, or None if none were stored."""
+    if KEYFRAMES not in episode:
+        return None
+    return episode.read(KEYFRAMES).tolist()
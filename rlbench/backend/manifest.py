@@ -0,0 +1,182 @@
+"""Per-variation index of the stored episodes.
+
+The dataset generator writes one manifest per variation, listing each
+episode together with its step count, stored modalities, image sizes and
+file checksums. Loaders use it to select and validate episodes without
+listing any directories. When the episodes carry normalisation statistics,
+the manifest also holds those of the whole variation.
+
+Each episode folder also gets a small footer, holding its manifest entry
+and the size of each of its files, so that an episode can be checked (and
+its variation manifest rebuilt) on its own, e.g. after a crash.
+"""
+import json
+import os
+import zlib
+from typing import List, Optional
+
+from rlbench.backend import dataset_stats
+from rlbench.backend.const import EPISODE_FILE, EPISODE_FOOTER, \
+    LOW_DIM_PICKLE, VARIATION_MANIFEST
+
+MANIFEST_VERSION = 1
+FOOTER_VERSION = 1
+
+
+def checksum(data: bytes, value: int = 0) -> int:
+    """CRC32 of the data, optionally continuing from a previous value."""
+    return zlib.crc32(data, value)
+
+
+def format_checksum(value: int) -> str:
+    return '%08x' % (value & 0xffffffff)
+
+
+def file_checksum(path: str, chunk_size: int = 1 << 22) -> str:
+    value = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            value = checksum(chunk, value)
+    return format_checksum(value)
+
+
+def episode_entry(episode_id: str, num_steps: int, storage_format: str,
+                  modalities: List[str], image_sizes: dict,
+                  checksums: dict, image_levels: dict = None,
+                  keyframes: List[int] = None,
+                  stats: dict = None) -> dict:
+    """Describes a single stored episode.
+
+    :param episode_id: The episode folder name, e.g. 'episode0'.
+    :param num_steps: The number of observations in the episode.
+    :param storage_format: Either 'png' or 'episode_file'.
+    :param modalities: The stored image modalities, e.g. 'front_rgb'.
+    :param image_sizes: Camera name to stored [width, height].
+    :param checksums: File path (relative to the episode folder) to CRC32.
+    :param image_levels: Camera name to the [width, height] of each extra,
+        downsampled copy of its images.
+    :param keyframes: The keyframe steps, if they were recorded.
+    :param stats: Name to RunningStats of the episode's normalisation
+        statistics (see dataset_stats.episode_stats).
+    """
+    entry = {
+        'id': episode_id,
+        'num_steps': num_steps,
+        'storage_format': storage_format,
+        'modalities': sorted(modalities),
+        'image_sizes': image_sizes,
+        'checksums': checksums,
+        'image_levels': image_levels or {},
+    }
+    if keyframes is not None:
+        entry['keyframes'] = [int(i) for i in keyframes]
+    if stats is not None:
+        entry['stats'] = dataset_stats.stats_to_dict(stats)
+    return entry
+
+
+def write_manifest(variation_path: str, entries: List[dict],
+                   **extra) -> None:
+    """Writes the variation manifest, replacing any previous one atomically.
+
+    Entries are stored ordered by episode number. If every entry has
+    statistics, their merge is stored as the statistics of the variation.
+    """
+    entries = sorted(entries, key=lambda e: _episode_number(e['id']))
+    manifest = dict(version=MANIFEST_VERSION, episodes=entries, **extra)
+    if len(entries) > 0 and all('stats' in e for e in entries):
+        manifest['stats'] = dataset_stats.stats_to_dict(
+            dataset_stats.merge_stats([
+                dataset_stats.stats_from_dict(e['stats']) for e in entries]))
+    path = os.path.join(variation_path, VARIATION_MANIFEST)
+    tmp_path = '%s.tmp%d' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(variation_path: str) -> Optional[dict]:
+    """Reads the variation manifest, or returns None if there is none."""
+    path = os.path.join(variation_path, VARIATION_MANIFEST)
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('version', 0) > MANIFEST_VERSION:
+        raise RuntimeError(
+            'Manifest %s has version %d, but only versions up to %d are '
+            'supported.' % (path, manifest['version'], MANIFEST_VERSION))
+    return manifest
+
+
+def write_episode_footer(example_path: str, entry: dict) -> None:
+    """Writes the footer of an episode, once all of its files are written.
+
+    :param entry: The manifest entry of the episode (see episode_entry),
+        whose checksums list every file of the episode.
+    """
+    footer = {
+        'version': FOOTER_VERSION,
+        'entry': entry,
+        'sizes': {rel_path: os.path.getsize(
+            os.path.join(example_path, rel_path))
+            for rel_path in entry['checksums']},
+    }
+    path = os.path.join(example_path, EPISODE_FOOTER)
+    tmp_path = '%s.tmp%d' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(footer, f)
+    os.replace(tmp_path, path)
+
+
+def read_episode_footer(example_path: str) -> Optional[dict]:
+    """Reads the footer of an episode, or returns None if there is none."""
+    try:
+        with open(os.path.join(example_path, EPISODE_FOOTER), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def verify_episode(example_path: str,
+                   checksums: bool = False) -> Optional[str]:
+    """Checks that an episode was completely written and is intact.
+
+    By default only the sizes of the files are checked against the footer,
+    which needs no reads of the episode data. Episodes written before there
+    were footers only need their low-dim pickle or episode file, as those
+    were written last.
+
+    :param checksums: Also check the checksum of every file.
+    :return: None if the episode is fine, otherwise what is wrong with it.
+    """
+    try:
+        footer = read_episode_footer(example_path)
+    except ValueError:
+        return 'The footer of %s is corrupt.' % example_path
+    if footer is None:
+        if any(os.path.exists(os.path.join(example_path, name))
+               for name in [LOW_DIM_PICKLE, EPISODE_FILE]):
+            return None
+        return '%s was not completely written.' % example_path
+    for rel_path, value in footer['entry']['checksums'].items():
+        path = os.path.join(example_path, rel_path)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return '%s is missing.' % path
+        if size != footer['sizes'][rel_path]:
+            return '%s has %d bytes, but %d were written.' % (
+                path, size, footer['sizes'][rel_path])
+        if checksums and file_checksum(path) != value:
+            return '%s does not match its checksum.' % path
+    return None
+
+
+def _episode_number(episode_id: str) -> int:
+    digits = ''.join(c for c in episode_id if c.isdigit())
+    return int(digits) if len(digits) > 0 else -1
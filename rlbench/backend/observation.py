@@ -79,3 +79,48 @@ class Observation(object):
             if data is not None:
                 low_dim_data.append(data)
         return np.concatenate(low_dim_data) if len(low_dim_data) > 0 else np.array([])
+
+
+class LazyObservation(Observation):
+    """An observation whose (image) fields are only decoded when accessed.
+
+    Takes the fields of an existing observation, and a dictionary of
+    field name to a zero-argument callable producing that field. Each
+    callable is run once, on first access, and the result cached.
+    """
+
+    def __init__(self, observation: Observation, loaders: dict):
+        self.__dict__.update(observation.__dict__)
+        for name in loaders:
+            self.__dict__.pop(name, None)
+        self._loaders = dict(loaders)
+
+    def __getattr__(self, name):
+        # Only called when the attribute has not been set (or decoded) yet.
+        loaders = self.__dict__.get('_loaders')
+        if loaders is None or name not in loaders:
+            raise AttributeError(name)
+        value = loaders.pop(name)()
+        setattr(self, name, value)
+        return value
+
+    def __setattr__(self, name, value):
+        loaders = self.__dict__.get('_loaders')
+        if loaders is not None:
+            loaders.pop(name, None)
+        super().__setattr__(name, value)
+
+    def decode_all(self) -> None:
+        """Decodes every field that has not been accessed yet."""
+        for name in list(self._loaders.keys()):
+            getattr(self, name)
+
+    def __getstate__(self):
+        self.decode_all()
+        state = dict(self.__dict__)
+        state.pop('_loaders')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__['_loaders'] = {}
@@ -333,6 +333,7 @@ class Scene(object):
                 'No waypoints were found.', self.task)
 
         demo = []
+        keyframes = []
         if record:
             self.pyrep.step()  # Need this here or get_force doesn't work...
             demo.append(self.get_observation())
@@ -368,6 +369,7 @@ class Scene(object):
                     success, term = self.task.success()
 
                 point.end_of_path()
+                self._demo_record_keyframe(demo, keyframes)
 
                 path.clear_visualization()
 
@@ -418,6 +420,7 @@ class Scene(object):
                             gripper.grasp(g_obj)
 
                     self._demo_record_step(demo, record, callable_each_step)
+                    self._demo_record_keyframe(demo, keyframes)
 
             if not self.task.should_repeat_waypoints() or success:
                 break
@@ -437,7 +440,8 @@ class Scene(object):
         if not success:
             raise DemoError('Demo was completed, but was not successful.',
                             self.task)
-        return Demo(demo)
+        self._demo_record_keyframe(demo, keyframes)
+        return Demo(demo, keyframes=keyframes if record else None)
 
     def get_observation_config(self) -> ObservationConfig:
         return self._obs_config
@@ -454,6 +458,12 @@ class Scene(object):
         if func is not None:
             func(self.get_observation())
 
+    def _demo_record_keyframe(self, demo_list, keyframes):
+        # The last recorded step ends a waypoint or a gripper action.
+        i = len(demo_list) - 1
+        if i > 0 and (len(keyframes) == 0 or keyframes[-1] != i):
+            keyframes.append(i)
+
     def _set_camera_properties(self) -> None:
         def _set_rgb_props(rgb_cam: VisionSensor,
                            rgb: bool, depth: bool, conf: CameraConfig):
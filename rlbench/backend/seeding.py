@@ -0,0 +1,60 @@
+"""Seeds derived per episode, so that any episode can be collected again.
+
+A dataset is generated from one base seed. Every (task, variation, episode)
+gets its own 64-bit seed, derived from the base seed by hashing, so the
+seed of an episode does not depend on which process collected it or on
+what that process collected before. Seeding the global numpy and Python
+random number generators with it, which tasks sample their episodes from,
+makes collecting the episode again on any process give the same episode.
+A demo stores the seed it was collected with (8 bytes, rather than the
+2.5 KB of a numpy random state), for reset_to_demo.
+"""
+import hashlib
+import os
+import random
+
+import numpy as np
+
+
+def derive_seed(seed: int, *keys) -> int:
+    """A 64-bit seed derived from a seed and a sequence of keys.
+
+    :param seed: The seed to derive from.
+    :param keys: Strings and ints, e.g. a task name, variation and episode.
+    """
+    data = repr((int(seed),) + tuple(
+        k if isinstance(k, str) else int(k) for k in keys))
+    digest = hashlib.blake2b(data.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def episode_seed(seed: int, task_name: str, variation: int,
+                 episode: int) -> int:
+    """The seed of an episode of a dataset generated with the given seed."""
+    return derive_seed(seed, task_name, variation, episode)
+
+
+def new_seed() -> int:
+    """A fresh 64-bit seed from the operating system."""
+    return int.from_bytes(os.urandom(8), 'little')
+
+
+def draw_seed() -> int:
+    """A 64-bit seed drawn from the global numpy random state.
+
+    Seeding numpy (e.g. with np.random.seed) so makes all of the seeds that
+    are drawn reproducible.
+    """
+    return int(np.random.randint(0, 2 ** 64, dtype=np.uint64))
+
+
+def random_state(seed: int) -> np.random.RandomState:
+    """A local numpy random state, seeded with a 64-bit seed."""
+    return np.random.RandomState(
+        np.random.MT19937(np.random.SeedSequence(seed)))
+
+
+def seed_global(seed: int) -> None:
+    """Seeds the global numpy and Python random number generators."""
+    np.random.set_state(random_state(seed).get_state())
+    random.seed(seed)
@@ -87,33 +87,81 @@ def float_array_to_rgb_image(float_array,
   Returns:
     24-bit RGB PIL Image object representing depth values.
   """
-  # Scale the floating point array.
-  scaled_array = np.floor(float_array * scale_factor + 0.5)
-  # Convert the array to integer type and clip to representable range.
-  min_inttype = 0
-  max_inttype = 2**24 - 1
-  scaled_array = ClipFloatValues(scaled_array, min_inttype, max_inttype)
-  int_array = scaled_array.astype(np.uint32)
-  # Calculate:
-  #   r = (f / 256) / 256  high byte
-  #   g = (f / 256) % 256  middle byte
-  #   b = f % 256          low byte
-  rg = np.divide(int_array, 256)
-  r = np.divide(rg, 256)
-  g = np.mod(rg, 256)
-  image_shape = int_array.shape
-  rgb_array = np.zeros((image_shape[0], image_shape[1], 3), dtype=np.uint8)
-  rgb_array[..., 0] = r
-  rgb_array[..., 1] = g
-  if not drop_blue:
-    # Calculate the blue channel and add it to the array.
-    b = np.mod(int_array, 256)
-    rgb_array[..., 2] = b
+  rgb_array = float_array_to_rgb_array(float_array, scale_factor, drop_blue)
   image_mode = 'RGB'
   image = Image.fromarray(rgb_array, mode=image_mode)
   return image
 
 
+def float_array_to_rgb_array(float_array,
+                             scale_factor=DEFAULT_RGB_SCALE_FACTOR,
+                             drop_blue=False,
+                             out=None):
+  """Encodes floating point values into the bytes of a 24-bit RGB array.
+
+  Gives the same bytes as float_array_to_rgb_image, but without the PIL
+  Image. The bytes are extracted with a little-endian uint32 view rather
+  than with float division and modulo.
+
+  Args:
+    float_array: Input array of floating point depth values in meters.
+    scale_factor: Scale value applied to all float values.
+    drop_blue: Zero out the blue channel.
+    out: Optional (H, W, 3) uint8 array to write the result into.
+
+  Returns:
+    (H, W, 3) uint8 array, R being the high order byte.
+  """
+  # Scale and round in place, keeping the dtype of the input.
+  scaled_array = float_array * scale_factor
+  scaled_array += 0.5
+  np.floor(scaled_array, out=scaled_array)
+  np.clip(scaled_array, 0, 2**24 - 1, out=scaled_array)
+  int_bytes = scaled_array.astype('<u4').view(np.uint8).reshape(
+      scaled_array.shape + (4,))
+  if out is None:
+    out = np.empty(scaled_array.shape + (3,), dtype=np.uint8)
+  out[..., 0] = int_bytes[..., 2]
+  out[..., 1] = int_bytes[..., 1]
+  if drop_blue:
+    out[..., 2] = 0
+  else:
+    out[..., 2] = int_bytes[..., 0]
+  return out
+
+
+def rgb_array_to_float_array(rgb_array,
+                             scale_factor=DEFAULT_RGB_SCALE_FACTOR,
+                             dtype=np.float64,
+                             out=None):
+  """Decodes a 24-bit RGB encoded array back into floating point values.
+
+  The inverse of float_array_to_rgb_array. The bytes are packed into a
+  uint32 view, so the only full size temporary is the integer array.
+
+  Args:
+    rgb_array: (..., H, W, 3) uint8 array, or an RGB PIL Image.
+    scale_factor: Fixed point scale factor.
+    dtype: The floating point type of the result. Ignored if out is given.
+    out: Optional (..., H, W) floating point array to write the result into.
+
+  Returns:
+    (..., H, W) floating point array.
+  """
+  rgb_array = np.asarray(rgb_array)
+  int_array = np.zeros(rgb_array.shape[:-1], dtype='<u4')
+  int_bytes = int_array.view(np.uint8).reshape(rgb_array.shape[:-1] + (4,))
+  int_bytes[..., 2] = rgb_array[..., 0]
+  int_bytes[..., 1] = rgb_array[..., 1]
+  int_bytes[..., 0] = rgb_array[..., 2]
+  if out is None:
+    out = np.empty(int_array.shape, dtype=dtype)
+  # Divide (rather than multiply by the inverse) so float64 results are
+  # identical to image_to_float_array.
+  np.divide(int_array, scale_factor, out=out)
+  return out
+
+
 DEFAULT_GRAY_SCALE_FACTOR = {np.uint8: 100.0,
                              np.uint16: 1000.0,
                              np.int32: DEFAULT_RGB_SCALE_FACTOR}
@@ -196,9 +244,9 @@ def image_to_float_array(image, scale_factor=None):
   assert 2 <= len(image_shape) <= 3
   if channels == 3:
     # RGB image needs to be converted to 24 bit integer.
-    float_array = np.sum(image_array * [65536, 256, 1], axis=2)
     if scale_factor is None:
       scale_factor = DEFAULT_RGB_SCALE_FACTOR
+    return rgb_array_to_float_array(image_array, scale_factor)
   else:
     if scale_factor is None:
       scale_factor = DEFAULT_GRAY_SCALE_FACTOR[image_dtype.type]
@@ -225,3 +273,29 @@ def rgb_handles_to_mask(rgb_coded_handles):
   return (rgb_coded_handles[:, :, 0] +
           rgb_coded_handles[:, :, 1] * 256 +
           rgb_coded_handles[:, :, 2] * 256 * 256)
+
+
+def detect_keyframes(gripper_open, joint_velocities, stopping_delta=0.1):
+  """Finds keyframes from low-dim data, for demos without stored ones.
+
+  A step is a keyframe when the gripper has just opened or closed, when the
+  arm has just come to a stop, or when it is the last step. Scene.get_demo
+  records the keyframes directly, so this is only needed for older data.
+
+  Args:
+    gripper_open: (T,) gripper open amounts.
+    joint_velocities: (T, J) joint velocities.
+    stopping_delta: Velocities with a magnitude below this are stopped.
+
+  Returns:
+    The sorted keyframe indices.
+  """
+  gripper_open = np.asarray(gripper_open)
+  stopped = np.all(np.abs(np.asarray(joint_velocities)) < stopping_delta,
+                   axis=1)
+  keyframes = []
+  for i in range(1, len(gripper_open)):
+    if (gripper_open[i] != gripper_open[i - 1] or
+        (stopped[i] and not stopped[i - 1]) or i == len(gripper_open) - 1):
+      keyframes.append(i)
+  return keyframes
@@ -1,11 +1,16 @@
 import numpy as np
 
+from rlbench.backend import seeding
+
 
 class Demo(object):
 
-    def __init__(self, observations, random_seed=None):
+    def __init__(self, observations, random_seed=None, keyframes=None):
         self._observations = observations
         self.random_seed = random_seed
+        # Indices of the observations that end a waypoint or a gripper
+        # action, as recorded by Scene.get_demo.
+        self.keyframes = keyframes
 
     def __len__(self):
         return len(self._observations)
@@ -13,5 +18,15 @@ class Demo(object):
     def __getitem__(self, i):
         return self._observations[i]
 
+    def __setstate__(self, state):
+        # Demos pickled before keyframes were recorded.
+        state.setdefault('keyframes', None)
+        self.__dict__.update(state)
+
     def restore_state(self):
-        np.random.set_state(self.random_seed)
+        if isinstance(self.random_seed, (int, np.integer)):
+            seeding.seed_global(int(self.random_seed))
+        else:
+            # Demos collected before their seed was recorded, which hold the
+            # whole numpy random state.
+            np.random.set_state(self.random_seed)
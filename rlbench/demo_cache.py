@@ -0,0 +1,256 @@
+"""Node-local cache of decoded demos, shared between processes.
+
+Processes on the same machine (e.g. one trainer per GPU) that load the same
+stored episode with the same observation config decode it only once. The
+first process to ask for a demo decodes it and publishes it into shared
+memory; the others map it and get arrays that point straight into the
+shared pages, so a demo is held in memory once however many processes use
+it.
+
+Each demo is one file in a tmpfs directory (/dev/shm when there is one):
+the demo pickled with protocol 5, with the buffers of its arrays stored
+out-of-band and aligned, so that unpickling from the mapped file copies
+nothing. An index, updated under an exclusive file lock, tracks the size
+and last use of every cached demo, and the least recently used ones are
+evicted to stay within the byte budget. Evicting only unlinks a file, so
+processes that have a demo mapped keep it until they drop it.
+
+While a demo is being decoded the index records the pid of the process
+decoding it, and other processes wait for it. When that process is found
+to be dead, its claim and partial files are removed and the demo is
+decoded again.
+"""
+import errno
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import time
+from typing import Callable
+
+from rlbench import utils
+from rlbench.demo import Demo
+from rlbench.observation_config import ObservationConfig
+
+_ALIGNMENT = 64
+_INDEX = 'index.json'
+_LOCK = 'index.lock'
+_SUFFIX = '.demo'
+
+
+def _default_directory() -> str:
+    root = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(root, 'rlbench_demo_cache')
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class SharedDemoCache(object):
+    """LRU cache of decoded demos in shared memory, under a byte budget.
+
+    Demos are keyed by the real path of the episode (so by dataset root,
+    task, variation and episode) and the settings of the observation config.
+    Demos loaded with stochastic noise are not cached, as every load should
+    draw new noise. Arrays of cached demos are read-only.
+
+    :param max_bytes: The budget for all of the cached demos together.
+        Demos larger than the whole budget are not cached.
+    :param directory: Where the cache lives. Processes share a cache by
+        using the same directory.
+    :param poll_interval: Seconds between checks while another process
+        decodes a demo.
+    """
+
+    def __init__(self, max_bytes: int, directory: str = None,
+                 poll_interval: float = 0.05):
+        self.max_bytes = max_bytes
+        self.directory = directory or _default_directory()
+        self._poll_interval = poll_interval
+        os.makedirs(self.directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, example_path: str, obs_config: ObservationConfig,
+            options: dict = None) -> str:
+        return hashlib.sha1(json.dumps([
+            os.path.realpath(example_path),
+            utils.observation_config_key(obs_config),
+            options or {}], sort_keys=True).encode('utf-8')).hexdigest()
+
+    def load(self, example_path: str, obs_config: ObservationConfig,
+             load_demo: Callable[[], Demo], options: dict = None) -> Demo:
+        """Returns the cached demo, or loads, publishes and returns it.
+
+        :param load_demo: Loads the demo (fully decoded) on a miss.
+        :param options: Other loading options that change the demo, which
+            are made part of the key.
+        """
+        if utils.has_stochastic_noise(obs_config):
+            return load_demo()
+        key = self.key(example_path, obs_config, options)
+        while True:
+            with self._locked_index() as index:
+                if key in index['demos']:
+                    demo = self._attach(key)
+                    if demo is not None:
+                        index['demos'][key]['last_used'] = time.time()
+                        self.hits += 1
+                        return demo
+                    # Removed from under the index, e.g. by hand.
+                    del index['demos'][key]
+                owner = index['loading'].get(key)
+                if owner is None or not _pid_alive(owner):
+                    index['loading'][key] = os.getpid()
+                    break
+            time.sleep(self._poll_interval)
+        self.misses += 1
+        try:
+            demo = load_demo()
+            self._publish(key, demo)
+        finally:
+            with self._locked_index() as index:
+                index['loading'].pop(key, None)
+        # Hand out the shared copy, so it is the only one kept in memory.
+        return self._attach(key) or demo
+
+    def clear(self) -> None:
+        """Removes every cached demo."""
+        with self._locked_index() as index:
+            for key in list(index['demos']):
+                self._remove(key)
+            index['demos'] = {}
+
+    def cleanup(self) -> None:
+        """Removes what processes that died left behind.
+
+        This also happens whenever the index is locked, so it only needs
+        calling to reclaim the space without using the cache.
+        """
+        with self._locked_index():
+            pass
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def _publish(self, key: str, demo: Demo) -> None:
+        buffers = []
+        data = pickle.dumps(demo, protocol=5,
+                            buffer_callback=buffers.append)
+        views = [b.raw() for b in buffers]
+        offset = _align(8 + 8 + 16 * len(views) + len(data))
+        table = []
+        for view in views:
+            table.append((offset, view.nbytes))
+            offset = _align(offset + view.nbytes)
+        size = offset
+        if size > self.max_bytes:
+            return
+        tmp_path = '%s.tmp%d' % (self._path(key), os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(struct.pack('<QQ', len(data), len(views)))
+            for entry in table:
+                f.write(struct.pack('<QQ', *entry))
+            f.write(data)
+            for (start, _), view in zip(table, views):
+                f.seek(start)
+                f.write(view)
+            f.truncate(size)
+        with self._locked_index() as index:
+            self._evict(index, size)
+            os.replace(tmp_path, self._path(key))
+            index['demos'][key] = {'bytes': size, 'last_used': time.time()}
+
+    def _attach(self, key: str):
+        try:
+            with open(self._path(key), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+        view = memoryview(mapped)
+        data_len, num_buffers = struct.unpack_from('<QQ', view, 0)
+        table = [struct.unpack_from('<QQ', view, 16 + 16 * i)
+                 for i in range(num_buffers)]
+        start = 16 + 16 * num_buffers
+        return pickle.loads(
+            view[start:start + data_len],
+            buffers=[view[o:o + n] for o, n in table])
+
+    def _evict(self, index: dict, needed: int) -> None:
+        demos = index['demos']
+        total = sum(d['bytes'] for d in demos.values())
+        for key in sorted(demos, key=lambda k: demos[k]['last_used']):
+            if total + needed <= self.max_bytes:
+                break
+            total -= demos.pop(key)['bytes']
+            self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _locked_index(self):
+        return _LockedIndex(self)
+
+    def _clean_dead(self, index: dict) -> None:
+        for key, pid in list(index['loading'].items()):
+            if not _pid_alive(pid):
+                del index['loading'][key]
+        for name in os.listdir(self.directory):
+            pid = name.rpartition('.tmp')[2]
+            if '.tmp' in name:
+                dead = pid.isdigit() and not _pid_alive(int(pid))
+            else:
+                # Published, but the owner died before indexing it.
+                dead = (name.endswith(_SUFFIX) and
+                        name[:-len(_SUFFIX)] not in index['demos'])
+            if dead:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+class _LockedIndex(object):
+    """Holds the index lock, and writes the index back on exit."""
+
+    def __init__(self, cache: SharedDemoCache):
+        self._cache = cache
+
+    def __enter__(self) -> dict:
+        directory = self._cache.directory
+        self._lock = open(os.path.join(directory, _LOCK), 'a')
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        try:
+            with open(os.path.join(directory, _INDEX), 'r') as f:
+                self._index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._index = {'demos': {}, 'loading': {}}
+        self._cache._clean_dead(self._index)
+        return self._index
+
+    def __exit__(self, *args):
+        try:
+            path = os.path.join(self._cache.directory, _INDEX)
+            tmp_path = '%s.tmp%d' % (path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(self._index, f)
+            os.replace(tmp_path, path)
+        finally:
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+            self._lock.close()
@@ -0,0 +1,262 @@
+"""Streaming access to stored demos across many tasks and variations."""
+import collections
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+from typing import Iterator, List, Tuple, Type, Union
+
+import numpy as np
+
+from rlbench import utils
+from rlbench.backend.const import VARIATIONS_FOLDER, EPISODES_FOLDER
+from rlbench.backend.manifest import _episode_number
+from rlbench.backend.task import Task
+from rlbench.demo import Demo
+from rlbench.observation_config import ObservationConfig
+
+StreamItem = Tuple[str, int, int, Demo]
+
+
+def task_name(task: Union[str, Type[Task]]) -> str:
+    """The dataset folder name of a task, given its name or its class."""
+    if isinstance(task, str):
+        return task
+    # Same conversion as Task.__init__.
+    return re.sub('(?<!^)(?=[A-Z])', '_', task.__name__).lower()
+
+
+def list_episodes(dataset_root: str,
+                  tasks: List[Union[str, Type[Task]]],
+                  variations: List[int] = None,
+                  shuffle: bool = False,
+                  seed: int = None,
+                  shard_index: int = 0,
+                  num_shards: int = 1) -> List[Tuple[str, int, int, str]]:
+    """Lists the stored episodes of a set of tasks, without loading them.
+
+    Without shuffling the order is deterministic: tasks in the given order,
+    then variations and episodes in ascending order. Sharding is applied
+    before shuffling, and each shard is shuffled on its own, so the shards
+    of different workers are disjoint whatever their seeds.
+
+    :return: (task name, variation, episode number, episode path) tuples.
+    """
+    return [item[:4] for item in _list_episodes(
+        dataset_root, tasks, variations, shuffle, seed, shard_index,
+        num_shards)]
+
+
+def _list_episodes(dataset_root, tasks, variations, shuffle, seed,
+                   shard_index, num_shards):
+    if not 0 <= shard_index < num_shards:
+        raise ValueError('Shard index %d is not in [0, %d).' % (
+            shard_index, num_shards))
+    items = []
+    for task in tasks:
+        name = task_name(task)
+        task_variations = utils.list_stored_variations(dataset_root, name)
+        if variations is not None:
+            task_variations = [v for v in task_variations if v in variations]
+        for variation in task_variations:
+            episodes_path = join(dataset_root, name,
+                                 VARIATIONS_FOLDER % variation,
+                                 EPISODES_FOLDER)
+            for example, entry in utils.list_stored_episodes(
+                    dataset_root, name, variation):
+                items.append((name, variation, _episode_number(example),
+                              join(episodes_path, example), entry))
+    items = items[shard_index::num_shards]
+    if shuffle:
+        order = np.random.RandomState(seed).permutation(len(items))
+        items = [items[i] for i in order]
+    return items
+
+
+def iter_stored_demos(dataset_root: str,
+                      obs_config: ObservationConfig,
+                      tasks: List[Union[str, Type[Task]]],
+                      variations: List[int] = None,
+                      shuffle: bool = False,
+                      seed: int = None,
+                      shard_index: int = 0,
+                      num_shards: int = 1,
+                      read_ahead: int = 2,
+                      **load_kwargs) -> Iterator[StreamItem]:
+    """Streams (task name, variation, episode number, demo) tuples.
+
+    Demos are loaded one at a time by a background thread that stays at most
+    read_ahead demos ahead of the consumer, so memory use does not depend on
+    the size of the dataset.
+
+    :param dataset_root: The root of the stored dataset.
+    :param obs_config: The observation config to load the demos with.
+    :param tasks: Task names or task classes, e.g. FS50_V1['train'].
+    :param variations: The variations to load. None for all stored ones.
+    :param shuffle: Shuffle the episodes across tasks and variations.
+    :param seed: Seed for the shuffle.
+    :param shard_index: Which shard this worker loads.
+    :param num_shards: The number of workers the episodes are split across.
+    :param read_ahead: The number of demos loaded ahead of the consumer. 0
+        loads the demos in the calling thread.
+    :param load_kwargs: Passed on to utils.load_stored_demo, e.g. lazy=True.
+    """
+    items = _list_episodes(dataset_root, tasks, variations, shuffle, seed,
+                           shard_index, num_shards)
+
+    def load(item):
+        name, variation, episode, path, entry = item
+        return name, variation, episode, utils.load_stored_demo(
+            path, obs_config, entry=entry, **load_kwargs)
+
+    if read_ahead <= 0:
+        for item in items:
+            yield load(item)
+        return
+
+    buffer = queue.Queue(maxsize=read_ahead)
+    stop = threading.Event()
+
+    def put(value):
+        # Gives up once the consumer has gone away.
+        while not stop.is_set():
+            try:
+                buffer.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((True, load(item))):
+                    return
+        except Exception as e:
+            put((False, e))
+            return
+        put((False, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, value = buffer.get()
+            if not ok:
+                if value is not None:
+                    raise value
+                break
+            yield value
+    finally:
+        stop.set()
+        thread.join()
+
+
+class PrefetchDemoLoader(object):
+    """Loads the stored demos of a task variation ahead of the consumer.
+
+    Episodes are selected as get_stored_demos selects them, and are loaded
+    by num_workers background threads so that loading overlaps with
+    whatever the consumer does in between. At most prefetch demos (or
+    batches) are loaded ahead. Iterating yields demos, or lists of
+    batch_size demos, in selection order. An exception raised while loading
+    is raised to the consumer when it reaches that demo.
+
+    Use as a context manager, or call close(), to stop the workers early.
+
+    :param amount: The number of demos per pass. -1 for all.
+    :param batch_size: Yield lists of this many demos. The last batch of a
+        pass can be smaller. None yields single demos.
+    :param prefetch: The number of demos (or batches) loaded ahead.
+    :param num_workers: The number of loading threads.
+    :param repeat: Select and load the demos again after every pass,
+        without end.
+    :param seed: Seed for the random selection. None uses the global numpy
+        random state, as get_stored_demos does.
+    :param load_kwargs: Passed on to utils.load_stored_demo, e.g.
+        keyframes_only=True.
+    """
+
+    def __init__(self, dataset_root: str, task_name: str,
+                 variation_number: int, obs_config: ObservationConfig,
+                 amount: int = -1,
+                 random_selection: bool = True,
+                 from_episode_number: int = 0,
+                 batch_size: int = None,
+                 prefetch: int = 2,
+                 num_workers: int = 1,
+                 repeat: bool = False,
+                 seed: int = None,
+                 **load_kwargs):
+        if prefetch < 1 or num_workers < 1:
+            raise ValueError('prefetch and num_workers must be at least 1.')
+        random_state = None if seed is None else np.random.RandomState(seed)
+        self._select = lambda: utils.select_stored_episodes(
+            dataset_root, task_name, variation_number, amount,
+            random_selection, from_episode_number, random_state)
+        self._obs_config = obs_config
+        self._load_kwargs = load_kwargs
+        self._batch_size = batch_size
+        self._repeat = repeat
+        self._max_pending = prefetch * (batch_size or 1)
+        self._pass = collections.deque(self._select())
+        self._pending = collections.deque()
+        self._executor = ThreadPoolExecutor(num_workers)
+        self._closed = False
+        self._fill()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed or len(self._pending) == 0:
+            raise StopIteration
+        if self._batch_size is None:
+            return self._next_demo()[1]
+        batch = []
+        while len(batch) < self._batch_size and len(self._pending) > 0:
+            end_of_pass, demo = self._next_demo()
+            batch.append(demo)
+            if end_of_pass:
+                break
+        return batch
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        """Stops loading, waiting for the demos being loaded to finish."""
+        if self._closed:
+            return
+        self._closed = True
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+    def _next_demo(self) -> Tuple[bool, Demo]:
+        end_of_pass, future = self._pending.popleft()
+        try:
+            demo = future.result()
+        except BaseException:
+            self.close()
+            raise
+        self._fill()
+        return end_of_pass, demo
+
+    def _fill(self) -> None:
+        while len(self._pending) < self._max_pending:
+            if len(self._pass) == 0:
+                if not self._repeat:
+                    return
+                self._pass.extend(self._select())
+                if len(self._pass) == 0:
+                    return
+            example_path, entry = self._pass.popleft()
+            self._pending.append((len(self._pass) == 0, self._executor.submit(
+                utils.load_stored_demo, example_path, self._obs_config,
+                entry=entry, **self._load_kwargs)))
@@ -1,11 +1,12 @@
 import importlib
 from os.path import exists, dirname, abspath, join
-from typing import Type, List
+from typing import Type, List, Iterator, Union
 
 from pyrep import PyRep
 from pyrep.objects import VisionSensor
 from pyrep.robots.arms.panda import Panda
 
+from rlbench import demo_loader
 from rlbench import utils
 from rlbench.action_modes.action_mode import ActionMode
 from rlbench.backend.const import *
@@ -14,6 +15,7 @@ from rlbench.backend.scene import Scene
 from rlbench.backend.task import Task
 from rlbench.const import SUPPORTED_ROBOTS
 from rlbench.demo import Demo
+from rlbench.demo_cache import SharedDemoCache
 from rlbench.observation_config import ObservationConfig
 from rlbench.sim2real.domain_randomization import RandomizeEvery, \
     VisualRandomizationConfig, DynamicsRandomizationConfig
@@ -152,15 +154,58 @@ class Environment(object):
                   variation_number=0,
                   image_paths=False,
                   random_selection: bool = True,
-                  from_episode_number: int = 0) -> List[Demo]:
+                  from_episode_number: int = 0,
+                  memory_map: bool = False,
+                  lazy: bool = False,
+                  decode_pool: utils.DecodePool = None,
+                  point_cloud_cache: utils.PointCloudCache = None,
+                  keyframes_only: bool = False,
+                  demo_cache: Union[utils.DemoCache, SharedDemoCache] = None,
+                  verify: Union[bool, str] = False
+                  ) -> List[Demo]:
         if self._dataset_root is None or len(self._dataset_root) == 0:
             raise RuntimeError(
                 "Can't ask for a stored demo when no dataset root provided.")
         demos = utils.get_stored_demos(
             amount, image_paths, self._dataset_root, variation_number,
-            task_name, self._obs_config, random_selection, from_episode_number)
+            task_name, self._obs_config, random_selection, from_episode_number,
+            memory_map, lazy, decode_pool, point_cloud_cache, keyframes_only,
+            demo_cache, verify)
         return demos
 
+    def iter_demos(self, tasks: List[Union[str, Type[Task]]],
+                   variations: List[int] = None,
+                   shuffle: bool = False,
+                   seed: int = None,
+                   shard_index: int = 0,
+                   num_shards: int = 1,
+                   read_ahead: int = 2,
+                   **load_kwargs) -> Iterator[demo_loader.StreamItem]:
+        """Streams stored demos across tasks and variations.
+
+        See demo_loader.iter_stored_demos for the options.
+        """
+        if self._dataset_root is None or len(self._dataset_root) == 0:
+            raise RuntimeError(
+                "Can't ask for a stored demo when no dataset root provided.")
+        return demo_loader.iter_stored_demos(
+            self._dataset_root, self._obs_config, tasks, variations, shuffle,
+            seed, shard_index, num_shards, read_ahead, **load_kwargs)
+
+    def prefetch_demos(self, task_name: str, amount: int = -1,
+                       variation_number: int = 0,
+                       **kwargs) -> demo_loader.PrefetchDemoLoader:
+        """Loads stored demos in the background, ahead of the consumer.
+
+        See demo_loader.PrefetchDemoLoader for the options.
+        """
+        if self._dataset_root is None or len(self._dataset_root) == 0:
+            raise RuntimeError(
+                "Can't ask for a stored demo when no dataset root provided.")
+        return demo_loader.PrefetchDemoLoader(
+            self._dataset_root, task_name, variation_number, self._obs_config,
+            amount, **kwargs)
+
     def get_scene_data(self) -> dict:
         """Get the data of various scene/camera information.
 
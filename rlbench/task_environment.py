@@ -1,11 +1,12 @@
 import logging
-from typing import List, Callable
+from typing import List, Callable, Union
 
 import numpy as np
 from pyrep import PyRep
 from pyrep.const import ObjectType
 from rlbench import utils
 from rlbench.action_modes.action_mode import ActionMode
+from rlbench.backend import seeding
 from rlbench.backend.exceptions import BoundaryError, WaypointError, \
     TaskEnvironmentError
 from rlbench.backend.observation import Observation
@@ -13,6 +14,7 @@ from rlbench.backend.robot import Robot
 from rlbench.backend.scene import Scene
 from rlbench.backend.task import Task
 from rlbench.demo import Demo
+from rlbench.demo_cache import SharedDemoCache
 from rlbench.observation_config import ObservationConfig
 
 _DT = 0.05
@@ -112,9 +114,22 @@ class TaskEnvironment(object):
                   callable_each_step: Callable[[Observation], None] = None,
                   max_attempts: int = _MAX_DEMO_ATTEMPTS,
                   random_selection: bool = True,
-                  from_episode_number: int = 0
+                  from_episode_number: int = 0,
+                  memory_map: bool = False,
+                  lazy: bool = False,
+                  decode_pool: utils.DecodePool = None,
+                  point_cloud_cache: utils.PointCloudCache = None,
+                  keyframes_only: bool = False,
+                  demo_cache: Union[utils.DemoCache, SharedDemoCache] = None,
+                  verify: Union[bool, str] = False,
+                  seed: int = None
                   ) -> List[Demo]:
-        """Negative means all demos"""
+        """Negative means all demos.
+
+        Live demos are collected with 64-bit seeds derived from seed (by
+        default, drawn from the numpy random state), which they keep as
+        their random_seed.
+        """
 
         if not live_demos and (self._dataset_root is None
                                or len(self._dataset_root) == 0):
@@ -128,24 +143,32 @@ class TaskEnvironment(object):
             demos = utils.get_stored_demos(
                 amount, image_paths, self._dataset_root, self._variation_number,
                 self._task.get_name(), self._obs_config,
-                random_selection, from_episode_number)
+                random_selection, from_episode_number, memory_map, lazy,
+                decode_pool, point_cloud_cache, keyframes_only, demo_cache,
+                verify)
         else:
             ctr_loop = self._robot.arm.joints[0].is_control_loop_enabled()
             self._robot.arm.set_control_loop_enabled(True)
             demos = self._get_live_demos(
-                amount, callable_each_step, max_attempts)
+                amount, callable_each_step, max_attempts, seed)
             self._robot.arm.set_control_loop_enabled(ctr_loop)
         return demos
 
     def _get_live_demos(self, amount: int,
                         callable_each_step: Callable[
                             [Observation], None] = None,
-                        max_attempts: int = _MAX_DEMO_ATTEMPTS) -> List[Demo]:
+                        max_attempts: int = _MAX_DEMO_ATTEMPTS,
+                        seed: int = None) -> List[Demo]:
         demos = []
         for i in range(amount):
             attempts = max_attempts
             while attempts > 0:
-                random_seed = np.random.get_state()
+                if seed is None:
+                    random_seed = seeding.draw_seed()
+                else:
+                    random_seed = seeding.derive_seed(
+                        seed, i, max_attempts - attempts)
+                seeding.seed_global(random_seed)
                 self.reset()
                 try:
                     demo = self._scene.get_demo(
@@ -0,0 +1,135 @@
+"""Random access to single transitions across a stored dataset.
+
+A TransitionIndex numbers every step of every stored episode with a global
+transition id, using only the manifests (and the episode file headers of
+variations without one). TransitionSampler then loads batches of single
+steps, reading only the bytes of the steps it returns, so the cost of a
+batch does not depend on how large the dataset is.
+"""
+from collections import OrderedDict
+from typing import List, NamedTuple, Tuple, Type, Union
+
+import numpy as np
+
+from rlbench import demo_loader
+from rlbench.backend.observation import Observation
+from rlbench.backend.task import Task
+from rlbench.observation_config import ObservationConfig
+from rlbench.utils import StoredEpisode
+
+
+class TransitionBatch(NamedTuple):
+    ids: np.ndarray
+    observations: List[Observation]
+    # Only set when next observations were asked for. The next observation
+    # of the last step of an episode is that step again, with terminal set.
+    next_observations: List[Observation] = None
+    terminals: np.ndarray = None
+
+
+class TransitionIndex(object):
+    """Maps global transition ids to (task, variation, episode, step).
+
+    Lookups are O(1): the episode of every transition is held in a flat
+    array, next to the global id of the first step of every episode.
+    """
+
+    def __init__(self, dataset_root: str,
+                 tasks: List[Union[str, Type[Task]]],
+                 variations: List[int] = None):
+        items = demo_loader._list_episodes(
+            dataset_root, tasks, variations, False, None, 0, 1)
+        self.tasks = [name for name, _, _, _, _ in items]
+        self.variations = np.array([v for _, v, _, _, _ in items],
+                                   dtype=np.int32)
+        self.episodes = np.array([e for _, _, e, _, _ in items],
+                                 dtype=np.int32)
+        self.paths = [path for _, _, _, path, _ in items]
+        self.entries = [entry for _, _, _, _, entry in items]
+        num_steps = np.array([
+            entry['num_steps'] if entry is not None else
+            len(StoredEpisode(path)) for _, _, _, path, entry in items],
+            dtype=np.int64)
+        self.episode_starts = np.concatenate([[0], np.cumsum(num_steps)])
+        self._episode_of = np.repeat(
+            np.arange(len(items), dtype=np.int32), num_steps)
+
+    def __len__(self):
+        return len(self._episode_of)
+
+    @property
+    def num_episodes(self) -> int:
+        return len(self.paths)
+
+    def locate(self, ids) -> Tuple[np.ndarray, np.ndarray]:
+        """The episode indices and steps of an array of transition ids."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if np.any((ids < 0) | (ids >= len(self))):
+            raise IndexError('Transition ids must be in [0, %d).' % len(self))
+        episodes = self._episode_of[ids]
+        return episodes, ids - self.episode_starts[episodes]
+
+    def transition(self, i: int) -> Tuple[str, int, int, int]:
+        """The (task name, variation, episode number, step) of an id."""
+        episodes, steps = self.locate([i])
+        e = episodes[0]
+        return (self.tasks[e], int(self.variations[e]),
+                int(self.episodes[e]), int(steps[0]))
+
+    def is_last(self, ids) -> np.ndarray:
+        """Whether each transition is the last step of its episode."""
+        episodes, _ = self.locate(ids)
+        return np.asarray(ids) + 1 == self.episode_starts[episodes + 1]
+
+
+class TransitionSampler(object):
+    """Samples batches of single observations from a TransitionIndex.
+
+    The episodes that are read are kept open (memory mapped where they are
+    stored as episode files), up to max_open_episodes of them.
+    """
+
+    def __init__(self, index: TransitionIndex,
+                 obs_config: ObservationConfig,
+                 seed: int = None,
+                 max_open_episodes: int = 64):
+        self.index = index
+        self._obs_config = obs_config
+        self._random = np.random.RandomState(seed)
+        self._max_open_episodes = max_open_episodes
+        self._open = OrderedDict()
+
+    def sample(self, batch_size: int,
+               next_observations: bool = False) -> TransitionBatch:
+        """Loads a batch of uniformly sampled transitions."""
+        if len(self.index) == 0:
+            raise RuntimeError('There are no stored transitions to sample.')
+        ids = self._random.randint(0, len(self.index), size=batch_size)
+        return self.get(ids, next_observations)
+
+    def get(self, ids, next_observations: bool = False) -> TransitionBatch:
+        """Loads the transitions with the given ids."""
+        ids = np.asarray(ids, dtype=np.int64)
+        episodes, steps = self.index.locate(ids)
+        observations = [self._observation(e, s)
+                        for e, s in zip(episodes, steps)]
+        if not next_observations:
+            return TransitionBatch(ids, observations)
+        terminals = self.index.is_last(ids)
+        next_obs = [observations[j] if terminal
+                    else self._observation(episodes[j], steps[j] + 1)
+                    for j, terminal in enumerate(terminals)]
+        return TransitionBatch(ids, observations, next_obs, terminals)
+
+    def _observation(self, e: int, step: int) -> Observation:
+        return self._episode(e).observation(int(step), self._obs_config)
+
+    def _episode(self, e: int) -> StoredEpisode:
+        if e in self._open:
+            self._open.move_to_end(e)
+            return self._open[e]
+        episode = StoredEpisode(self.index.paths[e], self.index.entries[e])
+        self._open[e] = episode
+        if len(self._open) > self._max_open_episodes:
+            self._open.popitem(last=False)
+        return episode
@@ -1,18 +1,39 @@
+import collections
+import copy
+import hashlib
 import importlib
+import json
+import logging
+import os
 import pickle
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from os import listdir
 from os.path import join, exists
-from typing import List
+from typing import Dict, List, Tuple, Union
 
 import numpy as np
 from PIL import Image
 from natsort import natsorted
 from pyrep.objects import VisionSensor
 
+from rlbench.backend import dataset_stats
+from rlbench.backend import manifest
 from rlbench.backend.const import *
-from rlbench.backend.utils import image_to_float_array, rgb_handles_to_mask
+from rlbench.backend.episode_file import EpisodeFile, EpisodeFileError, \
+    keyframes_from_episode_file, observation_from_episode_file, \
+    observations_from_episode_file, random_state_from_episode_file, \
+    write_episode_file
+from rlbench.backend.observation import Observation, LazyObservation
+from rlbench.backend.utils import detect_keyframes, \
+    rgb_array_to_float_array, rgb_handles_to_mask
 from rlbench.demo import Demo
-from rlbench.observation_config import ObservationConfig
+from rlbench.noise_model import Identity, NoiseModel
+from rlbench.observation_config import ObservationConfig, CameraConfig
+
+
+_EPISODE_NAME = re.compile('^%s$' % EPISODE_FOLDER.replace('%d', r'\d+'))
 
 
 class InvalidTaskName(Exception):
@@ -42,8 +63,68 @@ def get_stored_demos(amount: int, image_paths: bool, dataset_root: str,
                      variation_number: int, task_name: str,
                      obs_config: ObservationConfig,
                      random_selection: bool = True,
-                     from_episode_number: int = 0) -> List[Demo]:
+                     from_episode_number: int = 0,
+                     memory_map: bool = False,
+                     lazy: bool = False,
+                     decode_pool: 'DecodePool' = None,
+                     point_cloud_cache: 'PointCloudCache' = None,
+                     keyframes_only: bool = False,
+                     demo_cache: 'DemoCache' = None,
+                     verify: Union[bool, str] = False
+                     ) -> List[Demo]:
+    """Loads stored demos of a task variation from the dataset.
+
+    :param memory_map: For episodes stored as a single episode file, map the
+        file rather than reading it. Observations are then only decoded when
+        indexed, and RGB images (when no resize is needed) and low-dim data
+        are read-only views into the mapped file.
+    :param lazy: Only load the low-dimensional data up front. Each image
+        field (and its point cloud) is decoded the first time it is accessed,
+        and then cached on the observation.
+    :param decode_pool: A DecodePool used to decode the images of each demo
+        in parallel. Ignored for lazy and memory-mapped loading.
+    :param point_cloud_cache: A PointCloudCache to read the point clouds
+        from, rather than reprojecting the stored depth on every load.
+    :param keyframes_only: Only load (and decode) the keyframe observations
+        of each demo, in order. memory_map, lazy, decode_pool and
+        point_cloud_cache are not used, as only those steps are read.
+    :param demo_cache: A DemoCache, to keep decoded demos for repeated
+        calls, or a demo_cache.SharedDemoCache that processes on the same
+        machine share decoded demos through. Cached demos are fully decoded,
+        so memory_map and lazy are not used on a miss.
+    :param verify: Check that each episode was completely written and skip,
+        with a warning, those that were not, rather than failing while
+        loading them. 'sizes' (or True) checks the file sizes in the footer
+        of each episode, 'checksums' also checks the checksums of its files.
+    """
 
+    # Process these examples (e.g. loading observations)
+    demos = []
+    for example_path, entry in select_stored_episodes(
+            dataset_root, task_name, variation_number, amount,
+            random_selection, from_episode_number, verify=verify):
+        demos.append(load_stored_demo(
+            example_path, obs_config, image_paths, memory_map, lazy,
+            decode_pool, entry, point_cloud_cache, keyframes_only,
+            demo_cache))
+    return demos
+
+
+def select_stored_episodes(dataset_root: str, task_name: str,
+                           variation_number: int, amount: int,
+                           random_selection: bool = True,
+                           from_episode_number: int = 0,
+                           random_state: np.random.RandomState = None,
+                           verify: Union[bool, str] = False
+                           ) -> List[Tuple[str, dict]]:
+    """Selects stored episodes the way get_stored_demos does.
+
+    :param random_state: Used for the random selection instead of the
+        global numpy random state.
+    :param verify: Only select from the episodes that pass the
+        manifest.verify_episode check, as for list_stored_episodes.
+    :return: (episode path, manifest entry or None) pairs.
+    """
     task_root = join(dataset_root, task_name)
     if not exists(task_root):
         raise RuntimeError("Can't find the demos for %s at: %s" % (
@@ -51,9 +132,11 @@ def get_stored_demos(amount: int, image_paths: bool, dataset_root: str,
 
     # Sample an amount of examples for the variation of this task
     examples_path = join(
-        task_root, VARIATIONS_FOLDER % variation_number,
-        EPISODES_FOLDER)
-    examples = listdir(examples_path)
+        task_root, VARIATIONS_FOLDER % variation_number, EPISODES_FOLDER)
+    listed = list_stored_episodes(dataset_root, task_name, variation_number,
+                                  verify)
+    entries = {example: entry for example, entry in listed}
+    examples = [example for example, _ in listed]
     if amount == -1:
         amount = len(examples)
     if amount > len(examples):
@@ -61,257 +144,1072 @@ def get_stored_demos(amount: int, image_paths: bool, dataset_root: str,
             'You asked for %d examples, but only %d were available.' % (
                 amount, len(examples)))
     if random_selection:
-        selected_examples = np.random.choice(examples, amount, replace=False)
+        rng = np.random if random_state is None else random_state
+        selected_examples = rng.choice(examples, amount, replace=False)
     else:
-        selected_examples = natsorted(
-            examples)[from_episode_number:from_episode_number+amount]
+        selected_examples = examples[
+            from_episode_number:from_episode_number+amount]
+    return [(join(examples_path, example), entries[example])
+            for example in selected_examples]
 
-    # Process these examples (e.g. loading observations)
-    demos = []
-    for example in selected_examples:
-        example_path = join(examples_path, example)
+
+def list_stored_episodes(dataset_root: str, task_name: str,
+                         variation_number: int,
+                         verify: Union[bool, str] = False
+                         ) -> List[Tuple[str, dict]]:
+    """Lists the stored episodes of a task variation, in episode order.
+
+    :param verify: Leave out, with a warning, the episodes that fail the
+        manifest.verify_episode check. 'sizes' (or True) only checks the
+        file sizes in their footers, 'checksums' also reads their files to
+        check their checksums.
+    :return: (episode folder name, manifest entry) pairs. The entries are
+        None when the variation has no manifest, in which case the episodes
+        folder is listed instead.
+    """
+    if verify not in [False, True, 'sizes', 'checksums']:
+        raise ValueError("verify must be False, 'sizes' or 'checksums', not "
+                         "%r." % (verify,))
+    variation_path = join(
+        dataset_root, task_name, VARIATIONS_FOLDER % variation_number)
+    variation_manifest = manifest.read_manifest(variation_path)
+    if variation_manifest is not None:
+        # The manifest lists the episodes in order, so there is no need to
+        # list (or sort) the episodes folder.
+        listed = [(e['id'], e) for e in variation_manifest['episodes']]
+    else:
+        # Episodes still being written are in temporary folders.
+        listed = [(example, None) for example in natsorted(
+            listdir(join(variation_path, EPISODES_FOLDER)))
+            if _EPISODE_NAME.match(example)]
+    if not verify:
+        return listed
+    verified = []
+    for example, entry in listed:
+        problem = manifest.verify_episode(
+            join(variation_path, EPISODES_FOLDER, example),
+            checksums=verify == 'checksums')
+        if problem is not None:
+            logging.warning('Skipping episode: %s', problem)
+        else:
+            verified.append((example, entry))
+    return verified
+
+
+def list_stored_variations(dataset_root: str, task_name: str) -> List[int]:
+    """Lists the variation numbers stored for a task, in ascending order."""
+    task_root = join(dataset_root, task_name)
+    if not exists(task_root):
+        raise RuntimeError("Can't find the demos for %s at: %s" % (
+            task_name, task_root))
+    prefix = VARIATIONS_FOLDER.replace('%d', '')
+    return sorted(int(v[len(prefix):]) for v in listdir(task_root)
+                  if v.startswith(prefix) and v[len(prefix):].isdigit())
+
+
+def get_stored_stats(dataset_root: str, task_name: str,
+                     variation_number: int = None
+                     ) -> Dict[str, dataset_stats.RunningStats]:
+    """Loads the normalisation statistics gathered when writing a dataset.
+
+    Reads only the manifests; no episode data is touched.
+
+    :param variation_number: The variation to get the statistics of. None
+        merges those of every stored variation of the task.
+    :return: Name (a low-dim field, or e.g. 'front_depth' and
+        'front_depth_m' for depth as stored and in meters) to its stats.
+    """
+    variations = (list_stored_variations(dataset_root, task_name)
+                  if variation_number is None else [variation_number])
+    stats = []
+    for variation in variations:
+        variation_path = join(dataset_root, task_name,
+                              VARIATIONS_FOLDER % variation)
+        variation_manifest = manifest.read_manifest(variation_path)
+        if variation_manifest is None or 'stats' not in variation_manifest:
+            raise RuntimeError(
+                'No statistics were stored for the episodes at: %s. '
+                'Regenerate or convert the variation to gather them.'
+                % variation_path)
+        stats.append(dataset_stats.stats_from_dict(
+            variation_manifest['stats']))
+    return dataset_stats.merge_stats(stats)
+
+
+def load_stored_demo(example_path: str, obs_config: ObservationConfig,
+                     image_paths: bool = False, memory_map: bool = False,
+                     lazy: bool = False, decode_pool: 'DecodePool' = None,
+                     entry: dict = None,
+                     point_cloud_cache: 'PointCloudCache' = None,
+                     keyframes_only: bool = False,
+                     demo_cache: 'DemoCache' = None) -> Demo:
+    """Loads a single stored episode. See get_stored_demos for the options.
+
+    :param example_path: The episode folder.
+    :param entry: The manifest entry of the episode, if there is one.
+    """
+    if demo_cache is not None and not image_paths:
+        return demo_cache.load(
+            example_path, obs_config,
+            lambda: load_stored_demo(
+                example_path, obs_config, False, False, False, decode_pool,
+                entry, point_cloud_cache, keyframes_only),
+            {'keyframes_only': keyframes_only})
+    if keyframes_only:
+        if image_paths:
+            raise RuntimeError('Image paths are not available when only '
+                               'loading the keyframes.')
+        episode = StoredEpisode(example_path, entry)
+        keyframes = episode.keyframes
+        return Demo([episode.observation(i, obs_config) for i in keyframes],
+                    random_seed=episode.random_seed,
+                    keyframes=list(range(len(keyframes))))
+    if entry is not None:
+        _check_manifest_entry(entry, example_path, obs_config)
+    if point_cloud_cache is not None and not image_paths:
+        return point_cloud_cache.load(
+            example_path, obs_config, entry, memory_map or lazy,
+            lambda config: load_stored_demo(
+                example_path, config, False, memory_map, lazy, decode_pool,
+                entry))
+    if _is_episode_file(example_path, entry):
+        return _load_episode_file_demo(
+            example_path, image_paths, obs_config, memory_map, lazy,
+            decode_pool, entry)
+    return _load_png_demo(
+        example_path, image_paths, obs_config, lazy, decode_pool, entry)
+
+
+def get_stored_low_dim_demos(dataset_root: str, task_name: str,
+                             variation_number: int,
+                             obs_config: ObservationConfig = None
+                             ) -> List[Demo]:
+    """Loads the low-dimensional data of every stored episode of a variation.
+
+    No images are loaded; all image fields are None. Episodes with a low-dim
+    file are read with a single read each and without unpickling, and
+    episodes stored as an episode file only read their low-dim columns.
+
+    :param obs_config: If given, low-dim fields it does not ask for are
+        removed, as in get_stored_demos.
+    :return: The demos, in episode order.
+    """
+    examples_path = join(dataset_root, task_name,
+                         VARIATIONS_FOLDER % variation_number,
+                         EPISODES_FOLDER)
+    return [load_stored_low_dim_demo(join(examples_path, example),
+                                     obs_config, entry)
+            for example, entry in list_stored_episodes(
+                dataset_root, task_name, variation_number)]
+
+
+def load_stored_low_dim_demo(example_path: str,
+                             obs_config: ObservationConfig = None,
+                             entry: dict = None) -> Demo:
+    """Loads the low-dimensional data of a single stored episode."""
+    if exists(join(example_path, LOW_DIM_FILE)):
+        episode = EpisodeFile(join(example_path, LOW_DIM_FILE), preload=True)
+    elif _is_episode_file(example_path, entry):
+        episode = EpisodeFile(join(example_path, EPISODE_FILE))
+    else:
+        episode = None
+    if episode is not None:
+        demo = Demo(observations_from_episode_file(episode),
+                    random_state_from_episode_file(episode),
+                    keyframes_from_episode_file(episode))
+    else:
         with open(join(example_path, LOW_DIM_PICKLE), 'rb') as f:
-            obs = pickle.load(f)
-
-        l_sh_rgb_f = join(example_path, LEFT_SHOULDER_RGB_FOLDER)
-        l_sh_depth_f = join(example_path, LEFT_SHOULDER_DEPTH_FOLDER)
-        l_sh_mask_f = join(example_path, LEFT_SHOULDER_MASK_FOLDER)
-        r_sh_rgb_f = join(example_path, RIGHT_SHOULDER_RGB_FOLDER)
-        r_sh_depth_f = join(example_path, RIGHT_SHOULDER_DEPTH_FOLDER)
-        r_sh_mask_f = join(example_path, RIGHT_SHOULDER_MASK_FOLDER)
-        oh_rgb_f = join(example_path, OVERHEAD_RGB_FOLDER)
-        oh_depth_f = join(example_path, OVERHEAD_DEPTH_FOLDER)
-        oh_mask_f = join(example_path, OVERHEAD_MASK_FOLDER)
-        wrist_rgb_f = join(example_path, WRIST_RGB_FOLDER)
-        wrist_depth_f = join(example_path, WRIST_DEPTH_FOLDER)
-        wrist_mask_f = join(example_path, WRIST_MASK_FOLDER)
-        front_rgb_f = join(example_path, FRONT_RGB_FOLDER)
-        front_depth_f = join(example_path, FRONT_DEPTH_FOLDER)
-        front_mask_f = join(example_path, FRONT_MASK_FOLDER)
-
-        num_steps = len(obs)
-
-        if not (num_steps == len(listdir(l_sh_rgb_f)) == len(
-                listdir(l_sh_depth_f)) == len(listdir(r_sh_rgb_f)) == len(
-                listdir(r_sh_depth_f)) == len(listdir(oh_rgb_f)) == len(
-                listdir(oh_depth_f)) == len(listdir(wrist_rgb_f)) == len(
-                listdir(wrist_depth_f)) == len(listdir(front_rgb_f)) == len(
-                listdir(front_depth_f))):
-            raise RuntimeError('Broken dataset assumption')
+            demo = pickle.load(f)
+    if entry is not None:
+        _check_num_steps(len(demo), entry)
+    if obs_config is not None:
+        for ob in demo:
+            _remove_unused_low_dim(ob, obs_config)
+    return demo
+
+
+class StoredEpisode(object):
+    """Random access to the single steps of a stored episode.
+
+    Episode files (and the low-dim file of png episodes) are memory mapped,
+    so reading a step only touches the bytes of that step. Episodes with
+    only a low-dim pickle have it loaded once, when they are opened.
+    """
+
+    def __init__(self, example_path: str, entry: dict = None):
+        self.example_path = example_path
+        self._entry = entry
+        self._episode = None
+        self._low_dim = None
+        self._low_dim_pickle = None
+        if _is_episode_file(example_path, entry):
+            self._episode = EpisodeFile(
+                join(example_path, EPISODE_FILE), memory_map=True)
+            self._low_dim = self._episode
+            self.num_steps = self._episode.num_steps
+        elif exists(join(example_path, LOW_DIM_FILE)):
+            self._low_dim = EpisodeFile(
+                join(example_path, LOW_DIM_FILE), memory_map=True)
+            self.num_steps = self._low_dim.num_steps
+        else:
+            with open(join(example_path, LOW_DIM_PICKLE), 'rb') as f:
+                self._low_dim_pickle = pickle.load(f)
+            self.num_steps = len(self._low_dim_pickle)
+        if entry is not None:
+            _check_num_steps(self.num_steps, entry)
+        self._levels = {}
+
+    def __len__(self):
+        return self.num_steps
+
+    @property
+    def random_seed(self):
+        if self._low_dim is not None:
+            return random_state_from_episode_file(self._low_dim)
+        return self._low_dim_pickle.random_seed
 
+    @property
+    def keyframes(self) -> List[int]:
+        """The keyframe steps, detected from the low-dim data if the
+        episode was stored without them."""
+        if self._entry is not None and 'keyframes' in self._entry:
+            return self._entry['keyframes']
+        if self._low_dim is not None:
+            keyframes = keyframes_from_episode_file(self._low_dim)
+            if keyframes is None:
+                keyframes = detect_keyframes(
+                    self._low_dim.read('gripper_open'),
+                    self._low_dim.read('joint_velocities'))
+        else:
+            keyframes = self._low_dim_pickle.keyframes
+            if keyframes is None:
+                keyframes = detect_keyframes(
+                    [ob.gripper_open for ob in self._low_dim_pickle],
+                    [ob.joint_velocities for ob in self._low_dim_pickle])
+        return keyframes
+
+    def observation(self, i: int,
+                    obs_config: ObservationConfig) -> Observation:
+        """Loads and decodes step i, as get_stored_demos would."""
+        if self._entry is not None:
+            _check_manifest_entry(self._entry, self.example_path, obs_config)
+        elif self._episode is not None:
+            _check_stored(self._episode.columns(), self.example_path,
+                          obs_config)
+        else:
+            _check_stored([name for name in _needed_images(obs_config)
+                           if exists(join(self.example_path, name))],
+                          self.example_path, obs_config)
+        if self._low_dim is not None:
+            ob = observation_from_episode_file(self._low_dim, i)
+        else:
+            ob = copy.deepcopy(self._low_dim_pickle[i])
+        _remove_unused_low_dim(ob, obs_config)
+        if self._episode is not None:
+            levels = self._levels_for(obs_config)
+
+            def fetch(camera, modality):
+                return self._episode.read_step(
+                    _stored_name(levels, camera, modality), i)
+        else:
+            fetch = _png_fetcher(self.example_path, range(self.num_steps)[i],
+                                 self._levels_for(obs_config))
+        for camera in CAMERAS:
+            cam_config = getattr(obs_config, '%s_camera' % camera)
+            _decode_camera(ob, camera, cam_config,
+                           *_fetch_camera_images(fetch, camera, cam_config))
+        return ob
+
+    def _levels_for(self, obs_config: ObservationConfig) -> dict:
+        sizes = tuple(tuple(getattr(obs_config, '%s_camera' % c).image_size)
+                      for c in CAMERAS)
+        if sizes not in self._levels:
+            self._levels[sizes] = _image_levels(
+                self.example_path, obs_config, self._entry, self._episode)
+        return self._levels[sizes]
+
+
+def observation_config_key(obs_config: ObservationConfig) -> str:
+    """A stable description of every setting of an observation config.
+
+    Two configs with the same settings (including the parameters of their
+    noise models) give the same key, in any process, so it can be used to
+    key caches of loaded demos.
+    """
+    def describe(value):
+        if isinstance(value, (ObservationConfig, CameraConfig, NoiseModel)):
+            return [type(value).__name__,
+                    {k: describe(v) for k, v in vars(value).items()}]
+        if isinstance(value, (list, tuple)):
+            return [describe(v) for v in value]
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        return value
+    return json.dumps(describe(obs_config), sort_keys=True, default=str)
+
+
+def has_stochastic_noise(obs_config: ObservationConfig) -> bool:
+    """Whether loading with the config applies any (random) noise."""
+    configs = [obs_config] + [getattr(obs_config, '%s_camera' % camera)
+                              for camera in CAMERAS]
+    return any(isinstance(v, NoiseModel) and not isinstance(v, Identity)
+               for config in configs for v in vars(config).values())
+
+
+def _is_episode_file(example_path: str, entry: dict = None) -> bool:
+    if entry is not None:
+        return entry['storage_format'] == 'episode_file'
+    return exists(join(example_path, EPISODE_FILE))
+
+
+def _check_manifest_entry(entry: dict, example_path: str,
+                          obs_config: ObservationConfig) -> None:
+    _check_stored(set(entry['modalities']), example_path, obs_config)
+
+
+def _needed_images(obs_config: ObservationConfig) -> List[str]:
+    """The stored images (e.g. 'front_depth') an observation config needs."""
+    names = []
+    for camera in CAMERAS:
+        cam_config = getattr(obs_config, '%s_camera' % camera)
+        for modality, needed in [
+                ('rgb', cam_config.rgb),
+                ('depth', cam_config.depth or cam_config.point_cloud),
+                ('mask', cam_config.mask)]:
+            if needed:
+                names.append('%s_%s' % (camera, modality))
+    return names
+
+
+def _check_stored(stored, example_path: str,
+                  obs_config: ObservationConfig) -> None:
+    for name in _needed_images(obs_config):
+        if name not in stored:
+            raise RuntimeError(
+                'The observation config asks for %s, but it was not '
+                'stored for the episode at: %s' % (name, example_path))
+
+
+def _image_levels(example_path: str, obs_config: ObservationConfig,
+                  entry: dict = None, episode: EpisodeFile = None) -> dict:
+    """Finds the stored pyramid levels that match the requested image sizes.
+
+    :return: Image name (e.g. 'front_rgb') to the name of the stored level
+        of exactly the configured size. Images without one are read at the
+        stored size and resized.
+    """
+    levels = {}
+    for camera in CAMERAS:
+        size = tuple(getattr(obs_config, '%s_camera' % camera).image_size)
+        if entry is not None and size not in [
+                tuple(s) for s in entry.get('image_levels', {}).get(
+                    camera, [])]:
+            continue
+        for modality in ['rgb', 'depth', 'mask']:
+            name = '%s_%s' % (camera, modality)
+            level = IMAGE_LEVEL_FORMAT % (name, size[0], size[1])
+            if entry is not None:
+                stored = name in entry['modalities']
+            elif episode is not None:
+                stored = level in episode
+            else:
+                stored = exists(join(example_path, level))
+            if stored:
+                levels[name] = level
+    return levels
+
+
+def _stored_name(levels: dict, camera: str, modality: str) -> str:
+    name = '%s_%s' % (camera, modality)
+    return name if levels is None else levels.get(name, name)
+
+
+def _check_num_steps(num_steps: int, entry: dict) -> None:
+    if num_steps != entry['num_steps']:
+        raise RuntimeError(
+            'Broken dataset assumption: episode %s has %d steps, but the '
+            'manifest lists %d.' % (entry['id'], num_steps,
+                                    entry['num_steps']))
+
+
+def _load_png_demo(example_path: str, image_paths: bool,
+                   obs_config: ObservationConfig, lazy: bool = False,
+                   decode_pool: 'DecodePool' = None,
+                   entry: dict = None) -> Demo:
+    with open(join(example_path, LOW_DIM_PICKLE), 'rb') as f:
+        obs = pickle.load(f)
+    num_steps = len(obs)
+
+    if entry is not None:
+        _check_num_steps(num_steps, entry)
+    else:
+        _check_png_folders(example_path, num_steps, obs_config)
+    levels = _image_levels(example_path, obs_config, entry)
+
+    if lazy and not image_paths:
+        lazy_obs = []
         for i in range(num_steps):
-            si = IMAGE_FORMAT % i
-            if obs_config.left_shoulder_camera.rgb:
-                obs[i].left_shoulder_rgb = join(l_sh_rgb_f, si)
-            if obs_config.left_shoulder_camera.depth or obs_config.left_shoulder_camera.point_cloud:
-                obs[i].left_shoulder_depth = join(l_sh_depth_f, si)
-            if obs_config.left_shoulder_camera.mask:
-                obs[i].left_shoulder_mask = join(l_sh_mask_f, si)
-            if obs_config.right_shoulder_camera.rgb:
-                obs[i].right_shoulder_rgb = join(r_sh_rgb_f, si)
-            if obs_config.right_shoulder_camera.depth or obs_config.right_shoulder_camera.point_cloud:
-                obs[i].right_shoulder_depth = join(r_sh_depth_f, si)
-            if obs_config.right_shoulder_camera.mask:
-                obs[i].right_shoulder_mask = join(r_sh_mask_f, si)
-            if obs_config.overhead_camera.rgb:
-                obs[i].overhead_rgb = join(oh_rgb_f, si)
-            if obs_config.overhead_camera.depth or obs_config.overhead_camera.point_cloud:
-                obs[i].overhead_depth = join(oh_depth_f, si)
-            if obs_config.overhead_camera.mask:
-                obs[i].overhead_mask = join(oh_mask_f, si)
-            if obs_config.wrist_camera.rgb:
-                obs[i].wrist_rgb = join(wrist_rgb_f, si)
-            if obs_config.wrist_camera.depth or obs_config.wrist_camera.point_cloud:
-                obs[i].wrist_depth = join(wrist_depth_f, si)
-            if obs_config.wrist_camera.mask:
-                obs[i].wrist_mask = join(wrist_mask_f, si)
-            if obs_config.front_camera.rgb:
-                obs[i].front_rgb = join(front_rgb_f, si)
-            if obs_config.front_camera.depth or obs_config.front_camera.point_cloud:
-                obs[i].front_depth = join(front_depth_f, si)
-            if obs_config.front_camera.mask:
-                obs[i].front_mask = join(front_mask_f, si)
-
-            # Remove low dim info if necessary
-            if not obs_config.joint_velocities:
-                obs[i].joint_velocities = None
-            if not obs_config.joint_positions:
-                obs[i].joint_positions = None
-            if not obs_config.joint_forces:
-                obs[i].joint_forces = None
-            if not obs_config.gripper_open:
-                obs[i].gripper_open = None
-            if not obs_config.gripper_pose:
-                obs[i].gripper_pose = None
-            if not obs_config.gripper_joint_positions:
-                obs[i].gripper_joint_positions = None
-            if not obs_config.gripper_touch_forces:
-                obs[i].gripper_touch_forces = None
-            if not obs_config.task_low_dim_state:
-                obs[i].task_low_dim_state = None
-
-        if not image_paths:
-            for i in range(num_steps):
-                if obs_config.left_shoulder_camera.rgb:
-                    obs[i].left_shoulder_rgb = np.array(
-                        _resize_if_needed(
-                            Image.open(obs[i].left_shoulder_rgb),
-                            obs_config.left_shoulder_camera.image_size))
-                if obs_config.right_shoulder_camera.rgb:
-                    obs[i].right_shoulder_rgb = np.array(
-                        _resize_if_needed(Image.open(
-                        obs[i].right_shoulder_rgb),
-                            obs_config.right_shoulder_camera.image_size))
-                if obs_config.overhead_camera.rgb:
-                    obs[i].overhead_rgb = np.array(
-                        _resize_if_needed(Image.open(
-                        obs[i].overhead_rgb),
-                            obs_config.overhead_camera.image_size))
-                if obs_config.wrist_camera.rgb:
-                    obs[i].wrist_rgb = np.array(
-                        _resize_if_needed(
-                            Image.open(obs[i].wrist_rgb),
-                            obs_config.wrist_camera.image_size))
-                if obs_config.front_camera.rgb:
-                    obs[i].front_rgb = np.array(
-                        _resize_if_needed(
-                            Image.open(obs[i].front_rgb),
-                            obs_config.front_camera.image_size))
-
-                if obs_config.left_shoulder_camera.depth or obs_config.left_shoulder_camera.point_cloud:
-                    l_sh_depth = image_to_float_array(
-                        _resize_if_needed(
-                            Image.open(obs[i].left_shoulder_depth),
-                            obs_config.left_shoulder_camera.image_size),
-                        DEPTH_SCALE)
-                    near = obs[i].misc['left_shoulder_camera_near']
-                    far = obs[i].misc['left_shoulder_camera_far']
-                    l_sh_depth_m = near + l_sh_depth * (far - near)
-                    if obs_config.left_shoulder_camera.depth:
-                        d = l_sh_depth_m if obs_config.left_shoulder_camera.depth_in_meters else l_sh_depth
-                        obs[i].left_shoulder_depth = obs_config.left_shoulder_camera.depth_noise.apply(d)
-                    else:
-                        obs[i].left_shoulder_depth = None
-
-                if obs_config.right_shoulder_camera.depth or obs_config.right_shoulder_camera.point_cloud:
-                    r_sh_depth = image_to_float_array(
-                        _resize_if_needed(
-                            Image.open(obs[i].right_shoulder_depth),
-                            obs_config.right_shoulder_camera.image_size),
-                        DEPTH_SCALE)
-                    near = obs[i].misc['right_shoulder_camera_near']
-                    far = obs[i].misc['right_shoulder_camera_far']
-                    r_sh_depth_m = near + r_sh_depth * (far - near)
-                    if obs_config.right_shoulder_camera.depth:
-                        d = r_sh_depth_m if obs_config.right_shoulder_camera.depth_in_meters else r_sh_depth
-                        obs[i].right_shoulder_depth = obs_config.right_shoulder_camera.depth_noise.apply(d)
-                    else:
-                        obs[i].right_shoulder_depth = None
-
-                if obs_config.overhead_camera.depth or obs_config.overhead_camera.point_cloud:
-                    oh_depth = image_to_float_array(
-                        _resize_if_needed(
-                            Image.open(obs[i].overhead_depth),
-                            obs_config.overhead_camera.image_size),
-                        DEPTH_SCALE)
-                    near = obs[i].misc['overhead_camera_near']
-                    far = obs[i].misc['overhead_camera_far']
-                    oh_depth_m = near + oh_depth * (far - near)
-                    if obs_config.overhead_camera.depth:
-                        d = oh_depth_m if obs_config.overhead_camera.depth_in_meters else oh_depth
-                        obs[i].overhead_depth = obs_config.overhead_camera.depth_noise.apply(d)
-                    else:
-                        obs[i].overhead_depth = None
-
-                if obs_config.wrist_camera.depth or obs_config.wrist_camera.point_cloud:
-                    wrist_depth = image_to_float_array(
-                        _resize_if_needed(
-                            Image.open(obs[i].wrist_depth),
-                            obs_config.wrist_camera.image_size),
-                        DEPTH_SCALE)
-                    near = obs[i].misc['wrist_camera_near']
-                    far = obs[i].misc['wrist_camera_far']
-                    wrist_depth_m = near + wrist_depth * (far - near)
-                    if obs_config.wrist_camera.depth:
-                        d = wrist_depth_m if obs_config.wrist_camera.depth_in_meters else wrist_depth
-                        obs[i].wrist_depth = obs_config.wrist_camera.depth_noise.apply(d)
-                    else:
-                        obs[i].wrist_depth = None
-
-                if obs_config.front_camera.depth or obs_config.front_camera.point_cloud:
-                    front_depth = image_to_float_array(
-                        _resize_if_needed(
-                            Image.open(obs[i].front_depth),
-                            obs_config.front_camera.image_size),
-                        DEPTH_SCALE)
-                    near = obs[i].misc['front_camera_near']
-                    far = obs[i].misc['front_camera_far']
-                    front_depth_m = near + front_depth * (far - near)
-                    if obs_config.front_camera.depth:
-                        d = front_depth_m if obs_config.front_camera.depth_in_meters else front_depth
-                        obs[i].front_depth = obs_config.front_camera.depth_noise.apply(d)
-                    else:
-                        obs[i].front_depth = None
-
-                if obs_config.left_shoulder_camera.point_cloud:
-                    obs[i].left_shoulder_point_cloud = VisionSensor.pointcloud_from_depth_and_camera_params(
-                        l_sh_depth_m,
-                        obs[i].misc['left_shoulder_camera_extrinsics'],
-                        obs[i].misc['left_shoulder_camera_intrinsics'])
-                if obs_config.right_shoulder_camera.point_cloud:
-                    obs[i].right_shoulder_point_cloud = VisionSensor.pointcloud_from_depth_and_camera_params(
-                        r_sh_depth_m,
-                        obs[i].misc['right_shoulder_camera_extrinsics'],
-                        obs[i].misc['right_shoulder_camera_intrinsics'])
-                if obs_config.overhead_camera.point_cloud:
-                    obs[i].overhead_point_cloud = VisionSensor.pointcloud_from_depth_and_camera_params(
-                        oh_depth_m,
-                        obs[i].misc['overhead_camera_extrinsics'],
-                        obs[i].misc['overhead_camera_intrinsics'])
-                if obs_config.wrist_camera.point_cloud:
-                    obs[i].wrist_point_cloud = VisionSensor.pointcloud_from_depth_and_camera_params(
-                        wrist_depth_m,
-                        obs[i].misc['wrist_camera_extrinsics'],
-                        obs[i].misc['wrist_camera_intrinsics'])
-                if obs_config.front_camera.point_cloud:
-                    obs[i].front_point_cloud = VisionSensor.pointcloud_from_depth_and_camera_params(
-                        front_depth_m,
-                        obs[i].misc['front_camera_extrinsics'],
-                        obs[i].misc['front_camera_intrinsics'])
-
-                # Masks are stored as coded RGB images.
-                # Here we transform them into 1 channel handles.
-                if obs_config.left_shoulder_camera.mask:
-                    obs[i].left_shoulder_mask = rgb_handles_to_mask(
-                        np.array(_resize_if_needed(Image.open(
-                            obs[i].left_shoulder_mask),
-                            obs_config.left_shoulder_camera.image_size)))
-                if obs_config.right_shoulder_camera.mask:
-                    obs[i].right_shoulder_mask = rgb_handles_to_mask(
-                        np.array(_resize_if_needed(Image.open(
-                            obs[i].right_shoulder_mask),
-                            obs_config.right_shoulder_camera.image_size)))
-                if obs_config.overhead_camera.mask:
-                    obs[i].overhead_mask = rgb_handles_to_mask(
-                        np.array(_resize_if_needed(Image.open(
-                            obs[i].overhead_mask),
-                            obs_config.overhead_camera.image_size)))
-                if obs_config.wrist_camera.mask:
-                    obs[i].wrist_mask = rgb_handles_to_mask(np.array(
-                        _resize_if_needed(Image.open(
-                            obs[i].wrist_mask),
-                            obs_config.wrist_camera.image_size)))
-                if obs_config.front_camera.mask:
-                    obs[i].front_mask = rgb_handles_to_mask(np.array(
-                        _resize_if_needed(Image.open(
-                            obs[i].front_mask),
-                            obs_config.front_camera.image_size)))
-
-        demos.append(obs)
-    return demos
+            _remove_unused_low_dim(obs[i], obs_config)
+            lazy_obs.append(_lazy_observation(
+                obs[i], obs_config, _png_fetcher(example_path, i, levels)))
+        return Demo(lazy_obs, random_seed=obs.random_seed,
+                    keyframes=obs.keyframes)
+
+    for i in range(num_steps):
+        si = IMAGE_FORMAT % i
+        for camera in CAMERAS:
+            cam_config = getattr(obs_config, '%s_camera' % camera)
+            if cam_config.rgb:
+                setattr(obs[i], '%s_rgb' % camera, join(
+                    example_path, _stored_name(levels, camera, 'rgb'), si))
+            if cam_config.depth or cam_config.point_cloud:
+                setattr(obs[i], '%s_depth' % camera, join(
+                    example_path, _stored_name(levels, camera, 'depth'), si))
+            if cam_config.mask:
+                setattr(obs[i], '%s_mask' % camera, join(
+                    example_path, _stored_name(levels, camera, 'mask'), si))
+        _remove_unused_low_dim(obs[i], obs_config)
+
+    if not image_paths and decode_pool is not None:
+        decode_pool.decode(
+            obs, obs_config,
+            [_png_fetcher(example_path, i, levels)
+             for i in range(num_steps)])
+    elif not image_paths:
+        for i in range(num_steps):
+            for camera in CAMERAS:
+                rgb, depth, mask = [
+                    _open_image(getattr(obs[i], '%s_%s' % (camera, m)))
+                    for m in ['rgb', 'depth', 'mask']]
+                _decode_camera(
+                    obs[i], camera, getattr(obs_config, '%s_camera' % camera),
+                    rgb, depth, mask)
+    return obs
+
+
+def _check_png_folders(example_path: str, num_steps: int,
+                       obs_config: ObservationConfig) -> None:
+    # Without a manifest, the only check available is listing the folders.
+    # Episodes may be stored with only some of the cameras and modalities,
+    # so only the folders the observation config needs are checked.
+    needed = _needed_images(obs_config)
+    _check_stored([name for name in needed
+                   if exists(join(example_path, name))],
+                  example_path, obs_config)
+    for name in needed:
+        if len(listdir(join(example_path, name))) != num_steps:
+            raise RuntimeError('Broken dataset assumption')
+
+
+def _load_episode_file_demo(example_path: str, image_paths: bool,
+                            obs_config: ObservationConfig,
+                            memory_map: bool = False,
+                            lazy: bool = False,
+                            decode_pool: 'DecodePool' = None,
+                            entry: dict = None) -> Demo:
+    if image_paths:
+        raise RuntimeError(
+            'Image paths are not available for episodes stored as a '
+            'single episode file: %s' % example_path)
+    episode = EpisodeFile(join(example_path, EPISODE_FILE), memory_map)
+    if entry is not None:
+        _check_num_steps(episode.num_steps, entry)
+    else:
+        _check_stored(episode.columns(), example_path, obs_config)
+    random_seed = random_state_from_episode_file(episode)
+    keyframes = keyframes_from_episode_file(episode)
+    obs = observations_from_episode_file(episode)
+    for ob in obs:
+        _remove_unused_low_dim(ob, obs_config)
+    levels = _image_levels(example_path, obs_config, entry, episode)
+    if lazy:
+        fetcher = _ColumnFetcher(episode, levels)
+        return Demo([_lazy_observation(ob, obs_config, fetcher.at_step(i))
+                     for i, ob in enumerate(obs)], random_seed=random_seed,
+                    keyframes=keyframes)
+    if memory_map:
+        return Demo(_MappedObservations(episode, obs, obs_config, levels),
+                    random_seed=random_seed, keyframes=keyframes)
+    if decode_pool is not None:
+        fetcher = _ColumnFetcher(episode, levels)
+        decode_pool.decode(obs, obs_config,
+                           [fetcher.at_step(i) for i in range(len(obs))])
+        return Demo(obs, random_seed=random_seed, keyframes=keyframes)
+    # One contiguous read per modality, rather than one file per frame.
+    columns = {}
+    for camera in CAMERAS:
+        cam_config = getattr(obs_config, '%s_camera' % camera)
+        for modality, needed in [
+                ('rgb', cam_config.rgb),
+                ('depth', cam_config.depth or cam_config.point_cloud),
+                ('mask', cam_config.mask)]:
+            if needed:
+                columns['%s_%s' % (camera, modality)] = episode.read(
+                    _stored_name(levels, camera, modality))
+    # Decode in the same (step, camera) order as the png layout, so noise
+    # is drawn identically.
+    for i, ob in enumerate(obs):
+        for camera in CAMERAS:
+            rgb, depth, mask = [
+                columns['%s_%s' % (camera, m)][i]
+                if '%s_%s' % (camera, m) in columns else None
+                for m in ['rgb', 'depth', 'mask']]
+            _decode_camera(
+                ob, camera, getattr(obs_config, '%s_camera' % camera),
+                rgb, depth, mask)
+    return Demo(obs, random_seed=random_seed, keyframes=keyframes)
+
+
+class _MappedObservations(object):
+    """Observations of a memory-mapped episode file, decoded on indexing.
+
+    Nothing is decoded up front; each lookup builds a fresh observation from
+    the mapped columns, so only the touched frames are ever paged in.
+    """
+
+    def __init__(self, episode: EpisodeFile, low_dim: List[Observation],
+                 obs_config: ObservationConfig, levels: dict = None):
+        self._episode = episode
+        self._low_dim = low_dim
+        self._obs_config = obs_config
+        self._levels = levels or {}
+        self._fields = {}
+
+    def add_fields(self, fields: dict) -> None:
+        """Adds per-step values (field name to column) to set on indexing."""
+        self._fields.update(fields)
+
+    def __len__(self):
+        return len(self._low_dim)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        ob = copy.copy(self._low_dim[i])
+        ob.misc = dict(ob.misc)
+        for name, column in self._fields.items():
+            setattr(ob, name, column[i])
+        for camera in CAMERAS:
+            cam_config = getattr(self._obs_config, '%s_camera' % camera)
+            rgb, depth, mask = [
+                self._episode.read_step(
+                    _stored_name(self._levels, camera, m), i) if needed
+                else None for m, needed in [
+                    ('rgb', cam_config.rgb),
+                    ('depth', cam_config.depth or cam_config.point_cloud),
+                    ('mask', cam_config.mask)]]
+            _decode_camera(ob, camera, cam_config, rgb, depth, mask)
+        return ob
+
+
+class DecodePool(object):
+    """Worker pools for decoding the images of stored demos in parallel.
+
+    Decoding is fanned out as one job per step per camera, and the results
+    are put back in order. PNG decoding and resizing runs on the threads
+    (PIL releases the GIL while decoding); the numpy work (depth decoding,
+    point clouds and mask handles) runs on the processes, or on the threads
+    when num_processes is 0. Noise models are always applied in the calling
+    process, in step order, so results do not depend on the pool.
+
+    The pools are reused across calls, so create one and pass it to every
+    get_stored_demos call.
+    """
+
+    def __init__(self, num_threads: int = 4, num_processes: int = 0):
+        self._threads = ThreadPoolExecutor(max_workers=num_threads)
+        self._processes = (ProcessPoolExecutor(max_workers=num_processes)
+                           if num_processes > 0 else None)
+
+    def close(self) -> None:
+        self._threads.shutdown()
+        if self._processes is not None:
+            self._processes.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def decode(self, observations: List[Observation],
+               obs_config: ObservationConfig, fetchers: list) -> None:
+        """Decodes the camera images of each observation, in place.
+
+        :param observations: The observations of a demo.
+        :param obs_config: Which images to decode, and how.
+        :param fetchers: One per observation. fetchers[i](camera, modality)
+            returns the stored image of step i.
+        """
+        # Cameras with nothing to decode would only cost a job each.
+        cameras = [(camera, getattr(obs_config, '%s_camera' % camera))
+                   for camera in CAMERAS]
+        cameras = [(camera, cam_config) for camera, cam_config in cameras
+                   if cam_config.rgb or cam_config.depth or
+                   cam_config.point_cloud or cam_config.mask]
+        jobs = []
+        for ob, fetch in zip(observations, fetchers):
+            for camera, cam_config in cameras:
+                misc = {k: v for k, v in ob.misc.items()
+                        if k.startswith('%s_camera_' % camera)}
+                if self._processes is None:
+                    future = self._threads.submit(
+                        _fetch_and_decode, fetch, camera, cam_config, misc)
+                else:
+                    future = self._threads.submit(
+                        _fetch_camera_images, fetch, camera, cam_config)
+                jobs.append((ob, camera, cam_config, misc, future))
+        if self._processes is not None:
+            # Hand each set of images over to the processes as soon as the
+            # threads have read it.
+            jobs = [(ob, camera, cam_config, misc, self._processes.submit(
+                _decode_camera_images, camera, cam_config, misc,
+                *future.result()))
+                for ob, camera, cam_config, misc, future in jobs]
+        for ob, camera, cam_config, _, future in jobs:
+            _apply_decoded(ob, camera, cam_config, future.result())
+
+
+class PointCloudCache(object):
+    """On-disk cache of the point clouds derived from the stored depth.
+
+    Point clouds (and, with store_depth, the depth in meters) are computed
+    once per episode, camera and image size, and stored as an episode file
+    either in the episode folder or, given a cache_dir, under a folder named
+    after the hashed episode path. Each cache file records the source it was
+    computed from (the manifest checksums of the depth images and low-dim
+    data, or their sizes and modification times), and is recomputed when
+    that changes.
+
+    Cached values are taken before noise is applied, so the noise settings
+    do not affect the cache. Depth is only read from the cache when it is
+    asked for in meters without noise; otherwise it is decoded as usual.
+    """
+
+    VERSION = 1
+
+    def __init__(self, cache_dir: str = None, store_depth: bool = False):
+        self._cache_dir = cache_dir
+        self._store_depth = store_depth
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, example_path: str, camera: str, size) -> str:
+        name = '%s_%dx%d.rlb' % (camera, size[0], size[1])
+        if self._cache_dir is None:
+            return join(example_path, POINT_CLOUD_CACHE_FOLDER, name)
+        key = hashlib.sha1(
+            os.path.realpath(example_path).encode('utf-8')).hexdigest()
+        return join(self._cache_dir, key[:2], key, name)
+
+    def load(self, example_path: str, obs_config: ObservationConfig,
+             entry: dict, memory_map: bool, load_demo) -> Demo:
+        """Loads a demo, taking the point clouds from the cache.
+
+        :param load_demo: Loads the demo given an observation config. It is
+            called with point clouds (and cached depth) turned off.
+        """
+        reduced = copy.copy(obs_config)
+        fields = {}
+        missing = []
+        for camera in CAMERAS:
+            cam_config = getattr(obs_config, '%s_camera' % camera)
+            if not cam_config.point_cloud:
+                continue
+            columns = self._read(example_path, obs_config, camera, entry,
+                                 memory_map)
+            if columns is None:
+                missing.append(camera)
+                continue
+            self.hits += 1
+            fields.update(self._fields(camera, cam_config, columns))
+        if len(missing) > 0:
+            self.misses += len(missing)
+            fields.update(self._compute(example_path, obs_config, entry,
+                                        missing))
+        for camera in CAMERAS:
+            cam_config = copy.copy(getattr(reduced, '%s_camera' % camera))
+            cam_config.point_cloud = False
+            if '%s_depth' % camera in fields:
+                cam_config.depth = False
+            setattr(reduced, '%s_camera' % camera, cam_config)
+        demo = load_demo(reduced)
+        if isinstance(demo._observations, _MappedObservations):
+            demo._observations.add_fields(fields)
+        else:
+            for name, column in fields.items():
+                for i, ob in enumerate(demo):
+                    setattr(ob, name, column[i])
+        return demo
+
+    def _fields(self, camera: str, cam_config: CameraConfig,
+                columns: dict) -> dict:
+        fields = {'%s_point_cloud' % camera: columns['point_cloud']}
+        if (cam_config.depth and cam_config.depth_in_meters and
+                isinstance(cam_config.depth_noise, Identity) and
+                'depth_m' in columns):
+            fields['%s_depth' % camera] = columns['depth_m']
+        return fields
+
+    def _source(self, example_path: str, obs_config: ObservationConfig,
+                camera: str, entry: dict) -> str:
+        if entry is not None:
+            sources = sorted(
+                (name, value) for name, value in entry['checksums'].items()
+                if name in [LOW_DIM_PICKLE, EPISODE_FILE] or
+                name.startswith('%s_depth' % camera))
+        elif _is_episode_file(example_path):
+            sources = [_file_source(example_path, EPISODE_FILE)]
+        else:
+            # Every image of the depth folder read, as rewriting an image
+            # does not change the folder itself.
+            folder = _stored_name(_image_levels(example_path, obs_config),
+                                  camera, 'depth')
+            sources = [_file_source(example_path, LOW_DIM_PICKLE)] + [
+                _file_source(example_path, join(folder, name))
+                for name in sorted(listdir(join(example_path, folder)))]
+        return manifest.format_checksum(manifest.checksum(
+            json.dumps([self.VERSION, sources]).encode('utf-8')))
+
+    def _read(self, example_path: str, obs_config: ObservationConfig,
+              camera: str, entry: dict, memory_map: bool):
+        size = getattr(obs_config, '%s_camera' % camera).image_size
+        path = self.path(example_path, camera, size)
+        try:
+            cached = EpisodeFile(path, memory_map)
+        except (FileNotFoundError, EpisodeFileError):
+            return None
+        if cached.attrs.get('source') != self._source(
+                example_path, obs_config, camera, entry):
+            return None
+        return {name: cached.read(name) for name in cached.columns()}
+
+    def _compute(self, example_path: str, obs_config: ObservationConfig,
+                 entry: dict, cameras: List[str]) -> dict:
+        if _is_episode_file(example_path, entry):
+            episode = EpisodeFile(join(example_path, EPISODE_FILE))
+            misc = [ob.misc for ob in observations_from_episode_file(episode)]
+            fetcher = _ColumnFetcher(episode, _image_levels(
+                example_path, obs_config, entry, episode))
+            fetchers = [fetcher.at_step(i) for i in range(len(misc))]
+        else:
+            with open(join(example_path, LOW_DIM_PICKLE), 'rb') as f:
+                misc = [ob.misc for ob in pickle.load(f)]
+            levels = _image_levels(example_path, obs_config, entry)
+            fetchers = [_png_fetcher(example_path, i, levels)
+                        for i in range(len(misc))]
+        fields = {}
+        for camera in cameras:
+            cam_config = getattr(obs_config, '%s_camera' % camera)
+            size = cam_config.image_size
+            depth_m = np.stack([
+                _decode_depth(fetch(camera, 'depth'), size, m, camera)[1]
+                for fetch, m in zip(fetchers, misc)])
+            columns = {'point_cloud': np.stack([
+                _point_cloud(d, m, camera) for d, m in zip(depth_m, misc)])}
+            if self._store_depth:
+                columns['depth_m'] = depth_m
+            path = self.path(example_path, camera, size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Threads of a process (e.g. of a DecodePool) may compute the
+            # same episode at once.
+            tmp_path = '%s.tmp%d.%d' % (path, os.getpid(),
+                                        threading.get_ident())
+            write_episode_file(tmp_path, len(misc), columns, {
+                'source': self._source(example_path, obs_config, camera,
+                                       entry)})
+            os.replace(tmp_path, path)
+            fields.update(self._fields(camera, cam_config, columns))
+        return fields
+
+
+def _file_source(example_path: str, name: str) -> tuple:
+    stat = os.stat(join(example_path, name))
+    return name, stat.st_size, stat.st_mtime_ns
+
+
+class DemoCache(object):
+    """In-process LRU cache of decoded demos.
+
+    Repeated loads of the same episode with the same observation settings
+    (see observation_config_key) return the cached demo instead of decoding
+    it again. Selection is not cached, so random_selection still picks new
+    episodes on every call. Demos loaded with stochastic noise are not
+    cached, as every load should draw new noise.
+
+    Each load returns a new Demo holding copies of the observations, but
+    the arrays are shared with the cache and are made read-only.
+
+    :param max_demos: The number of demos kept.
+    :param max_bytes: If given, also evict demos to keep the total size of
+        their arrays within this many bytes.
+    """
+
+    def __init__(self, max_demos: int = 32, max_bytes: int = None):
+        self.max_demos = max_demos
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._demos = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._demos)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._demos.clear()
+            self._bytes = 0
+
+    def load(self, example_path: str, obs_config: ObservationConfig,
+             load_demo, options: dict = None) -> Demo:
+        """Returns the cached demo, or loads and caches it.
+
+        :param load_demo: Loads the demo (fully decoded) on a miss.
+        :param options: Other loading options that change the demo, which
+            are made part of the key.
+        """
+        if has_stochastic_noise(obs_config):
+            return load_demo()
+        key = (os.path.realpath(example_path),
+               observation_config_key(obs_config),
+               json.dumps(options or {}, sort_keys=True))
+        with self._lock:
+            if key in self._demos:
+                self._demos.move_to_end(key)
+                self.hits += 1
+                return _copy_demo(self._demos[key][0])
+            self.misses += 1
+        demo = load_demo()
+        nbytes = _freeze_demo(demo)
+        with self._lock:
+            if key not in self._demos:
+                self._demos[key] = (demo, nbytes)
+                self._bytes += nbytes
+            while len(self._demos) > self.max_demos or (
+                    self.max_bytes is not None and len(self._demos) > 0 and
+                    self._bytes > self.max_bytes):
+                _, (_, evicted) = self._demos.popitem(last=False)
+                self._bytes -= evicted
+        return _copy_demo(demo)
+
+
+def _freeze_demo(demo: Demo) -> int:
+    """Makes the arrays of a demo read-only, and returns their size."""
+    nbytes = 0
+    for ob in demo:
+        for value in list(vars(ob).values()) + list(
+                (ob.misc or {}).values()):
+            if isinstance(value, np.ndarray):
+                value.setflags(write=False)
+                nbytes += value.nbytes
+    return nbytes
+
+
+def _copy_demo(demo: Demo) -> Demo:
+    observations = []
+    for ob in demo:
+        ob = copy.copy(ob)
+        ob.misc = dict(ob.misc or {})
+        observations.append(ob)
+    return Demo(observations, random_seed=demo.random_seed,
+                keyframes=demo.keyframes)
+
+
+def _fetch_camera_images(fetch, camera: str, cam_config: CameraConfig):
+    """Reads and resizes the stored images of one camera as uint8 arrays."""
+    needed = [cam_config.rgb, cam_config.depth or cam_config.point_cloud,
+              cam_config.mask]
+    return [np.array(_resize_if_needed(fetch(camera, m),
+                                       cam_config.image_size))
+            if n else None for m, n in zip(['rgb', 'depth', 'mask'], needed)]
+
+
+def _fetch_and_decode(fetch, camera: str, cam_config: CameraConfig,
+                      misc: dict) -> dict:
+    return _decode_camera_images(
+        camera, cam_config, misc,
+        *_fetch_camera_images(fetch, camera, cam_config))
+
+
+def _remove_unused_low_dim(obs: Observation, obs_config: ObservationConfig):
+    if not obs_config.joint_velocities:
+        obs.joint_velocities = None
+    if not obs_config.joint_positions:
+        obs.joint_positions = None
+    if not obs_config.joint_forces:
+        obs.joint_forces = None
+    if not obs_config.gripper_open:
+        obs.gripper_open = None
+    if not obs_config.gripper_pose:
+        obs.gripper_pose = None
+    if not obs_config.gripper_joint_positions:
+        obs.gripper_joint_positions = None
+    if not obs_config.gripper_touch_forces:
+        obs.gripper_touch_forces = None
+    if not obs_config.task_low_dim_state:
+        obs.task_low_dim_state = None
+
+
+def _decode_camera(obs: Observation, camera: str, cam_config: CameraConfig,
+                   rgb, depth, mask) -> None:
+    """Decodes the stored images of one camera into the observation.
+
+    The images can either be PIL images (PNG layout) or uint8 arrays
+    (episode file layout); both hold the same pixel encoding.
+    """
+    _apply_decoded(obs, camera, cam_config, _decode_camera_images(
+        camera, cam_config, obs.misc, rgb, depth, mask))
+
+
+def _decode_camera_images(camera: str, cam_config: CameraConfig, misc: dict,
+                          rgb, depth, mask) -> dict:
+    """Does the decoding work for one camera at one step.
+
+    Works on plain images and arrays only (no observation), so that it can
+    be run in a worker process. Noise is not applied here.
+    """
+    decoded = {}
+    if cam_config.rgb:
+        decoded['rgb'] = _decode_rgb(rgb, cam_config.image_size)
+    if cam_config.depth or cam_config.point_cloud:
+        decoded['depth'], decoded['depth_m'] = _decode_depth(
+            depth, cam_config.image_size, misc, camera)
+        if cam_config.point_cloud:
+            decoded['point_cloud'] = _point_cloud(
+                decoded['depth_m'], misc, camera)
+    if cam_config.mask:
+        decoded['mask'] = _decode_mask(mask, cam_config.image_size)
+    return decoded
+
+
+def _apply_decoded(obs: Observation, camera: str, cam_config: CameraConfig,
+                   decoded: dict) -> None:
+    if 'rgb' in decoded:
+        setattr(obs, '%s_rgb' % camera, decoded['rgb'])
+    if 'depth' in decoded:
+        setattr(obs, '%s_depth' % camera, _select_depth(
+            decoded['depth'], decoded['depth_m'], cam_config))
+    if 'point_cloud' in decoded:
+        setattr(obs, '%s_point_cloud' % camera, decoded['point_cloud'])
+    if 'mask' in decoded:
+        setattr(obs, '%s_mask' % camera, decoded['mask'])
+
+
+def _camera_loaders(obs: Observation, camera: str, cam_config: CameraConfig,
+                    fetch) -> dict:
+    """Lazy counterpart of _decode_camera.
+
+    Returns field name to callable, where fetch(camera, modality) returns
+    the stored image. Depth is decoded at most once, even when both the depth
+    and point cloud of the camera are accessed.
+    """
+    loaders = {}
+    size = cam_config.image_size
+    if cam_config.rgb:
+        loaders['%s_rgb' % camera] = lambda: _decode_rgb(
+            fetch(camera, 'rgb'), size)
+    if cam_config.depth or cam_config.point_cloud:
+        decoded = []
+
+        def depth_and_meters():
+            if len(decoded) == 0:
+                decoded.extend(_decode_depth(
+                    fetch(camera, 'depth'), size, obs.misc, camera))
+            return decoded
+
+        if cam_config.depth:
+            loaders['%s_depth' % camera] = lambda: _select_depth(
+                *depth_and_meters(), cam_config)
+        if cam_config.point_cloud:
+            loaders['%s_point_cloud' % camera] = lambda: _point_cloud(
+                depth_and_meters()[1], obs.misc, camera)
+    if cam_config.mask:
+        loaders['%s_mask' % camera] = lambda: _decode_mask(
+            fetch(camera, 'mask'), size)
+    return loaders
+
+
+def _lazy_observation(obs: Observation, obs_config: ObservationConfig,
+                      fetch) -> LazyObservation:
+    loaders = {}
+    for camera in CAMERAS:
+        loaders.update(_camera_loaders(
+            obs, camera, getattr(obs_config, '%s_camera' % camera), fetch))
+    return LazyObservation(obs, loaders)
+
+
+def _decode_rgb(rgb, size) -> np.ndarray:
+    rgb = _resize_if_needed(rgb, size)
+    return rgb if isinstance(rgb, np.ndarray) else np.array(rgb)
+
+
+def _decode_depth(depth, size, misc: dict, camera: str):
+    """Returns the depth in the stored 0-1 range, and in meters."""
+    depth = rgb_array_to_float_array(
+        _resize_if_needed(depth, size), DEPTH_SCALE)
+    near = misc['%s_camera_near' % camera]
+    far = misc['%s_camera_far' % camera]
+    return depth, near + depth * (far - near)
+
+
+def _select_depth(depth, depth_m, cam_config: CameraConfig):
+    if not cam_config.depth:
+        return None
+    d = depth_m if cam_config.depth_in_meters else depth
+    return cam_config.depth_noise.apply(d)
+
+
+def _point_cloud(depth_m, misc: dict, camera: str) -> np.ndarray:
+    return VisionSensor.pointcloud_from_depth_and_camera_params(
+        depth_m,
+        misc['%s_camera_extrinsics' % camera],
+        misc['%s_camera_intrinsics' % camera])
+
+
+def _decode_mask(mask, size) -> np.ndarray:
+    # Masks are stored as coded RGB images.
+    # Here we transform them into 1 channel handles.
+    return rgb_handles_to_mask(np.array(_resize_if_needed(mask, size)))
+
+
+def _png_fetcher(example_path: str, i: int, levels: dict = None):
+    def fetch(camera, modality):
+        return Image.open(join(
+            example_path, _stored_name(levels, camera, modality),
+            IMAGE_FORMAT % i))
+    return fetch
+
+
+class _ColumnFetcher(object):
+    """Reads each episode file column at most once, on first use."""
+
+    def __init__(self, episode: EpisodeFile, levels: dict = None):
+        self._episode = episode
+        self._levels = levels
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def at_step(self, i: int):
+        def fetch(camera, modality):
+            name = _stored_name(self._levels, camera, modality)
+            with self._lock:
+                if name not in self._columns:
+                    self._columns[name] = self._episode.read(name)
+            return self._columns[name][i]
+        return fetch
+
+
+def _open_image(path):
+    return None if path is None else Image.open(path)
 
 
 def _resize_if_needed(image, size):
+    if isinstance(image, np.ndarray):
+        if image.shape[1] == size[0] and image.shape[0] == size[1]:
+            return image
+        image = Image.fromarray(image)
     if image.size[0] != size[0] or image.size[1] != size[1]:
         image = image.resize(size)
     return image
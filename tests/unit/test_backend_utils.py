@@ -0,0 +1,75 @@
+import unittest
+
+import numpy as np
+
+from rlbench.backend import utils
+from rlbench.backend.const import DEPTH_SCALE
+
+
+def reference_encode(float_array, scale_factor):
+    # The per-channel implementation the codec replaced.
+    scaled_array = np.floor(float_array * scale_factor + 0.5)
+    scaled_array = np.clip(scaled_array, 0, 2**24 - 1)
+    int_array = scaled_array.astype(np.uint32)
+    rg = np.divide(int_array, 256)
+    rgb_array = np.zeros(int_array.shape + (3,), dtype=np.uint8)
+    rgb_array[..., 0] = np.divide(rg, 256)
+    rgb_array[..., 1] = np.mod(rg, 256)
+    rgb_array[..., 2] = np.mod(int_array, 256)
+    return rgb_array
+
+
+def reference_decode(rgb_array, scale_factor):
+    return np.sum(rgb_array * [65536, 256, 1], axis=2) / scale_factor
+
+
+class TestDepthEncoding(unittest.TestCase):
+
+    def setUp(self):
+        self.depth = np.random.uniform(size=(16, 24)).astype(np.float32)
+
+    def test_matches_reference_encoding(self):
+        depth = self.depth.copy()
+        # Including the bounds, and depths clipped to them.
+        depth[0, :4] = [0.0, 1.0, -0.5, 1.5]
+        expected = reference_encode(depth, DEPTH_SCALE)
+        np.testing.assert_array_equal(
+            utils.float_array_to_rgb_array(depth, DEPTH_SCALE), expected)
+        np.testing.assert_array_equal(
+            np.array(utils.float_array_to_rgb_image(depth, DEPTH_SCALE)),
+            expected)
+        np.testing.assert_array_equal(
+            utils.rgb_array_to_float_array(expected, DEPTH_SCALE),
+            reference_decode(expected, DEPTH_SCALE))
+
+    def test_known_encodings(self):
+        depth = np.array([[0.0, 1.0, 2.0, -1.0,
+                           (65536 + 2 * 256 + 3) / DEPTH_SCALE,
+                           (DEPTH_SCALE - 1) / DEPTH_SCALE]])
+        np.testing.assert_array_equal(
+            utils.float_array_to_rgb_array(depth, DEPTH_SCALE),
+            [[[0, 0, 0], [255, 255, 255], [255, 255, 255], [0, 0, 0],
+              [1, 2, 3], [255, 255, 254]]])
+
+    def test_round_trip(self):
+        encoded = utils.float_array_to_rgb_array(self.depth, DEPTH_SCALE)
+        decoded = utils.rgb_array_to_float_array(encoded, DEPTH_SCALE)
+        np.testing.assert_allclose(decoded, self.depth, atol=1.0 / DEPTH_SCALE)
+
+    def test_out_and_dtype(self):
+        encoded = utils.float_array_to_rgb_array(self.depth, DEPTH_SCALE)
+        out = np.empty(self.depth.shape, dtype=np.float32)
+        decoded = utils.rgb_array_to_float_array(encoded, DEPTH_SCALE, out=out)
+        self.assertIs(decoded, out)
+        self.assertEqual(utils.rgb_array_to_float_array(
+            encoded, DEPTH_SCALE, dtype=np.float32).dtype, np.float32)
+
+
+class TestDetectKeyframes(unittest.TestCase):
+
+    def test_gripper_changes_stops_and_last_step(self):
+        gripper_open = [1, 1, 1, 0, 0, 0, 0]
+        velocities = np.ones((7, 2))
+        velocities[2] = velocities[5] = velocities[6] = 0
+        self.assertEqual(utils.detect_keyframes(gripper_open, velocities),
+                         [2, 3, 5, 6])
@@ -0,0 +1,106 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from os import path
+
+import numpy as np
+
+from rlbench import utils
+from rlbench.backend import manifest
+from rlbench.backend.const import CAMERAS, EPISODE_FILE, EPISODES_FOLDER, \
+    LOW_DIM_PICKLE, VARIATION_DESCRIPTIONS
+from rlbench.observation_config import ObservationConfig
+
+ASSET_DIR = path.join(path.dirname(path.abspath(__file__)), 'assets', 'tasks')
+ROOT = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
+CONVERTER = path.join(ROOT, 'tools', 'convert_dataset.py')
+
+
+class TestConvertDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = path.join(self.tmp_dir, 'source')
+        self.output = path.join(self.tmp_dir, 'output')
+        shutil.copytree(ASSET_DIR, self.source)
+        # A variation where every episode fails to convert.
+        task = path.join(self.source, 'reach_target')
+        shutil.copytree(path.join(task, 'variation0'),
+                        path.join(task, 'variation1'))
+        episodes = path.join(task, 'variation1', 'episodes')
+        for example in os.listdir(episodes):
+            os.remove(path.join(episodes, example, LOW_DIM_PICKLE))
+        self.obs_config = ObservationConfig()
+        self.obs_config.set_all(True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def convert(self):
+        return subprocess.run(
+            [sys.executable, CONVERTER, '--dataset_root=' + self.source,
+             '--output_root=' + self.output],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            # Convert with this checkout of rlbench, installed or not.
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(
+                [ROOT] + [os.environ.get('PYTHONPATH', '')])))
+
+    def test_converted_episodes_load_as_source(self):
+        result = self.convert()
+        self.assertEqual(result.returncode, 0, result.stdout)
+        num_episodes = len(utils.list_stored_episodes(
+            self.source, 'reach_target', 0))
+        self.assertIn('%d episodes failed' % num_episodes, result.stdout)
+        self.assertIsNotNone(manifest.read_manifest(
+            path.join(self.output, 'reach_target', 'variation0')))
+        self.assertIsNone(manifest.read_manifest(
+            path.join(self.output, 'reach_target', 'variation1')))
+        self.assertTrue(path.exists(path.join(
+            self.output, 'reach_target', 'variation1',
+            VARIATION_DESCRIPTIONS)))
+
+        expected = utils.get_stored_demos(
+            -1, False, self.source, 0, 'reach_target', self.obs_config,
+            random_selection=False)
+        converted = utils.get_stored_demos(
+            -1, False, self.output, 0, 'reach_target', self.obs_config,
+            random_selection=False)
+        self.assertEqual(len(converted), len(expected))
+        for demo, expected_demo in zip(converted, expected):
+            self.assertEqual(len(demo), len(expected_demo))
+            for ob, expected_ob in zip(demo, expected_demo):
+                np.testing.assert_array_equal(
+                    ob.joint_positions, expected_ob.joint_positions)
+                for camera in CAMERAS:
+                    for modality in ['rgb', 'depth', 'mask', 'point_cloud']:
+                        name = '%s_%s' % (camera, modality)
+                        np.testing.assert_array_equal(
+                            getattr(ob, name), getattr(expected_ob, name))
+
+    def test_conversion_resumes(self):
+        self.convert()
+        result = self.convert()
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertIn('Converted 0 episodes (0 steps', result.stdout)
+
+    def test_resume_does_not_read_converted_episodes(self):
+        self.convert()
+        variation = path.join(self.output, 'reach_target', 'variation0')
+        entries = manifest.read_manifest(variation)['episodes']
+        # Same size, other content: only reading the file would notice.
+        episode = path.join(variation, EPISODES_FOLDER, entries[0]['id'],
+                            EPISODE_FILE)
+        with open(episode, 'r+b') as f:
+            first = f.read(1)
+            f.seek(0)
+            f.write(bytes([first[0] ^ 0xff]))
+        result = self.convert()
+        self.assertEqual(result.returncode, 0, result.stdout)
+        # Only the episodes of variation1, which cannot be converted.
+        self.assertIn('%d episodes failed' % len(entries), result.stdout)
+        self.assertEqual(manifest.read_manifest(variation)['episodes'],
+                         entries)
@@ -0,0 +1,350 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from os import path
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from rlbench import utils
+from rlbench.backend.const import DEPTH_SCALE, EPISODE_FILE, \
+    EPISODE_FOLDER, EPISODE_FOOTER, EPISODES_FOLDER
+from rlbench.backend.observation import Observation
+from rlbench.backend.utils import float_array_to_rgb_array, \
+    rgb_array_to_float_array
+from rlbench.demo import Demo
+from rlbench.observation_config import ObservationConfig
+from tools import dataset_generator
+from tools.dataset_generator import EpisodeWriter, ManifestTracker, \
+    WorkScheduler, downsample, save_demo, _episodes_to_collect
+
+
+def _make_demo(num_steps=3, size=16, seed=0):
+    random = np.random.RandomState(seed)
+    observations = []
+    for i in range(num_steps):
+        obs = Observation(*([None] * 29), misc={
+            'front_camera_near': 0.1, 'front_camera_far': 3.5})
+        obs.joint_positions = random.uniform(size=7)
+        obs.gripper_open = float(i % 2)
+        obs.front_rgb = random.randint(0, 255, (size, size, 3),
+                                       dtype=np.uint8)
+        obs.front_depth = random.uniform(size=(size, size))
+        observations.append(obs)
+    return Demo(observations, random_seed=seed)
+
+
+class TestWorkScheduler(unittest.TestCase):
+
+    def discover(self, scheduler, episodes):
+        # Every task is looked at first, as the generator does.
+        for task, task_episodes in enumerate(episodes):
+            self.assertEqual(scheduler.next(0), ('variations', task))
+            self.assertIsNone(scheduler.finish(0))
+            scheduler.add_variations(task, task_episodes)
+
+    def test_items_are_runs_of_consecutive_episodes(self):
+        scheduler = WorkScheduler(1, 3)
+        self.discover(scheduler, [{0: list(range(7)), 1: [0, 1, 4, 5, 6]}])
+        items = []
+        while not scheduler.done():
+            items.append(scheduler.next(0, 0))
+            scheduler.finish(0)
+        self.assertEqual(items, [
+            ('episodes', 0, 0, 0, 3), ('episodes', 0, 0, 3, 6),
+            ('episodes', 0, 0, 6, 7), ('episodes', 0, 1, 0, 2),
+            ('episodes', 0, 1, 4, 7)])
+
+    def test_loaded_task_then_new_tasks_then_stealing(self):
+        scheduler = WorkScheduler(3, 1)
+        self.assertEqual(scheduler.next(0), ('variations', 0))
+        self.assertEqual(scheduler.next(1), ('variations', 1))
+        scheduler.finish(0)
+        scheduler.finish(1)
+        scheduler.add_variations(0, {0: [0, 1, 2]})
+        scheduler.add_variations(1, {0: [0]})
+        self.assertEqual(scheduler.next(0, 0), ('episodes', 0, 0, 0, 1))
+        self.assertEqual(scheduler.next(1, 1), ('episodes', 1, 0, 0, 1))
+        self.assertEqual(scheduler.next(2, 1), ('variations', 2))
+        scheduler.finish(1)
+        # Nothing left of its own task, so it takes from the busiest one,
+        # starting from the end.
+        self.assertEqual(scheduler.next(1, 1), ('episodes', 0, 0, 2, 3))
+        self.assertEqual(scheduler.running(1), ('episodes', 0, 0, 2, 3))
+
+    def test_finishing_reports_the_last_item_of_a_variation(self):
+        scheduler = WorkScheduler(1, 1)
+        self.discover(scheduler, [{0: [0, 1]}])
+        scheduler.next(0, 0)
+        scheduler.next(1, 0)
+        self.assertIsNone(scheduler.finish(1))
+        self.assertEqual(scheduler.finish(0), (0, 0))
+        self.assertTrue(scheduler.done())
+
+    def test_failed_item_drops_the_rest_of_its_variation(self):
+        scheduler = WorkScheduler(1, 1)
+        self.discover(scheduler, [{0: [0, 1, 2], 1: [0]}])
+        self.assertEqual(scheduler.next(0, 0), ('episodes', 0, 0, 0, 1))
+        self.assertEqual(scheduler.finish(0, failed=True), (0, 0))
+        self.assertEqual(scheduler.failed, {(0, 0)})
+        self.assertEqual(scheduler.next(0, 0), ('episodes', 0, 1, 0, 1))
+        self.assertEqual(scheduler.finish(0), (0, 1))
+        self.assertTrue(scheduler.done())
+
+
+class TestManifestTracker(unittest.TestCase):
+
+    def test_waits_for_the_demos_of_every_item(self):
+        tracker = ManifestTracker()
+        key = (0, 0)
+        # Written before their item ended.
+        self.assertEqual(tracker.written(0, key, 'e0'), [])
+        tracker.collected(0, key, 2)
+        tracker.collected(1, key, 1)
+        self.assertEqual(tracker.finish(key), [])
+        self.assertEqual(tracker.written(1, key, 'e2'), [])
+        self.assertEqual(tracker.written(0, key, 'e1'),
+                         [(key, ['e0', 'e2', 'e1'])])
+
+    def test_demos_of_dead_processes_are_not_waited_for(self):
+        tracker = ManifestTracker()
+        key = (0, 0)
+        # Process 0 writes two demos and dies before its item ends, while
+        # process 1 has collected demos of the variation still to write.
+        tracker.written(0, key, 'e0')
+        tracker.written(0, key, 'e1')
+        self.assertEqual(tracker.exited(0), [])
+        tracker.collected(1, key, 2)
+        self.assertEqual(tracker.finish(key), [])
+        self.assertEqual(tracker.written(1, key, 'e5'), [])
+        # Failing to save still counts as written.
+        self.assertEqual(tracker.written(1, key), [(key, ['e0', 'e1', 'e5'])])
+
+    def test_demos_queued_by_dead_processes(self):
+        tracker = ManifestTracker()
+        key = (0, 0)
+        tracker.add(key, 'e0')
+        tracker.collected(0, key, 3)
+        self.assertEqual(tracker.finish(key), [])
+        self.assertEqual(tracker.exited(0), [(key, ['e0'])])
+
+
+class TestEpisodeWriter(unittest.TestCase):
+
+    def setUp(self):
+        # The writer takes its storage options from the flags' defaults.
+        if not dataset_generator.FLAGS.is_parsed():
+            dataset_generator.FLAGS.mark_as_parsed()
+            self.addCleanup(dataset_generator.FLAGS.unparse_flags)
+        self.sent = []
+        self.results = mock.Mock(send=self.sent.append)
+        self.release = {}
+        patcher = mock.patch.object(dataset_generator, 'save_demo',
+                                    side_effect=self.save_demo)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def save_demo(self, demo, episode_path, *args):
+        self.release[episode_path].wait()
+        if episode_path == 'broken':
+            raise IOError('disk full')
+        return episode_path
+
+    def write(self, writer, episode_path, release=True):
+        self.release[episode_path] = threading.Event()
+        if release:
+            self.release[episode_path].set()
+        writer.write(0, 1, None, episode_path)
+
+    def wait_for(self, num_sent):
+        deadline = time.time() + 10
+        while len(self.sent) < num_sent and time.time() < deadline:
+            time.sleep(0.01)
+        return [message[-2:] for message in self.sent]
+
+    def test_reports_in_order_as_soon_as_written(self):
+        writer = EpisodeWriter(0, self.results, 2, 4)
+        self.write(writer, 'e0', release=False)
+        self.write(writer, 'e1')
+        time.sleep(0.1)
+        # e1 is written, but waits for e0 to be reported first.
+        self.assertEqual(self.sent, [])
+        self.release['e0'].set()
+        # Without handing over another demo.
+        self.assertEqual(self.wait_for(2), [('e0', None), ('e1', None)])
+        writer.close()
+
+    def test_reports_failures(self):
+        writer = EpisodeWriter(3, self.results, 1, 4)
+        self.write(writer, 'broken')
+        writer.close()
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.sent[0][:5], ('written', 3, 0, 1, None))
+        self.assertIn('disk full', self.sent[0][5])
+
+    def test_waits_for_the_oldest_beyond_max_pending(self):
+        writer = EpisodeWriter(0, self.results, 1, 1)
+        self.write(writer, 'e0', release=False)
+        handed_over = threading.Event()
+
+        def write_next():
+            self.write(writer, 'e1')
+            handed_over.set()
+
+        thread = threading.Thread(target=write_next)
+        thread.start()
+        self.assertFalse(handed_over.wait(0.1))
+        self.release['e0'].set()
+        self.assertTrue(handed_over.wait(10))
+        thread.join()
+        writer.close()
+        self.assertEqual(self.wait_for(2), [('e0', None), ('e1', None)])
+
+
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.episodes = path.join(self.tmp_dir, EPISODES_FOLDER)
+        for i in range(5):
+            save_demo(_make_demo(seed=i), self.episode(i), 'episode_file')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def episode(self, i):
+        return path.join(self.episodes, EPISODE_FOLDER % i)
+
+    def test_complete_episodes_are_kept(self):
+        entries, missing = _episodes_to_collect(self.tmp_dir, 6)
+        self.assertEqual([e['id'] for e in entries],
+                         [EPISODE_FOLDER % i for i in range(5)])
+        self.assertEqual(missing, [5])
+
+    def test_partial_episodes_are_collected_again(self):
+        episode_file = path.join(self.episode(1), EPISODE_FILE)
+        with open(episode_file, 'r+b') as f:
+            f.truncate(os.path.getsize(episode_file) - 1)
+        # Written before there were footers, so it cannot be checked.
+        os.remove(path.join(self.episode(3), EPISODE_FOOTER))
+        # Left behind by a process that died while writing it.
+        shutil.move(self.episode(4), self.episode(4) + '.tmp123')
+        entries, missing = _episodes_to_collect(self.tmp_dir, 5)
+        self.assertEqual([e['id'] for e in entries],
+                         [EPISODE_FOLDER % i for i in [0, 2]])
+        self.assertEqual(missing, [1, 3, 4])
+
+    def test_interrupted_replacements_are_undone(self):
+        # Died between moving episode 1 aside and moving its new copy in.
+        shutil.move(self.episode(1), self.episode(1) + '.old123')
+        # Died before deleting the episode 2 that was replaced.
+        shutil.copytree(self.episode(2), self.episode(2) + '.old123')
+        self.assertEqual(_episodes_to_collect(self.tmp_dir, 5)[1], [])
+        self.assertEqual(sorted(os.listdir(self.episodes)),
+                         [EPISODE_FOLDER % i for i in range(5)])
+
+    def test_checksums(self):
+        episode_file = path.join(self.episode(2), EPISODE_FILE)
+        with open(episode_file, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0xff]))
+        self.assertEqual(_episodes_to_collect(self.tmp_dir, 5)[1], [])
+        self.assertEqual(
+            _episodes_to_collect(self.tmp_dir, 5, checksums=True)[1], [2])
+
+
+class TestImageLevels(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.obs_config = ObservationConfig()
+        self.obs_config.set_all(False)
+        self.obs_config.set_all_low_dim(True)
+        self.obs_config.front_camera.rgb = True
+        self.obs_config.front_camera.depth = True
+        self.obs_config.front_camera.depth_in_meters = False
+        self.obs_config.front_camera.image_size = (8, 8)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_levels_are_loaded_as_stored(self):
+        demo = _make_demo()
+        expected = []
+        for obs in demo:
+            rgb = downsample(Image.fromarray(obs.front_rgb), 'rgb', [8, 8])
+            depth = downsample(Image.fromarray(float_array_to_rgb_array(
+                obs.front_depth, DEPTH_SCALE)), 'depth', [8, 8])
+            expected.append((np.array(rgb), rgb_array_to_float_array(
+                np.array(depth), DEPTH_SCALE)))
+        for storage_format in ['png', 'episode_file']:
+            example_path = path.join(self.tmp_dir, storage_format)
+            entry = save_demo(_make_demo(), example_path, storage_format,
+                              image_levels=[[8, 8]])
+            for lazy in [False, True]:
+                for with_entry in [entry, None]:
+                    loaded = utils.load_stored_demo(
+                        example_path, self.obs_config, lazy=lazy,
+                        entry=with_entry)
+                    for obs, (rgb, depth) in zip(loaded, expected):
+                        np.testing.assert_array_equal(obs.front_rgb, rgb)
+                        np.testing.assert_array_equal(obs.front_depth, depth)
+
+
+class TestMemoryMappedDemos(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.obs_config = ObservationConfig()
+        self.obs_config.set_all(False)
+        self.obs_config.set_all_low_dim(True)
+        self.obs_config.front_camera.rgb = True
+        self.obs_config.front_camera.depth = True
+        self.obs_config.front_camera.image_size = (16, 16)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def save(self, name, **kwargs):
+        demo = _make_demo(num_steps=5)
+        # Repeated frames, for deduplicate_frames to find.
+        for obs in demo[2:]:
+            obs.front_rgb = demo[1].front_rgb
+            obs.front_depth = demo[1].front_depth
+        example_path = path.join(self.tmp_dir, name)
+        save_demo(demo, example_path, 'episode_file', **kwargs)
+        return example_path
+
+    def assert_loads_as_eager(self, example_path):
+        expected = utils.load_stored_demo(example_path, self.obs_config)
+        mapped = utils.load_stored_demo(example_path, self.obs_config,
+                                        memory_map=True)
+        self.assertEqual(len(mapped), len(expected))
+        for obs, expected_obs in zip(mapped, expected):
+            np.testing.assert_array_equal(
+                obs.joint_positions, expected_obs.joint_positions)
+            np.testing.assert_array_equal(obs.front_rgb,
+                                          expected_obs.front_rgb)
+            np.testing.assert_array_equal(obs.front_depth,
+                                          expected_obs.front_depth)
+        return mapped
+
+    def test_rgb_frames_are_views_of_the_file(self):
+        mapped = self.assert_loads_as_eager(self.save('plain'))
+        for obs in mapped:
+            self.assertFalse(obs.front_rgb.flags.writeable)
+            self.assertFalse(obs.front_rgb.flags.owndata)
+
+    def test_compressed_and_deduplicated(self):
+        for name, kwargs in [
+                ('compressed', dict(compress_images=True)),
+                ('deduplicated', dict(deduplicate_frames=True)),
+                ('both', dict(compress_images=True,
+                              deduplicate_frames=True))]:
+            self.assert_loads_as_eager(self.save(name, **kwargs))
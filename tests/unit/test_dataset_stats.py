@@ -0,0 +1,44 @@
+import unittest
+
+import numpy as np
+
+from rlbench.backend import dataset_stats
+from rlbench.backend.dataset_stats import RunningStats
+from rlbench.backend.observation import Observation
+from rlbench.demo import Demo
+
+
+class TestDatasetStats(unittest.TestCase):
+
+    def test_merge_matches_single_pass(self):
+        values = np.random.uniform(-2, 5, size=(50, 3))
+        merged = RunningStats()
+        for part in np.split(values, [7, 8, 30]):
+            merged.merge(RunningStats.from_array(part))
+        self.assertEqual(merged.count, 50)
+        np.testing.assert_allclose(merged.mean, values.mean(axis=0))
+        np.testing.assert_allclose(merged.std, values.std(axis=0))
+        np.testing.assert_array_equal(merged.min, values.min(axis=0))
+        np.testing.assert_array_equal(merged.max, values.max(axis=0))
+
+    def test_dict_round_trip(self):
+        stats = RunningStats.from_array(np.arange(6.0).reshape(3, 2))
+        restored = RunningStats.from_dict(stats.to_dict())
+        np.testing.assert_array_equal(restored.mean, stats.mean)
+        np.testing.assert_array_equal(restored.m2, stats.m2)
+
+    def test_episode_stats(self):
+        observations = []
+        for i in range(4):
+            obs = Observation(*([None] * 29), misc={
+                'front_camera_near': 1.0, 'front_camera_far': 3.0})
+            obs.joint_positions = np.arange(7) * float(i)
+            obs.front_depth = np.full((2, 2), i / 4.0)
+            observations.append(obs)
+        stats = dataset_stats.episode_stats(Demo(observations))
+        self.assertNotIn('joint_velocities', stats)
+        np.testing.assert_allclose(stats['joint_positions'].mean,
+                                   np.arange(7) * 1.5)
+        self.assertEqual(stats['front_depth'].count, 16)
+        self.assertAlmostEqual(float(stats['front_depth_m'].min), 1.0)
+        self.assertAlmostEqual(float(stats['front_depth_m'].max), 2.5)
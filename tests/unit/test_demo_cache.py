@@ -0,0 +1,116 @@
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from os import path
+
+import numpy as np
+
+from rlbench import utils
+from rlbench.demo_cache import SharedDemoCache
+from rlbench.noise_model import GaussianNoise
+from rlbench.observation_config import ObservationConfig
+
+ASSET_DIR = path.join(path.dirname(path.abspath(__file__)), 'assets', 'tasks')
+EPISODE = path.join(ASSET_DIR, 'reach_target', 'variation0', 'episodes',
+                    'episode0')
+
+
+class TestSharedDemoCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.obs_config = ObservationConfig()
+        self.obs_config.set_all(False)
+        self.obs_config.set_all_low_dim(True)
+        self.obs_config.front_camera.rgb = True
+        self.expected = utils.load_stored_demo(EPISODE, self.obs_config)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def load(self, cache, obs_config=None):
+        return utils.load_stored_demo(EPISODE, obs_config or self.obs_config,
+                                      demo_cache=cache)
+
+    def test_published_demo_is_shared(self):
+        self.load(SharedDemoCache(1 << 30, self.tmp_dir))
+        cache = SharedDemoCache(1 << 30, self.tmp_dir)
+        demo = self.load(cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertEqual(len(demo), len(self.expected))
+        np.testing.assert_array_equal(demo[3].front_rgb,
+                                      self.expected[3].front_rgb)
+        self.assertFalse(demo[3].front_rgb.flags.writeable)
+
+    def test_config_is_part_of_the_key(self):
+        cache = SharedDemoCache(1 << 30, self.tmp_dir)
+        self.load(cache)
+        config = ObservationConfig()
+        config.set_all(False)
+        config.set_all_low_dim(True)
+        self.assertIsNone(self.load(cache, config)[0].front_rgb)
+        self.assertEqual(cache.misses, 2)
+
+    def test_stochastic_noise_is_not_cached(self):
+        cache = SharedDemoCache(1 << 30, self.tmp_dir)
+        self.obs_config.front_camera.depth = True
+        self.obs_config.front_camera.depth_noise = GaussianNoise(0.1)
+        self.load(cache)
+        self.load(cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+    def test_budget_evicts(self):
+        cache = SharedDemoCache(1 << 30, self.tmp_dir)
+        self.load(cache)
+        with open(path.join(self.tmp_dir, 'index.json')) as f:
+            size = next(iter(json.load(f)['demos'].values()))['bytes']
+        cache = SharedDemoCache(size, self.tmp_dir)
+        config = ObservationConfig()
+        config.set_all(False)
+        self.load(cache, config)
+        self.load(cache)
+        self.assertEqual(cache.misses, 2)
+
+    def test_claims_of_dead_processes_are_dropped(self):
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        cache = SharedDemoCache(1 << 30, self.tmp_dir)
+        key = cache.key(EPISODE, self.obs_config,
+                        {'keyframes_only': False})
+        with open(path.join(self.tmp_dir, 'index.json'), 'w') as f:
+            json.dump({'demos': {}, 'loading': {key: dead.pid}}, f)
+        self.load(cache)
+        self.assertEqual(cache.misses, 1)
+
+
+class TestDemoCache(unittest.TestCase):
+
+    def setUp(self):
+        self.obs_config = ObservationConfig()
+        self.obs_config.set_all(False)
+        self.obs_config.set_all_low_dim(True)
+        self.obs_config.front_camera.rgb = True
+
+    def test_repeated_loads_hit(self):
+        cache = utils.DemoCache()
+        for _ in range(3):
+            demos = utils.get_stored_demos(
+                -1, False, ASSET_DIR, 0, 'reach_target', self.obs_config,
+                random_selection=True, demo_cache=cache)
+        self.assertEqual(cache.misses, len(demos))
+        self.assertEqual(cache.hits, 2 * len(demos))
+        self.assertFalse(demos[0][0].front_rgb.flags.writeable)
+        demos[0][0].front_rgb = None
+        self.assertIsNotNone(utils.load_stored_demo(
+            EPISODE, self.obs_config, demo_cache=cache)[0].front_rgb)
+
+    def test_evicts_least_recently_used(self):
+        cache = utils.DemoCache(max_demos=1)
+        config = ObservationConfig()
+        config.set_all(False)
+        for obs_config in [self.obs_config, config, self.obs_config]:
+            utils.load_stored_demo(EPISODE, obs_config, demo_cache=cache)
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (0, 3, 1))
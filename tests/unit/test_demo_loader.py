@@ -0,0 +1,356 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from os import listdir, path
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from rlbench import demo_loader
+from rlbench import utils
+from rlbench.backend import manifest
+from rlbench.backend.const import EPISODE_FILE, IMAGE_FORMAT, LOW_DIM_FILE, \
+    LOW_DIM_PICKLE
+from rlbench.backend.episode_file import LOW_DIM_FIELDS, demo_to_columns, \
+    write_episode_file
+from rlbench.backend.observation import LazyObservation
+from rlbench.observation_config import ObservationConfig
+
+ASSET_DIR = path.join(path.dirname(path.abspath(__file__)), 'assets', 'tasks')
+
+
+class ReachTarget(object):
+    pass
+
+
+class TestDemoLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.obs_config = ObservationConfig()
+        self.obs_config.set_all(False)
+        self.obs_config.set_all_low_dim(True)
+
+    def test_task_name_from_class(self):
+        self.assertEqual(demo_loader.task_name(ReachTarget), 'reach_target')
+
+    def test_deterministic_order(self):
+        episodes = demo_loader.list_episodes(ASSET_DIR, ['reach_target'])
+        self.assertEqual([e[2] for e in episodes],
+                         list(range(len(episodes))))
+
+    def test_shards_are_disjoint(self):
+        episodes = demo_loader.list_episodes(ASSET_DIR, ['reach_target'])
+        shards = [demo_loader.list_episodes(
+            ASSET_DIR, ['reach_target'], shuffle=True, seed=3,
+            shard_index=i, num_shards=2) for i in range(2)]
+        self.assertEqual(sorted(shards[0] + shards[1]), sorted(episodes))
+
+    def test_unseeded_shards_cover_every_episode_once(self):
+        episodes = demo_loader.list_episodes(ASSET_DIR, ['reach_target'])
+        for seeds in [[None] * 3, [0, 1, 2]]:
+            shards = [demo_loader.list_episodes(
+                ASSET_DIR, ['reach_target'], shuffle=True, seed=seed,
+                shard_index=i, num_shards=3) for i, seed in enumerate(seeds)]
+            listed = [e for shard in shards for e in shard]
+            self.assertEqual(sorted(listed), sorted(episodes))
+
+    def test_iter_stored_demos(self):
+        streamed = list(demo_loader.iter_stored_demos(
+            ASSET_DIR, self.obs_config, [ReachTarget], read_ahead=1))
+        self.assertEqual(
+            [s[:3] for s in streamed],
+            [e[:3] for e in demo_loader.list_episodes(
+                ASSET_DIR, ['reach_target'])])
+        self.assertGreater(len(streamed[0][3]), 0)
+
+    def test_prefetch_demo_loader_batches(self):
+        expected = utils.get_stored_demos(
+            -1, False, ASSET_DIR, 0, 'reach_target', self.obs_config, False)
+        with demo_loader.PrefetchDemoLoader(
+                ASSET_DIR, 'reach_target', 0, self.obs_config,
+                random_selection=False, batch_size=2, prefetch=1,
+                num_workers=2) as loader:
+            demos = [demo for batch in loader for demo in batch]
+        self.assertEqual(len(demos), len(expected))
+        for demo, expected_demo in zip(demos, expected):
+            np.testing.assert_array_equal(demo[-1].joint_positions,
+                                          expected_demo[-1].joint_positions)
+
+    def test_prefetch_demo_loader_repeats(self):
+        loader = demo_loader.PrefetchDemoLoader(
+            ASSET_DIR, 'reach_target', 0, self.obs_config, amount=1,
+            repeat=True, seed=0)
+        self.assertEqual(len([next(loader) for _ in range(3)]), 3)
+        loader.close()
+        self.assertEqual(list(loader), [])
+
+    def test_prefetch_demo_loader_raises_load_errors(self):
+        loader = demo_loader.PrefetchDemoLoader(
+            ASSET_DIR, 'reach_target', 0, self.obs_config,
+            image_paths=True, keyframes_only=True)
+        with self.assertRaises(RuntimeError):
+            next(loader)
+
+    def test_load_episode_with_only_some_images_stored(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        episode = path.join(tmp_dir, 'episode0')
+        shutil.copytree(path.join(ASSET_DIR, 'reach_target', 'variation0',
+                                  'episodes', 'episode0'), episode)
+        for name in listdir(episode):
+            if name not in ['front_rgb', 'low_dim_obs.pkl']:
+                shutil.rmtree(path.join(episode, name))
+        self.obs_config.front_camera.rgb = True
+        demo = utils.load_stored_demo(episode, self.obs_config)
+        self.assertIsNotNone(demo[0].front_rgb)
+        self.obs_config.wrist_camera.depth = True
+        with self.assertRaises(RuntimeError):
+            utils.load_stored_demo(episode, self.obs_config)
+
+    def test_decode_pool_skips_unused_cameras(self):
+        self.obs_config.front_camera.rgb = True
+        episode = path.join(ASSET_DIR, 'reach_target', 'variation0',
+                            'episodes', 'episode0')
+        expected = utils.load_stored_demo(episode, self.obs_config)
+        with utils.DecodePool(num_threads=2) as pool, mock.patch.object(
+                utils, '_fetch_and_decode',
+                wraps=utils._fetch_and_decode) as fetch_and_decode:
+            demo = utils.load_stored_demo(episode, self.obs_config,
+                                          decode_pool=pool)
+        # One job per step, for the front camera only.
+        self.assertEqual(fetch_and_decode.call_count, len(expected))
+        for obs, expected_obs in zip(demo, expected):
+            np.testing.assert_array_equal(obs.front_rgb,
+                                          expected_obs.front_rgb)
+            self.assertIsNone(obs.wrist_rgb)
+
+
+class TestLazyDemos(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.png_episode = path.join(ASSET_DIR, 'reach_target', 'variation0',
+                                     'episodes', 'episode0')
+        # The same episode, stored as an episode file.
+        with open(path.join(self.png_episode, LOW_DIM_PICKLE), 'rb') as f:
+            demo = pickle.load(f)
+        columns, attrs = demo_to_columns(demo)
+        for name in ['front_rgb', 'front_depth']:
+            columns[name] = np.stack([np.array(Image.open(path.join(
+                self.png_episode, name, IMAGE_FORMAT % i)))
+                for i in range(len(demo))])
+        self.file_episode = path.join(self.tmp_dir, 'episode0')
+        os.makedirs(self.file_episode)
+        write_episode_file(path.join(self.file_episode, EPISODE_FILE),
+                           len(demo), columns, attrs)
+        self.obs_config = ObservationConfig()
+        self.obs_config.set_all(False)
+        self.obs_config.set_all_low_dim(True)
+        self.obs_config.front_camera.rgb = True
+        self.obs_config.front_camera.depth = True
+        self.obs_config.front_camera.point_cloud = True
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_images_are_decoded_on_access(self):
+        fields = ['front_rgb', 'front_depth', 'front_point_cloud']
+        for example_path in [self.png_episode, self.file_episode]:
+            expected = utils.load_stored_demo(example_path, self.obs_config)
+            with mock.patch.object(utils, '_decode_rgb',
+                                   wraps=utils._decode_rgb) as decode_rgb, \
+                    mock.patch.object(utils, '_decode_depth',
+                                      wraps=utils._decode_depth) as \
+                    decode_depth:
+                demo = utils.load_stored_demo(example_path, self.obs_config,
+                                              lazy=True)
+                for obs in demo:
+                    self.assertIsInstance(obs, LazyObservation)
+                    self.assertEqual(sorted(obs._loaders), sorted(fields))
+                    for field in fields:
+                        self.assertNotIn(field, obs.__dict__)
+                self.assertEqual(decode_rgb.call_count, 0)
+                self.assertEqual(decode_depth.call_count, 0)
+
+                np.testing.assert_array_equal(demo[1].front_rgb,
+                                              expected[1].front_rgb)
+                self.assertEqual(decode_rgb.call_count, 1)
+                self.assertEqual(decode_depth.call_count, 0)
+                np.testing.assert_array_equal(demo[1].front_depth,
+                                              expected[1].front_depth)
+                np.testing.assert_array_equal(
+                    demo[1].front_point_cloud, expected[1].front_point_cloud)
+                # Depth is decoded once for both.
+                self.assertEqual(decode_depth.call_count, 1)
+                self.assertEqual(sorted(demo[0]._loaders), sorted(fields))
+                for obs, expected_obs in zip(demo, expected):
+                    for field in fields:
+                        np.testing.assert_array_equal(
+                            getattr(obs, field), getattr(expected_obs, field))
+
+
+class TestPointCloudCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.episode = path.join(self.tmp_dir, 'episode0')
+        shutil.copytree(path.join(ASSET_DIR, 'reach_target', 'variation0',
+                                  'episodes', 'episode0'), self.episode)
+        self.obs_config = ObservationConfig()
+        self.obs_config.set_all(False)
+        self.obs_config.set_all_low_dim(True)
+        self.obs_config.front_camera.point_cloud = True
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def load(self, cache):
+        return utils.load_stored_demo(self.episode, self.obs_config,
+                                      point_cloud_cache=cache)
+
+    def rewrite_depth(self, folder):
+        # Zero depth: every point at the camera.
+        image = path.join(self.episode, folder, IMAGE_FORMAT % 0)
+        Image.fromarray(np.zeros_like(np.array(Image.open(image)))).save(
+            image)
+
+    def test_rewritten_depth_is_recomputed(self):
+        cache = utils.PointCloudCache(path.join(self.tmp_dir, 'cache'))
+        before = self.load(cache)[0].front_point_cloud
+        self.load(cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.rewrite_depth('front_depth')
+        after = self.load(cache)[0].front_point_cloud
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertFalse(np.array_equal(after, before))
+        np.testing.assert_array_equal(
+            after, utils.load_stored_demo(
+                self.episode, self.obs_config)[0].front_point_cloud)
+
+    def test_rewritten_depth_level_is_recomputed(self):
+        level = path.join(self.episode, 'front_depth_64x64')
+        os.makedirs(level)
+        for name in listdir(path.join(self.episode, 'front_depth')):
+            Image.open(path.join(self.episode, 'front_depth', name)).resize(
+                (64, 64), Image.NEAREST).save(path.join(level, name))
+        self.obs_config.front_camera.image_size = (64, 64)
+        cache = utils.PointCloudCache(path.join(self.tmp_dir, 'cache'))
+        self.load(cache)
+        self.rewrite_depth('front_depth_64x64')
+        self.load(cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+
+class TestStoredLowDimDemos(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.obs_config = ObservationConfig()
+        self.obs_config.set_all(False)
+        self.obs_config.set_all_low_dim(True)
+        self.expected = utils.get_stored_demos(
+            -1, False, ASSET_DIR, 0, 'reach_target', self.obs_config,
+            random_selection=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def dataset(self, storage):
+        # A copy of the test assets, with the low-dim data stored as given.
+        root = path.join(self.tmp_dir, storage)
+        shutil.copytree(ASSET_DIR, root)
+        episodes = path.join(root, 'reach_target', 'variation0', 'episodes')
+        for example in listdir(episodes):
+            example_path = path.join(episodes, example)
+            with open(path.join(example_path, LOW_DIM_PICKLE), 'rb') as f:
+                demo = pickle.load(f)
+            columns, attrs = demo_to_columns(demo)
+            if storage == 'episode_file':
+                shutil.rmtree(example_path)
+                os.makedirs(example_path)
+                write_episode_file(path.join(example_path, EPISODE_FILE),
+                                   len(demo), columns, attrs)
+            elif storage == 'low_dim_file':
+                write_episode_file(path.join(example_path, LOW_DIM_FILE),
+                                   len(demo), columns, attrs)
+        return root
+
+    def assert_demos_equal(self, demos, expected):
+        self.assertEqual(len(demos), len(expected))
+        for demo, expected_demo in zip(demos, expected):
+            self.assertEqual(len(demo), len(expected_demo))
+            for ob, expected_ob in zip(demo, expected_demo):
+                for field in LOW_DIM_FIELDS:
+                    np.testing.assert_array_equal(
+                        getattr(ob, field), getattr(expected_ob, field))
+                self.assertIsNone(ob.front_rgb)
+                self.assertEqual(sorted(ob.misc), sorted(expected_ob.misc))
+                for key, value in expected_ob.misc.items():
+                    np.testing.assert_array_equal(ob.misc[key], value)
+
+    def test_matches_get_stored_demos(self):
+        for storage in ['png', 'low_dim_file', 'episode_file']:
+            root = ASSET_DIR if storage == 'png' else self.dataset(storage)
+            self.assert_demos_equal(utils.get_stored_low_dim_demos(
+                root, 'reach_target', 0, self.obs_config), self.expected)
+
+    def test_unused_fields_are_removed(self):
+        self.obs_config.joint_velocities = False
+        for storage in ['png', 'episode_file']:
+            root = ASSET_DIR if storage == 'png' else self.dataset(storage)
+            demos = utils.get_stored_low_dim_demos(
+                root, 'reach_target', 0, self.obs_config)
+            self.assertIsNone(demos[0][0].joint_velocities)
+            self.assertIsNotNone(demos[0][0].joint_positions)
+
+
+class TestVerifyStoredEpisodes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        shutil.copytree(ASSET_DIR, self.tmp_dir, dirs_exist_ok=True)
+        self.episodes = path.join(self.tmp_dir, 'reach_target', 'variation0',
+                                  'episodes')
+        for example in listdir(self.episodes):
+            example_path = path.join(self.episodes, example)
+            low_dim = path.join(example_path, LOW_DIM_PICKLE)
+            manifest.write_episode_footer(example_path, manifest.episode_entry(
+                example, 1, 'png', [], {},
+                {LOW_DIM_PICKLE: manifest.file_checksum(low_dim)}))
+        # Same size, one bit flipped.
+        with open(path.join(self.episodes, 'episode1', LOW_DIM_PICKLE),
+                  'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)[0]
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last ^ 1]))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def listed(self, verify):
+        return [example for example, _ in utils.list_stored_episodes(
+            self.tmp_dir, 'reach_target', 0, verify=verify)]
+
+    def test_checksums_catch_corrupt_episodes(self):
+        examples = sorted(listdir(self.episodes))
+        self.assertEqual(self.listed('sizes'), examples)
+        self.assertEqual(self.listed(True), examples)
+        with self.assertLogs(level='WARNING'):
+            listed = self.listed('checksums')
+        self.assertEqual(listed, [e for e in examples if e != 'episode1'])
+        obs_config = ObservationConfig()
+        obs_config.set_all(False)
+        obs_config.set_all_low_dim(True)
+        with self.assertLogs(level='WARNING'):
+            demos = utils.get_stored_demos(
+                -1, False, self.tmp_dir, 0, 'reach_target', obs_config,
+                random_selection=False, verify='checksums')
+        self.assertEqual(len(demos), len(examples) - 1)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            self.listed('crc')
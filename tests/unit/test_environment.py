@@ -1,3 +1,5 @@
+import shutil
+import tempfile
 import unittest
 from os import path
 
@@ -5,6 +7,7 @@ import numpy as np
 from pyrep.objects import Dummy
 
 from rlbench import environment
+from rlbench import utils
 from rlbench.action_modes.action_mode import MoveArmThenGripper
 from rlbench.action_modes.arm_action_modes import JointVelocity, JointPosition, \
     EndEffectorPoseViaPlanning, JointTorque, EndEffectorPoseViaIK
@@ -113,6 +116,70 @@ class TestEnvironment(unittest.TestCase):
         self.assertIsInstance(demos[0][0].right_shoulder_rgb, np.ndarray)
         self.assertIsNone(demos[0][0].left_shoulder_rgb)
 
+    def test_get_stored_demos_with_decode_pool(self):
+        obs_config = ObservationConfig()
+        obs_config.set_all(False)
+        obs_config.set_all_low_dim(True)
+        obs_config.right_shoulder_camera.rgb = True
+        obs_config.left_shoulder_camera.point_cloud = True
+        action_mode = MoveArmThenGripper(JointVelocity(), Discrete())
+        self.env = environment.Environment(
+            action_mode, ASSET_DIR, obs_config, headless=True)
+        expected = self.env.get_demos(
+            'reach_target', 1, random_selection=False)
+        with utils.DecodePool(num_threads=2, num_processes=2) as pool:
+            demos = self.env.get_demos(
+                'reach_target', 1, random_selection=False, decode_pool=pool)
+        self.assertEqual(len(demos[0]), len(expected[0]))
+        for obs, expected_obs in zip(demos[0], expected[0]):
+            np.testing.assert_array_equal(
+                obs.right_shoulder_rgb, expected_obs.right_shoulder_rgb)
+            np.testing.assert_array_equal(
+                obs.left_shoulder_point_cloud,
+                expected_obs.left_shoulder_point_cloud)
+            self.assertIsNone(obs.left_shoulder_depth)
+
+    def test_get_stored_demos_with_point_cloud_cache(self):
+        obs_config = ObservationConfig()
+        obs_config.set_all(False)
+        obs_config.set_all_low_dim(True)
+        obs_config.left_shoulder_camera.point_cloud = True
+        action_mode = MoveArmThenGripper(JointVelocity(), Discrete())
+        self.env = environment.Environment(
+            action_mode, ASSET_DIR, obs_config, headless=True)
+        expected = self.env.get_demos(
+            'reach_target', 1, random_selection=False)
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = utils.PointCloudCache(cache_dir)
+            for _ in range(2):
+                demos = self.env.get_demos(
+                    'reach_target', 1, random_selection=False,
+                    point_cloud_cache=cache)
+                for obs, expected_obs in zip(demos[0], expected[0]):
+                    np.testing.assert_array_equal(
+                        obs.left_shoulder_point_cloud,
+                        expected_obs.left_shoulder_point_cloud)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_get_stored_demos_keyframes_only(self):
+        obs_config = ObservationConfig()
+        obs_config.set_all(False)
+        obs_config.set_all_low_dim(True)
+        obs_config.front_camera.rgb = True
+        action_mode = MoveArmThenGripper(JointVelocity(), Discrete())
+        self.env = environment.Environment(
+            action_mode, ASSET_DIR, obs_config, headless=True)
+        full = self.env.get_demos('reach_target', 1, random_selection=False)
+        demos = self.env.get_demos('reach_target', 1, random_selection=False,
+                                   keyframes_only=True)
+        self.assertGreater(len(demos[0]), 0)
+        self.assertLess(len(demos[0]), len(full[0]))
+        np.testing.assert_array_equal(demos[0][-1].front_rgb,
+                                      full[0][-1].front_rgb)
+
     def test_get_live_demos(self):
         task = self.get_task(
             ReachTarget, JointVelocity())
@@ -120,6 +187,7 @@ class TestEnvironment(unittest.TestCase):
         self.assertEqual(len(demos), 2)
         self.assertGreater(len(demos[0]), 0)
         self.assertIsInstance(demos[0][0].right_shoulder_rgb, np.ndarray)
+        self.assertEqual(demos[0].keyframes[-1], len(demos[0]) - 1)
 
     def test_observation_shape_constant_across_demo(self):
         task = self.get_task(
@@ -0,0 +1,163 @@
+import shutil
+import tempfile
+import unittest
+from os import path
+
+import numpy as np
+
+from rlbench.backend.episode_file import EpisodeFile, EpisodeFileError, \
+    write_episode_file, demo_to_columns, observations_from_episode_file, \
+    random_state_from_episode_file, keyframes_from_episode_file
+from rlbench.backend.observation import Observation
+from rlbench.demo import Demo
+
+
+def _make_observation(i):
+    obs = Observation(*([None] * 29), misc={
+        'front_camera_near': 0.1, 'front_camera_far': 3.5,
+        'front_camera_extrinsics': np.eye(4) * i})
+    obs.joint_positions = np.arange(7) * float(i)
+    obs.gripper_open = float(i % 2)
+    return obs
+
+
+class TestEpisodeFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file = path.join(self.tmp_dir, 'episode.rlb')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_columns_round_trip(self):
+        rgb = np.random.randint(0, 255, (5, 16, 16, 3), dtype=np.uint8)
+        pose = np.random.uniform(size=(5, 7))
+        write_episode_file(self.file, 5, {'front_rgb': rgb, 'pose': pose},
+                           {'name': 'test'})
+        episode = EpisodeFile(self.file)
+        self.assertEqual(episode.num_steps, 5)
+        self.assertEqual(episode.attrs, {'name': 'test'})
+        self.assertIn('front_rgb', episode)
+        np.testing.assert_array_equal(episode.read('front_rgb'), rgb)
+        np.testing.assert_array_equal(episode.read('pose'), pose)
+
+    def test_memory_mapped_read_is_view(self):
+        rgb = np.random.randint(0, 255, (3, 8, 8, 3), dtype=np.uint8)
+        write_episode_file(self.file, 3, {'front_rgb': rgb})
+        episode = EpisodeFile(self.file, memory_map=True)
+        self.assertTrue(episode.memory_mapped)
+        column = episode.read('front_rgb')
+        np.testing.assert_array_equal(column, rgb)
+        self.assertFalse(column.flags.owndata)
+        self.assertFalse(column[1].flags.writeable)
+
+    def test_preloaded_read_is_writeable(self):
+        pose = np.random.uniform(size=(3, 7))
+        write_episode_file(self.file, 3, {'pose': pose})
+        episode = EpisodeFile(self.file, preload=True)
+        self.assertFalse(episode.memory_mapped)
+        column = episode.read('pose')
+        np.testing.assert_array_equal(column, pose)
+        self.assertTrue(column.flags.writeable)
+
+    def test_static_misc_stored_once(self):
+        demo = Demo([_make_observation(i) for i in range(3)])
+        columns, _ = demo_to_columns(demo)
+        self.assertEqual(columns['misc_static/front_camera_far'].shape, ())
+        self.assertIn('misc/front_camera_extrinsics', columns)
+
+    def test_delta_compressed_round_trip(self):
+        rgb = np.zeros((7, 8, 8, 3), dtype=np.uint8)
+        for i in range(7):
+            rgb[i, i] = 255 - i
+        write_episode_file(self.file, 7, {'front_rgb': rgb},
+                           compress=['front_rgb'], keyframe_interval=3)
+        for memory_map in [False, True]:
+            episode = EpisodeFile(self.file, memory_map=memory_map)
+            self.assertTrue(episode.compressed('front_rgb'))
+            np.testing.assert_array_equal(episode.read('front_rgb'), rgb)
+            for i in [0, 4, -1]:
+                np.testing.assert_array_equal(
+                    episode.read_step('front_rgb', i), rgb[i])
+
+    def test_delta_compression_needs_unsigned(self):
+        with self.assertRaises(EpisodeFileError):
+            write_episode_file(self.file, 2, {'pose': np.zeros((2, 7))},
+                               compress=['pose'])
+
+    def test_deduplicated_round_trip(self):
+        rgb = np.random.randint(0, 255, (3, 8, 8, 3), dtype=np.uint8)
+        # Steps 0, 0, 1, 1, 1, 2, 0.
+        rgb = rgb[[0, 0, 1, 1, 1, 2, 0]]
+        for compress in [(), ['front_rgb']]:
+            write_episode_file(self.file, 7, {'front_rgb': rgb},
+                               compress=compress, keyframe_interval=2,
+                               deduplicate=['front_rgb'])
+            episode = EpisodeFile(self.file, memory_map=True)
+            self.assertEqual(episode.shape('front_rgb'), rgb.shape)
+            column = episode.read('front_rgb')
+            np.testing.assert_array_equal(column, rgb)
+            # Expanded steps must not alias each other.
+            self.assertTrue(column.flags.writeable)
+            for i in range(-1, 7):
+                np.testing.assert_array_equal(
+                    episode.read_step('front_rgb', i), rgb[i])
+
+    def test_missing_column(self):
+        write_episode_file(self.file, 1, {'a': np.zeros(1)})
+        with self.assertRaises(KeyError):
+            EpisodeFile(self.file).read('b')
+
+    def test_not_an_episode_file(self):
+        with open(self.file, 'wb') as f:
+            f.write(b'not an episode file')
+        with self.assertRaises(EpisodeFileError):
+            EpisodeFile(self.file)
+
+    def test_demo_low_dim_round_trip(self):
+        np.random.seed(3)
+        demo = Demo([_make_observation(i) for i in range(4)],
+                    random_seed=np.random.get_state())
+        columns, attrs = demo_to_columns(demo)
+        write_episode_file(self.file, len(demo), columns, attrs)
+        episode = EpisodeFile(self.file)
+        observations = observations_from_episode_file(episode)
+        self.assertEqual(len(observations), 4)
+        for expected, actual in zip(demo, observations):
+            np.testing.assert_array_equal(
+                expected.joint_positions, actual.joint_positions)
+            self.assertEqual(expected.gripper_open, actual.gripper_open)
+            self.assertIsNone(actual.joint_velocities)
+            self.assertIsNone(actual.front_rgb)
+            self.assertEqual(actual.misc['front_camera_far'], 3.5)
+            np.testing.assert_array_equal(
+                expected.misc['front_camera_extrinsics'],
+                actual.misc['front_camera_extrinsics'])
+        state = random_state_from_episode_file(episode)
+        np.testing.assert_array_equal(state[1], demo.random_seed[1])
+        self.assertEqual(state[2:], demo.random_seed[2:])
+        self.assertIsNone(keyframes_from_episode_file(episode))
+
+    def test_random_seed_round_trip(self):
+        demo = Demo([_make_observation(i) for i in range(2)],
+                    random_seed=2 ** 64 - 1)
+        columns, attrs = demo_to_columns(demo)
+        write_episode_file(self.file, len(demo), columns, attrs)
+        self.assertEqual(
+            random_state_from_episode_file(EpisodeFile(self.file)),
+            2 ** 64 - 1)
+
+    def test_keyframes_round_trip(self):
+        demo = Demo([_make_observation(i) for i in range(4)],
+                    keyframes=[1, 3])
+        columns, attrs = demo_to_columns(demo)
+        write_episode_file(self.file, len(demo), columns, attrs)
+        self.assertEqual(
+            keyframes_from_episode_file(EpisodeFile(self.file)), [1, 3])
+
+    def test_partial_column_raises(self):
+        observations = [_make_observation(i) for i in range(2)]
+        observations[1].joint_positions = None
+        with self.assertRaises(EpisodeFileError):
+            demo_to_columns(Demo(observations))
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+from os import path
+
+import numpy as np
+
+from rlbench.backend import manifest
+from rlbench.backend.dataset_stats import RunningStats
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_missing_manifest(self):
+        self.assertIsNone(manifest.read_manifest(self.tmp_dir))
+
+    def test_round_trip_is_ordered(self):
+        entries = [manifest.episode_entry(
+            'episode%d' % i, 10 + i, 'png', ['front_rgb'],
+            {'front': [128, 128]}, {'low_dim_obs.pkl': '00000000'})
+            for i in [10, 2, 1]]
+        manifest.write_manifest(self.tmp_dir, entries)
+        read = manifest.read_manifest(self.tmp_dir)
+        self.assertEqual([e['id'] for e in read['episodes']],
+                         ['episode1', 'episode2', 'episode10'])
+        self.assertEqual(read['episodes'][0]['num_steps'], 11)
+
+    def test_variation_stats_are_merged(self):
+        entries = [manifest.episode_entry(
+            'episode%d' % i, 2, 'png', [], {}, {},
+            stats={'joint_positions': RunningStats.from_array(
+                np.full((2, 1), float(i)))}) for i in range(2)]
+        manifest.write_manifest(self.tmp_dir, entries)
+        stats = manifest.read_manifest(self.tmp_dir)['stats']
+        self.assertEqual(stats['joint_positions']['count'], 4)
+        self.assertEqual(stats['joint_positions']['mean'], [0.5])
+
+    def test_file_checksum(self):
+        file = path.join(self.tmp_dir, 'data')
+        with open(file, 'wb') as f:
+            f.write(b'rlbench')
+        self.assertEqual(manifest.file_checksum(file),
+                         manifest.format_checksum(manifest.checksum(b'rlbench')))
+
+    def _write_episode(self, data: bytes):
+        file = path.join(self.tmp_dir, 'episode_data.rlb')
+        with open(file, 'wb') as f:
+            f.write(data)
+        manifest.write_episode_footer(self.tmp_dir, manifest.episode_entry(
+            'episode0', 1, 'episode_file', [], {}, {'episode_data.rlb': (
+                manifest.format_checksum(manifest.checksum(data)))}))
+        return file
+
+    def test_verify_complete_episode(self):
+        self._write_episode(b'rlbench')
+        footer = manifest.read_episode_footer(self.tmp_dir)
+        self.assertEqual(footer['entry']['id'], 'episode0')
+        self.assertEqual(footer['sizes']['episode_data.rlb'], 7)
+        self.assertIsNone(manifest.verify_episode(self.tmp_dir))
+        self.assertIsNone(manifest.verify_episode(self.tmp_dir, True))
+
+    def test_verify_truncated_and_missing(self):
+        file = self._write_episode(b'rlbench')
+        with open(file, 'wb') as f:
+            f.write(b'rlb')
+        self.assertIsNotNone(manifest.verify_episode(self.tmp_dir))
+        os.remove(file)
+        self.assertIsNotNone(manifest.verify_episode(self.tmp_dir))
+
+    def test_verify_checksums(self):
+        file = self._write_episode(b'rlbench')
+        with open(file, 'wb') as f:
+            f.write(b'RLBENCH')
+        # Same size, so only the checksums tell.
+        self.assertIsNone(manifest.verify_episode(self.tmp_dir))
+        self.assertIsNotNone(manifest.verify_episode(self.tmp_dir, True))
+
+    def test_verify_without_footer(self):
+        self.assertIsNotNone(manifest.verify_episode(self.tmp_dir))
+        with open(path.join(self.tmp_dir, 'low_dim_obs.pkl'), 'wb') as f:
+            f.write(b'')
+        self.assertIsNone(manifest.verify_episode(self.tmp_dir))
@@ -0,0 +1,40 @@
+import pickle
+import unittest
+
+import numpy as np
+
+from rlbench.backend.observation import Observation, LazyObservation
+
+
+class TestLazyObservation(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        base = Observation(*([None] * 29), misc={})
+        base.joint_positions = np.zeros(7)
+        self.obs = LazyObservation(base, {'front_rgb': self._load})
+
+    def _load(self):
+        self.calls += 1
+        return np.ones((4, 4, 3), dtype=np.uint8)
+
+    def test_decodes_once_on_access(self):
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(self.obs.front_rgb.shape, (4, 4, 3))
+        self.obs.front_rgb
+        self.assertEqual(self.calls, 1)
+        np.testing.assert_array_equal(self.obs.joint_positions, np.zeros(7))
+
+    def test_set_overrides_loader(self):
+        self.obs.front_rgb = None
+        self.assertIsNone(self.obs.front_rgb)
+        self.assertEqual(self.calls, 0)
+
+    def test_unknown_attribute(self):
+        with self.assertRaises(AttributeError):
+            self.obs.not_a_field
+
+    def test_pickle_decodes_fields(self):
+        restored = pickle.loads(pickle.dumps(self.obs))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(restored.front_rgb.shape, (4, 4, 3))
@@ -0,0 +1,50 @@
+import unittest
+from os import path
+
+import numpy as np
+
+from rlbench import utils
+from rlbench.observation_config import ObservationConfig
+from rlbench.transition_index import TransitionIndex, TransitionSampler
+
+ASSET_DIR = path.join(path.dirname(path.abspath(__file__)), 'assets', 'tasks')
+
+
+class TestTransitionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.obs_config = ObservationConfig()
+        self.obs_config.set_all(False)
+        self.obs_config.set_all_low_dim(True)
+        self.index = TransitionIndex(ASSET_DIR, ['reach_target'])
+        self.demos = utils.get_stored_low_dim_demos(
+            ASSET_DIR, 'reach_target', 0, self.obs_config)
+
+    def test_counts_every_step(self):
+        self.assertEqual(self.index.num_episodes, len(self.demos))
+        self.assertEqual(len(self.index), sum(len(d) for d in self.demos))
+
+    def test_locate(self):
+        last = len(self.demos[0]) - 1
+        self.assertEqual(self.index.transition(last),
+                         ('reach_target', 0, 0, last))
+        self.assertEqual(self.index.transition(last + 1),
+                         ('reach_target', 0, 1, 0))
+        self.assertEqual(list(self.index.is_last([last, last + 1])),
+                         [True, False])
+        with self.assertRaises(IndexError):
+            self.index.locate([len(self.index)])
+
+    def test_sampled_observations_match_demos(self):
+        sampler = TransitionSampler(self.index, self.obs_config, seed=1)
+        batch = sampler.sample(8, next_observations=True)
+        episodes, steps = self.index.locate(batch.ids)
+        for j, (e, s) in enumerate(zip(episodes, steps)):
+            demo = self.demos[self.index.episodes[e]]
+            np.testing.assert_array_equal(
+                batch.observations[j].joint_positions,
+                demo[s].joint_positions)
+            next_step = s if batch.terminals[j] else s + 1
+            np.testing.assert_array_equal(
+                batch.next_observations[j].joint_positions,
+                demo[next_step].joint_positions)
@@ -0,0 +1,77 @@
+"""Micro-benchmark of the 24-bit RGB depth encoding.
+
+Compares the original float division / weighted sum implementation with
+the uint32 view based float_array_to_rgb_array / rgb_array_to_float_array,
+and checks that both produce the same values.
+"""
+import timeit
+
+import numpy as np
+from absl import app
+from absl import flags
+
+from rlbench.backend import utils
+from rlbench.backend.const import DEPTH_SCALE
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('sizes', [128, 512], 'The square image sizes to time.')
+flags.DEFINE_integer('repeats', 200, 'The number of calls timed per entry.')
+
+
+def reference_encode(float_array, scale_factor):
+    scaled_array = np.floor(float_array * scale_factor + 0.5)
+    scaled_array = np.clip(scaled_array, 0, 2**24 - 1)
+    int_array = scaled_array.astype(np.uint32)
+    rg = np.divide(int_array, 256)
+    rgb_array = np.zeros(int_array.shape + (3,), dtype=np.uint8)
+    rgb_array[..., 0] = np.divide(rg, 256)
+    rgb_array[..., 1] = np.mod(rg, 256)
+    rgb_array[..., 2] = np.mod(int_array, 256)
+    return rgb_array
+
+
+def reference_decode(rgb_array, scale_factor):
+    return np.sum(rgb_array * [65536, 256, 1], axis=2) / scale_factor
+
+
+def _time(fn):
+    seconds = timeit.timeit(fn, number=FLAGS.repeats) / FLAGS.repeats
+    return 1.0 / seconds
+
+
+def main(argv):
+    print('%-6s %-26s %12s' % ('size', 'implementation', 'frames/s'))
+    for size in map(int, FLAGS.sizes):
+        depth = np.random.uniform(size=(size, size)).astype(np.float32)
+        encoded = utils.float_array_to_rgb_array(depth, DEPTH_SCALE)
+        np.testing.assert_array_equal(
+            encoded, reference_encode(depth, DEPTH_SCALE))
+        np.testing.assert_array_equal(
+            utils.rgb_array_to_float_array(encoded, DEPTH_SCALE),
+            reference_decode(encoded, DEPTH_SCALE))
+
+        rgb_out = np.empty((size, size, 3), dtype=np.uint8)
+        f32_out = np.empty((size, size), dtype=np.float32)
+        entries = [
+            ('encode (reference)',
+             lambda: reference_encode(depth, DEPTH_SCALE)),
+            ('encode',
+             lambda: utils.float_array_to_rgb_array(depth, DEPTH_SCALE)),
+            ('encode (out=)',
+             lambda: utils.float_array_to_rgb_array(
+                 depth, DEPTH_SCALE, out=rgb_out)),
+            ('decode (reference)',
+             lambda: reference_decode(encoded, DEPTH_SCALE)),
+            ('decode',
+             lambda: utils.rgb_array_to_float_array(encoded, DEPTH_SCALE)),
+            ('decode (float32, out=)',
+             lambda: utils.rgb_array_to_float_array(
+                 encoded, DEPTH_SCALE, out=f32_out)),
+        ]
+        for name, fn in entries:
+            print('%-6d %-26s %12.0f' % (size, name, _time(fn)))
+
+
+if __name__ == '__main__':
+    app.run(main)
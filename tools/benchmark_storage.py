@@ -0,0 +1,115 @@
+"""Compares the storage layouts on stored (png layout) episodes.
+
+For a few episodes of each task, reports the bytes per episode and how
+fast all of the stored images of an episode decode (in steps per second)
+for the png layout, the episode file layout, and the episode file layout
+with delta_zlib compressed and with deduplicated images.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+from absl import app
+from absl import flags
+
+from rlbench import utils as rlbench_utils
+from rlbench.backend import episode_file
+from rlbench.backend.const import *
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('dataset_root', '/tmp/rlbench_data/',
+                    'A dataset stored in the png layout.')
+flags.DEFINE_list('tasks', [],
+                  'The tasks to benchmark. If empty, all stored tasks.')
+flags.DEFINE_integer('episodes', 2, 'The number of episodes per task.')
+flags.DEFINE_integer('keyframe_interval',
+                     episode_file.DEFAULT_KEYFRAME_INTERVAL,
+                     'Frames per chunk of the compressed columns.')
+
+
+def _image_folders(example_path):
+    return sorted('%s_%s' % (c, m) for c in CAMERAS
+                  for m in ['rgb', 'depth', 'mask']
+                  if os.path.isdir(os.path.join(example_path,
+                                                '%s_%s' % (c, m))))
+
+
+def _png_paths(example_path, folder):
+    return [os.path.join(example_path, folder, IMAGE_FORMAT % i) for i in
+            range(len(os.listdir(os.path.join(example_path, folder))))]
+
+
+def _decode_png(example_path):
+    return {folder: np.stack([np.array(Image.open(path)) for path in
+                              _png_paths(example_path, folder)])
+            for folder in _image_folders(example_path)}
+
+
+def _decode_episode_file(path):
+    episode = episode_file.EpisodeFile(path)
+    return {name: episode.read(name) for name in episode.columns()}
+
+
+def _timed(fn, *args):
+    start = time.time()
+    result = fn(*args)
+    return result, time.time() - start
+
+
+def main(argv):
+    tasks = FLAGS.tasks or sorted(os.listdir(FLAGS.dataset_root))
+    tmp_dir = tempfile.mkdtemp()
+    print('%-28s %-18s %12s %12s' % (
+        'task', 'layout', 'MB/episode', 'steps/s'))
+    try:
+        for task in tasks:
+            variation = rlbench_utils.list_stored_variations(
+                FLAGS.dataset_root, task)[0]
+            episodes = rlbench_utils.list_stored_episodes(
+                FLAGS.dataset_root, task, variation)[:FLAGS.episodes]
+            sizes = {'png': 0, 'episode_file': 0, 'delta_zlib': 0,
+                     'deduplicated': 0}
+            seconds = dict.fromkeys(sizes, 0.0)
+            steps = 0
+            for example, _ in episodes:
+                example_path = os.path.join(
+                    FLAGS.dataset_root, task, VARIATIONS_FOLDER % variation,
+                    EPISODES_FOLDER, example)
+                images, seconds_png = _timed(_decode_png, example_path)
+                seconds['png'] += seconds_png
+                sizes['png'] += sum(
+                    os.path.getsize(path)
+                    for folder in images
+                    for path in _png_paths(example_path, folder))
+                num_steps = len(next(iter(images.values())))
+                steps += num_steps
+                for layout, compress, deduplicate in [
+                        ('episode_file', (), ()),
+                        ('delta_zlib', list(images), ()),
+                        ('deduplicated', (), list(images))]:
+                    path = os.path.join(tmp_dir, layout + '.rlb')
+                    episode_file.write_episode_file(
+                        path, num_steps, images, compress=compress,
+                        keyframe_interval=FLAGS.keyframe_interval,
+                        deduplicate=deduplicate)
+                    sizes[layout] += os.path.getsize(path)
+                    decoded, seconds_layout = _timed(
+                        _decode_episode_file, path)
+                    seconds[layout] += seconds_layout
+                    for name, column in images.items():
+                        # The codecs must be lossless.
+                        assert np.array_equal(column, decoded[name])
+            for layout in sizes:
+                print('%-28s %-18s %12.2f %12.1f' % (
+                    task, layout, sizes[layout] / len(episodes) / 1e6,
+                    steps / seconds[layout]))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    app.run(main)
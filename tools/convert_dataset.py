@@ -0,0 +1,312 @@
+"""Converts datasets stored in the png layout into episode files.
+
+Each episode's png images and low-dim pickle are rewritten into a single
+episode file (see rlbench/backend/episode_file.py), keeping the stored
+pixel encoding, and every variation gets a manifest listing the converted
+episodes and their normalisation statistics. Each written file is read
+back and checked against the source images, both as raw pixels and after
+decoding (depth with DEPTH_SCALE and the mask handles), and against the
+pickled low-dim data.
+
+Episodes are converted in parallel, and an episode is only given its final
+name once it has been verified, so an interrupted conversion can simply be
+run again to pick up where it stopped.
+"""
+import os
+import pickle
+import shutil
+import time
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+from absl import app
+from absl import flags
+
+from rlbench import utils as rlbench_utils
+from rlbench.backend import dataset_stats
+from rlbench.backend import episode_file
+from rlbench.backend import manifest
+from rlbench.backend import utils
+from rlbench.backend.const import *
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('dataset_root', '/tmp/rlbench_data/',
+                    'The dataset to convert.')
+flags.DEFINE_string('output_root', '',
+                    'Where to write the converted dataset. If empty, the '
+                    'episode files are written next to the png files.')
+flags.DEFINE_list('tasks', [],
+                  'The tasks to convert. If empty, all tasks are converted.')
+flags.DEFINE_integer('processes', 1,
+                     'The number of episodes converted in parallel.')
+flags.DEFINE_boolean('verify', True,
+                     'Check every converted episode against its source.')
+flags.DEFINE_boolean('compress_images', False,
+                     'Store the images with the lossless delta_zlib codec.')
+flags.DEFINE_boolean('deduplicate_frames', False,
+                     'Store repeated camera frames of an episode only once.')
+flags.DEFINE_boolean('remove_png', False,
+                     'When converting in place, delete the png images of a '
+                     'variation once all of its episodes have been converted '
+                     'and verified.')
+
+MODALITIES = ['rgb', 'depth', 'mask']
+
+
+class ConversionError(Exception):
+    pass
+
+
+def image_folders(example_path):
+    """The image folders of an episode, including any image levels."""
+    names = ['%s_%s' % (c, m) for c in CAMERAS for m in MODALITIES]
+    return sorted(f for f in os.listdir(example_path)
+                  if os.path.isdir(os.path.join(example_path, f)) and
+                  any(f == n or f.startswith(n + '_') for n in names))
+
+
+def read_png_episode(example_path):
+    """Reads the source episode into episode file columns.
+
+    :return: The low-dim demo, the columns, their attrs and the number of
+        bytes read.
+    """
+    with open(os.path.join(example_path, LOW_DIM_PICKLE), 'rb') as f:
+        data = f.read()
+    demo = pickle.loads(data)
+    bytes_read = len(data)
+    columns, attrs = episode_file.demo_to_columns(demo)
+    for folder in image_folders(example_path):
+        frames = []
+        for i in range(len(demo)):
+            path = os.path.join(example_path, folder, IMAGE_FORMAT % i)
+            if not os.path.exists(path):
+                raise ConversionError('Missing image: %s' % path)
+            bytes_read += os.path.getsize(path)
+            frames.append(np.array(Image.open(path)))
+        columns[folder] = np.stack(frames)
+    # Normalisation statistics, as the generator gathers them.
+    attrs['stats'] = dataset_stats.stats_to_dict(dataset_stats.episode_stats(
+        demo, {camera: utils.rgb_array_to_float_array(
+            columns['%s_depth' % camera], DEPTH_SCALE)
+            for camera in CAMERAS if '%s_depth' % camera in columns}))
+    return demo, columns, attrs, bytes_read
+
+
+def verify_episode(path, demo, columns):
+    """Checks a written episode file against the source it was made from."""
+    episode = episode_file.EpisodeFile(path)
+    if episode.num_steps != len(demo):
+        raise ConversionError('%s has %d steps rather than %d.' % (
+            path, episode.num_steps, len(demo)))
+    for name, expected in columns.items():
+        actual = episode.read(name)
+        if not np.array_equal(actual, expected):
+            raise ConversionError('Column %s of %s differs from its source.'
+                                  % (name, path))
+        if name not in ['%s_%s' % (c, m) for c in CAMERAS
+                        for m in ['depth', 'mask']]:
+            continue
+        modality = name.split('_')[-1]
+        for i in range(len(actual)):
+            if modality == 'depth' and not np.array_equal(
+                    utils.rgb_array_to_float_array(actual[i], DEPTH_SCALE),
+                    utils.image_to_float_array(
+                        Image.fromarray(expected[i]), DEPTH_SCALE)):
+                raise ConversionError('Depth %d of %s does not decode to the '
+                                      'source depth.' % (i, path))
+            if modality == 'mask' and not np.array_equal(
+                    utils.rgb_handles_to_mask(actual[i].astype(np.float64)),
+                    utils.rgb_handles_to_mask(np.array(
+                        Image.fromarray(expected[i]), dtype=np.float64))):
+                raise ConversionError('Mask %d of %s does not decode to the '
+                                      'source handles.' % (i, path))
+    for expected, actual in zip(
+            demo, episode_file.observations_from_episode_file(episode)):
+        for field in episode_file.LOW_DIM_FIELDS:
+            if not np.array_equal(getattr(expected, field),
+                                  getattr(actual, field)):
+                raise ConversionError('Low-dim field %s of %s differs from '
+                                      'its source.' % (field, path))
+        for key, value in (expected.misc or {}).items():
+            if not np.array_equal(value, actual.misc[key]):
+                raise ConversionError('Misc %s of %s differs from its '
+                                      'source.' % (key, path))
+
+
+def episode_entry(example_path):
+    """The manifest entry of a converted episode, read from its file."""
+    path = os.path.join(example_path, EPISODE_FILE)
+    episode = episode_file.EpisodeFile(path)
+    names = ['%s_%s' % (c, m) for c in CAMERAS for m in MODALITIES]
+    modalities = [n for n in names if n in episode]
+    image_sizes, image_levels = {}, {}
+    for camera in CAMERAS:
+        for name in episode.columns():
+            if not name.startswith(camera + '_'):
+                continue
+            shape = episode.shape(name)
+            if name in modalities:
+                image_sizes[camera] = [shape[2], shape[1]]
+            elif name[len(camera) + 1:].split('_')[0] in MODALITIES:
+                size = [shape[2], shape[1]]
+                if size not in image_levels.setdefault(camera, []):
+                    image_levels[camera].append(size)
+    return manifest.episode_entry(
+        os.path.basename(example_path), episode.num_steps, 'episode_file',
+        modalities, image_sizes,
+        {EPISODE_FILE: manifest.file_checksum(path)}, image_levels,
+        episode_file.keyframes_from_episode_file(episode),
+        dataset_stats.stats_from_dict(episode.attrs['stats'])
+        if 'stats' in episode.attrs else None)
+
+
+def converted_entry(output_path, verify):
+    """The manifest entry of an episode converted before, without reading
+    its episode file.
+
+    :return: The entry from the footer of the episode, or None if the file
+        does not have the size the footer records, when verifying. Episodes
+        converted before there were footers are read once, to add one.
+    """
+    footer = manifest.read_episode_footer(output_path)
+    if footer is None:
+        entry = episode_entry(output_path)
+        manifest.write_episode_footer(output_path, entry)
+        return entry
+    if verify and manifest.verify_episode(output_path) is not None:
+        return None
+    return footer['entry']
+
+
+def convert_episode(job):
+    """Converts a single episode, unless it was converted before.
+
+    :return: The manifest entry, the number of steps and bytes read (both 0
+        when the episode was already converted) and any problem.
+    """
+    example_path, output_path, verify, compress_images, deduplicate = job
+    try:
+        if os.path.exists(os.path.join(output_path, EPISODE_FILE)):
+            entry = converted_entry(output_path, verify)
+            if entry is not None:
+                return entry, 0, 0, None
+        demo, columns, attrs, bytes_read = read_png_episode(example_path)
+        os.makedirs(output_path, exist_ok=True)
+        path = os.path.join(output_path, EPISODE_FILE)
+        tmp_path = '%s.tmp%d' % (path, os.getpid())
+        images = image_folders(example_path)
+        try:
+            episode_file.write_episode_file(
+                tmp_path, len(demo), columns, attrs,
+                compress=images if compress_images else (),
+                deduplicate=images if deduplicate else ())
+            if verify:
+                verify_episode(tmp_path, demo, columns)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        entry = episode_entry(output_path)
+        # The episode file is all that loaders read from now on.
+        manifest.write_episode_footer(output_path, entry)
+        return entry, len(demo), bytes_read, None
+    except Exception as e:
+        return None, 0, 0, 'Failed converting %s: %s' % (example_path, e)
+
+
+def list_jobs(dataset_root, output_root, tasks, verify, compress_images,
+              deduplicate_frames):
+    """Lists the episodes to convert, grouped by variation."""
+    tasks = tasks or sorted(
+        t for t in os.listdir(dataset_root)
+        if os.path.isdir(os.path.join(dataset_root, t)))
+    variations = {}
+    for task in tasks:
+        for variation in rlbench_utils.list_stored_variations(
+                dataset_root, task):
+            folder = os.path.join(task, VARIATIONS_FOLDER % variation)
+            episodes = rlbench_utils.list_stored_episodes(
+                dataset_root, task, variation)
+            variations[folder] = [(
+                os.path.join(dataset_root, folder, EPISODES_FOLDER, example),
+                os.path.join(output_root, folder, EPISODES_FOLDER, example),
+                verify, compress_images, deduplicate_frames)
+                for example, _ in episodes]
+    return variations
+
+
+def main(argv):
+    dataset_root = FLAGS.dataset_root
+    output_root = FLAGS.output_root or dataset_root
+    if FLAGS.remove_png and output_root != dataset_root:
+        raise ValueError('remove_png is only supported when converting in '
+                         'place.')
+    variations = list_jobs(dataset_root, output_root, FLAGS.tasks,
+                           FLAGS.verify, FLAGS.compress_images,
+                           FLAGS.deduplicate_frames)
+    jobs = [job for folder in sorted(variations) for job in variations[folder]]
+    variation_of = {job[0]: folder for folder, folder_jobs in
+                    variations.items() for job in folder_jobs}
+    pending = {folder: len(folder_jobs)
+               for folder, folder_jobs in variations.items()}
+    entries = {folder: [] for folder in variations}
+    problems = []
+    converted = skipped = steps = bytes_read = 0
+    start = time.time()
+
+    def finish_variation(folder):
+        if output_root != dataset_root:
+            descriptions = os.path.join(dataset_root, folder,
+                                        VARIATION_DESCRIPTIONS)
+            if os.path.exists(descriptions):
+                # Not created yet when none of the episodes converted.
+                os.makedirs(os.path.join(output_root, folder), exist_ok=True)
+                shutil.copy(descriptions, os.path.join(
+                    output_root, folder, VARIATION_DESCRIPTIONS))
+        if len(entries[folder]) < len(variations[folder]):
+            return
+        manifest.write_manifest(os.path.join(output_root, folder),
+                                entries[folder])
+        if FLAGS.remove_png:
+            # Only now that the manifest points at the episode files.
+            for example_path, *_ in variations[folder]:
+                for image_folder in image_folders(example_path):
+                    shutil.rmtree(os.path.join(example_path, image_folder))
+
+    with Pool(FLAGS.processes) as pool:
+        for job, (entry, n, b, problem) in zip(jobs, pool.imap(
+                convert_episode, jobs)):
+            folder = variation_of[job[0]]
+            if problem is not None:
+                print(problem)
+                problems.append(problem)
+            else:
+                entries[folder].append(entry)
+                converted += n > 0
+                skipped += n == 0
+                steps += n
+                bytes_read += b
+            pending[folder] -= 1
+            if pending[folder] == 0:
+                finish_variation(folder)
+            elapsed = time.time() - start
+            print('%d/%d episodes (%d already converted) // %.1f episodes/s '
+                  '// %.0f frames/s // %.1f MB/s read' % (
+                      converted + skipped + len(problems), len(jobs), skipped,
+                      converted / elapsed, steps / elapsed,
+                      bytes_read / elapsed / 1e6))
+
+    elapsed = time.time() - start
+    print('Converted %d episodes (%d steps, %.1f GB) in %.0fs, %d were '
+          'already converted.' % (converted, steps, bytes_read / 1e9,
+                                  elapsed, skipped))
+    if len(problems) > 0:
+        print('%d episodes failed, so their variations did not get a new '
+              'manifest:\n%s' % (len(problems), '\n'.join(problems)))
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -1,4 +1,6 @@
-from multiprocessing import Process, Manager
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pipe, Process, Queue
+from multiprocessing.connection import wait
 
 from pyrep.const import RenderMode
 
@@ -10,10 +12,22 @@ from rlbench.backend.utils import task_file_to_task_class
 from rlbench.environment import Environment
 import rlbench.backend.task as task
 
+import collections
+import glob
+import io
+import json
 import os
 import pickle
+import re
+import shutil
+import threading
+import time
 from PIL import Image
+from rlbench.backend import dataset_stats
 from rlbench.backend import utils
+from rlbench.backend import episode_file
+from rlbench.backend import manifest
+from rlbench.backend import seeding
 from rlbench.backend.const import *
 import numpy as np
 
@@ -36,8 +50,90 @@ flags.DEFINE_integer('processes', 1,
                      'The number of parallel processes during collection.')
 flags.DEFINE_integer('episodes_per_task', 10,
                      'The number of episodes to collect per task.')
+flags.DEFINE_integer('episodes_per_item', 5,
+                     'The episodes of a variation are collected in work '
+                     'items of this many episodes, which processes take in '
+                     'turn, so a variation with many episodes is spread over '
+                     'several processes.')
 flags.DEFINE_integer('variations', -1,
                      'Number of variations to collect per task. -1 for all.')
+flags.DEFINE_enum('storage_format', 'png', ['png', 'episode_file'],
+                  'png writes one image file per frame per camera. '
+                  'episode_file writes a single file per episode holding '
+                  'contiguous arrays for each modality.')
+flags.DEFINE_boolean('compress_images', False,
+                     'For the episode_file format, store the images with the '
+                     'lossless delta_zlib codec, which exploits how little '
+                     'consecutive frames differ.')
+flags.DEFINE_boolean('deduplicate_frames', False,
+                     'For the episode_file format, store repeated camera '
+                     'frames (e.g. while the gripper actuates) only once.')
+flags.DEFINE_boolean('resume', False,
+                     'Keep the complete episodes already in save_path, and '
+                     'only collect the missing ones. Episodes are checked '
+                     'against the file sizes in their footer.')
+flags.DEFINE_boolean('resume_checksums', False,
+                     'When resuming, also check the checksums of the files '
+                     'of every complete episode.')
+flags.DEFINE_boolean('retry_failed', False,
+                     'Only collect the task variations that failed in the '
+                     'previous run (as recorded in save_path), keeping their '
+                     'complete episodes.')
+flags.DEFINE_integer('demo_attempts', 10,
+                     'How many times to try collecting an episode before '
+                     'giving up on its variation.')
+flags.DEFINE_integer('writer_threads', 2,
+                     'The number of threads of each collection process that '
+                     'write its demos to disk, while it goes on simulating.')
+flags.DEFINE_integer('write_queue_size', 2,
+                     'How many collected demos of a process may wait to be '
+                     'written. When this many are waiting, the process waits '
+                     'for the oldest before collecting more.')
+flags.DEFINE_list('cameras', CAMERAS,
+                  'The cameras to render and store.')
+flags.DEFINE_list('modalities', ['rgb', 'depth', 'mask'],
+                  'The images (any of rgb, depth and mask) to render and '
+                  'store for each camera.')
+flags.DEFINE_integer('seed', None,
+                     'The base seed of the dataset. Every episode is '
+                     'collected with a seed derived from it and the task, '
+                     'variation and episode, so any episode can be collected '
+                     'again on its own. By default, a new seed is drawn and '
+                     'printed.')
+flags.DEFINE_list('image_levels', [],
+                  'Extra, smaller image sizes to store alongside image_size, '
+                  'e.g. 64,32x24. Loaders asking for one of these sizes read '
+                  'it directly instead of resizing.')
+
+
+# The task variations that failed, written to save_path after each run.
+FAILED_VARIATIONS = 'failed_variations.json'
+
+
+def observation_config():
+    """The observation config to collect with, from the flags.
+
+    Only the cameras and modalities that are stored are rendered.
+    """
+    img_size = list(map(int, FLAGS.image_size))
+    obs_config = ObservationConfig()
+    obs_config.set_all(True)
+    for camera in CAMERAS:
+        cam_config = getattr(obs_config, '%s_camera' % camera)
+        cam_config.image_size = img_size
+        # Store depth as 0 - 1
+        cam_config.depth_in_meters = False
+        # We want to save the masks as rgb encodings.
+        cam_config.masks_as_one_channel = False
+        if FLAGS.renderer == 'opengl':
+            cam_config.render_mode = RenderMode.OPENGL
+        stored = camera in FLAGS.cameras
+        cam_config.rgb = stored and 'rgb' in FLAGS.modalities
+        cam_config.depth = stored and 'depth' in FLAGS.modalities
+        cam_config.mask = stored and 'mask' in FLAGS.modalities
+        # Point clouds are not stored, loaders compute them from the depth.
+        cam_config.point_cloud = False
+    return obs_config
 
 
 def check_and_make(dir):
@@ -45,165 +141,479 @@ def check_and_make(dir):
         os.makedirs(dir)
 
 
-def save_demo(demo, example_path):
+def parse_image_levels(levels, image_size):
+    """Parses 'N' or 'WxH' sizes, which must be smaller than image_size."""
+    sizes = []
+    for level in levels:
+        size = [int(v) for v in level.lower().split('x')]
+        size = size * 2 if len(size) == 1 else size
+        if (len(size) != 2 or size[0] > image_size[0] or
+                size[1] > image_size[1]):
+            raise ValueError('Image level %s must be a size no larger than '
+                             'the image size %s.' % (level, image_size))
+        if size != list(image_size) and size not in sizes:
+            sizes.append(size)
+    return sizes
+
+
+def downsample(image, modality, size):
+    """Downsamples an encoded image to one level of the image pyramid.
+
+    RGB is filtered. Depth and masks hold encoded values, which must not be
+    blended, so they use nearest neighbour.
+    """
+    resample = Image.LANCZOS if modality == 'rgb' else Image.NEAREST
+    return image.resize(tuple(size), resample)
+
+
+def save_demo(demo, example_path, storage_format='png', image_levels=(),
+              compress_images=False, deduplicate_frames=False):
+    """Saves the demo and returns its entry for the variation manifest.
+
+    :param image_levels: [width, height] of each extra, downsampled copy of
+        the images to store.
+    :param compress_images: Delta compress the images of an episode file.
+    :param deduplicate_frames: Store repeated frames of an episode file once.
+    """
+    # Gather these first, as saving as png clears the images from the demo.
+    stats = dataset_stats.episode_stats(demo)
+    modalities, image_sizes = [], {}
+    for camera, modality in _stored_images(demo):
+        image = getattr(demo[0], '%s_%s' % (camera, modality))
+        modalities.append('%s_%s' % (camera, modality))
+        image_sizes[camera] = [image.shape[1], image.shape[0]]
+    # Write into a temporary folder, and only move it into place once it is
+    # complete, so that a crash never leaves a partly written episode.
+    _recover_episode(example_path)
+    for stale in glob.glob(glob.escape(example_path) + '.tmp*'):
+        shutil.rmtree(stale)
+    tmp_path = '%s.tmp%d' % (example_path, os.getpid())
+    if storage_format == 'episode_file':
+        checksums = save_demo_episode_file(
+            demo, tmp_path, image_levels, compress_images,
+            deduplicate_frames)
+    else:
+        checksums = save_demo_png(demo, tmp_path, image_levels)
+    entry = manifest.episode_entry(
+        os.path.basename(example_path), len(demo), storage_format,
+        modalities, image_sizes, checksums,
+        {camera: [list(size) for size in image_levels]
+         for camera in image_sizes} if len(image_levels) > 0 else None,
+        demo.keyframes, stats)
+    manifest.write_episode_footer(tmp_path, entry)
+    _commit_episode(tmp_path, example_path)
+    return entry
+
+
+def _commit_episode(tmp_path, example_path):
+    """Moves a completely written episode folder into place."""
+    if os.path.exists(example_path):
+        # Replacing an episode from a previous run.
+        old_path = '%s.old%d' % (example_path, os.getpid())
+        os.rename(example_path, old_path)
+        os.rename(tmp_path, example_path)
+        shutil.rmtree(old_path)
+    else:
+        os.rename(tmp_path, example_path)
+
+
+def _recover_episode(example_path):
+    """Cleans up after a process that died while replacing an episode.
+
+    The episode it was replacing is moved back into place if the new one
+    never was, and deleted otherwise.
+    """
+    for old_path in sorted(glob.glob(glob.escape(example_path) + '.old*')):
+        if os.path.exists(example_path):
+            shutil.rmtree(old_path)
+        else:
+            os.rename(old_path, example_path)
+
+
+def _level_name(name, size):
+    return IMAGE_LEVEL_FORMAT % (name, size[0], size[1])
+
+
+def save_demo_episode_file(demo, example_path, image_levels=(),
+                           compress_images=False, deduplicate_frames=False):
+    check_and_make(example_path)
+    columns, attrs = episode_file.demo_to_columns(demo)
+    # Images use the same pixel encoding as the png layout.
+    for camera, modality in _stored_images(demo):
+        name = '%s_%s' % (camera, modality)
+        columns[name] = np.stack(
+            [_encode_image(getattr(obs, name), modality) for obs in demo])
+        for size in image_levels:
+            columns[_level_name(name, size)] = np.stack(
+                [np.array(downsample(Image.fromarray(image), modality,
+                                     size))
+                 for image in columns[name]])
+    image_columns = [name for name in columns if any(
+        name.startswith(camera + '_') for camera in CAMERAS)]
+    crc = episode_file.write_episode_file(
+        os.path.join(example_path, EPISODE_FILE), len(demo), columns, attrs,
+        compress=image_columns if compress_images else (),
+        deduplicate=image_columns if deduplicate_frames else ())
+    return {EPISODE_FILE: manifest.format_checksum(crc)}
+
+
+def _write_file(data, example_path, rel_path, checksums):
+    with open(os.path.join(example_path, rel_path), 'wb') as f:
+        f.write(data)
+    checksums[rel_path] = manifest.format_checksum(manifest.checksum(data))
+
+
+def _save_image(image, example_path, rel_path, checksums):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    _write_file(buffer.getvalue(), example_path, rel_path, checksums)
+
+
+def _stored_images(demo):
+    """The (camera, modality) of every image the demo was collected with."""
+    return [(camera, modality) for camera in CAMERAS
+            for modality in ['rgb', 'depth', 'mask']
+            if getattr(demo[0], '%s_%s' % (camera, modality)) is not None]
+
+
+def _encode_image(image, modality):
+    """Encodes an image of the observations, as it is stored."""
+    if modality == 'depth':
+        return utils.float_array_to_rgb_array(image, scale_factor=DEPTH_SCALE)
+    if modality == 'mask':
+        return (image * 255).astype(np.uint8)
+    return image
+
+
+def save_demo_png(demo, example_path, image_levels=()):
+    checksums = {}
+    stored = _stored_images(demo)
+    for camera, modality in stored:
+        name = '%s_%s' % (camera, modality)
+        check_and_make(os.path.join(example_path, name))
+        for size in image_levels:
+            check_and_make(os.path.join(
+                example_path, _level_name(name, size)))
 
     # Save image data first, and then None the image data, and pickle
-    left_shoulder_rgb_path = os.path.join(
-        example_path, LEFT_SHOULDER_RGB_FOLDER)
-    left_shoulder_depth_path = os.path.join(
-        example_path, LEFT_SHOULDER_DEPTH_FOLDER)
-    left_shoulder_mask_path = os.path.join(
-        example_path, LEFT_SHOULDER_MASK_FOLDER)
-    right_shoulder_rgb_path = os.path.join(
-        example_path, RIGHT_SHOULDER_RGB_FOLDER)
-    right_shoulder_depth_path = os.path.join(
-        example_path, RIGHT_SHOULDER_DEPTH_FOLDER)
-    right_shoulder_mask_path = os.path.join(
-        example_path, RIGHT_SHOULDER_MASK_FOLDER)
-    overhead_rgb_path = os.path.join(
-        example_path, OVERHEAD_RGB_FOLDER)
-    overhead_depth_path = os.path.join(
-        example_path, OVERHEAD_DEPTH_FOLDER)
-    overhead_mask_path = os.path.join(
-        example_path, OVERHEAD_MASK_FOLDER)
-    wrist_rgb_path = os.path.join(example_path, WRIST_RGB_FOLDER)
-    wrist_depth_path = os.path.join(example_path, WRIST_DEPTH_FOLDER)
-    wrist_mask_path = os.path.join(example_path, WRIST_MASK_FOLDER)
-    front_rgb_path = os.path.join(example_path, FRONT_RGB_FOLDER)
-    front_depth_path = os.path.join(example_path, FRONT_DEPTH_FOLDER)
-    front_mask_path = os.path.join(example_path, FRONT_MASK_FOLDER)
-
-    check_and_make(left_shoulder_rgb_path)
-    check_and_make(left_shoulder_depth_path)
-    check_and_make(left_shoulder_mask_path)
-    check_and_make(right_shoulder_rgb_path)
-    check_and_make(right_shoulder_depth_path)
-    check_and_make(right_shoulder_mask_path)
-    check_and_make(overhead_rgb_path)
-    check_and_make(overhead_depth_path)
-    check_and_make(overhead_mask_path)
-    check_and_make(wrist_rgb_path)
-    check_and_make(wrist_depth_path)
-    check_and_make(wrist_mask_path)
-    check_and_make(front_rgb_path)
-    check_and_make(front_depth_path)
-    check_and_make(front_mask_path)
-
     for i, obs in enumerate(demo):
-        left_shoulder_rgb = Image.fromarray(obs.left_shoulder_rgb)
-        left_shoulder_depth = utils.float_array_to_rgb_image(
-            obs.left_shoulder_depth, scale_factor=DEPTH_SCALE)
-        left_shoulder_mask = Image.fromarray(
-            (obs.left_shoulder_mask * 255).astype(np.uint8))
-        right_shoulder_rgb = Image.fromarray(obs.right_shoulder_rgb)
-        right_shoulder_depth = utils.float_array_to_rgb_image(
-            obs.right_shoulder_depth, scale_factor=DEPTH_SCALE)
-        right_shoulder_mask = Image.fromarray(
-            (obs.right_shoulder_mask * 255).astype(np.uint8))
-        overhead_rgb = Image.fromarray(obs.overhead_rgb)
-        overhead_depth = utils.float_array_to_rgb_image(
-            obs.overhead_depth, scale_factor=DEPTH_SCALE)
-        overhead_mask = Image.fromarray(
-            (obs.overhead_mask * 255).astype(np.uint8))
-        wrist_rgb = Image.fromarray(obs.wrist_rgb)
-        wrist_depth = utils.float_array_to_rgb_image(
-            obs.wrist_depth, scale_factor=DEPTH_SCALE)
-        wrist_mask = Image.fromarray((obs.wrist_mask * 255).astype(np.uint8))
-        front_rgb = Image.fromarray(obs.front_rgb)
-        front_depth = utils.float_array_to_rgb_image(
-            obs.front_depth, scale_factor=DEPTH_SCALE)
-        front_mask = Image.fromarray((obs.front_mask * 255).astype(np.uint8))
-
-        left_shoulder_rgb.save(
-            os.path.join(left_shoulder_rgb_path, IMAGE_FORMAT % i))
-        left_shoulder_depth.save(
-            os.path.join(left_shoulder_depth_path, IMAGE_FORMAT % i))
-        left_shoulder_mask.save(
-            os.path.join(left_shoulder_mask_path, IMAGE_FORMAT % i))
-        right_shoulder_rgb.save(
-            os.path.join(right_shoulder_rgb_path, IMAGE_FORMAT % i))
-        right_shoulder_depth.save(
-            os.path.join(right_shoulder_depth_path, IMAGE_FORMAT % i))
-        right_shoulder_mask.save(
-            os.path.join(right_shoulder_mask_path, IMAGE_FORMAT % i))
-        overhead_rgb.save(
-            os.path.join(overhead_rgb_path, IMAGE_FORMAT % i))
-        overhead_depth.save(
-            os.path.join(overhead_depth_path, IMAGE_FORMAT % i))
-        overhead_mask.save(
-            os.path.join(overhead_mask_path, IMAGE_FORMAT % i))
-        wrist_rgb.save(os.path.join(wrist_rgb_path, IMAGE_FORMAT % i))
-        wrist_depth.save(os.path.join(wrist_depth_path, IMAGE_FORMAT % i))
-        wrist_mask.save(os.path.join(wrist_mask_path, IMAGE_FORMAT % i))
-        front_rgb.save(os.path.join(front_rgb_path, IMAGE_FORMAT % i))
-        front_depth.save(os.path.join(front_depth_path, IMAGE_FORMAT % i))
-        front_mask.save(os.path.join(front_mask_path, IMAGE_FORMAT % i))
+        for camera, modality in stored:
+            name = '%s_%s' % (camera, modality)
+            image = Image.fromarray(_encode_image(getattr(obs, name),
+                                                  modality))
+            _save_image(image, example_path, os.path.join(
+                name, IMAGE_FORMAT % i), checksums)
+            for size in image_levels:
+                _save_image(downsample(image, modality, size),
+                            example_path, os.path.join(
+                                _level_name(name, size),
+                                IMAGE_FORMAT % i), checksums)
 
         # We save the images separately, so set these to None for pickling.
-        obs.left_shoulder_rgb = None
-        obs.left_shoulder_depth = None
-        obs.left_shoulder_point_cloud = None
-        obs.left_shoulder_mask = None
-        obs.right_shoulder_rgb = None
-        obs.right_shoulder_depth = None
-        obs.right_shoulder_point_cloud = None
-        obs.right_shoulder_mask = None
-        obs.overhead_rgb = None
-        obs.overhead_depth = None
-        obs.overhead_point_cloud = None
-        obs.overhead_mask = None
-        obs.wrist_rgb = None
-        obs.wrist_depth = None
-        obs.wrist_point_cloud = None
-        obs.wrist_mask = None
-        obs.front_rgb = None
-        obs.front_depth = None
-        obs.front_point_cloud = None
-        obs.front_mask = None
+        for camera in CAMERAS:
+            setattr(obs, '%s_rgb' % camera, None)
+            setattr(obs, '%s_depth' % camera, None)
+            setattr(obs, '%s_point_cloud' % camera, None)
+            setattr(obs, '%s_mask' % camera, None)
 
     # Save the low-dimension data
-    with open(os.path.join(example_path, LOW_DIM_PICKLE), 'wb') as f:
-        pickle.dump(demo, f)
-
+    _write_file(pickle.dumps(demo), example_path, LOW_DIM_PICKLE, checksums)
+    # And again as columns, so it can be loaded without unpickling.
+    columns, attrs = episode_file.demo_to_columns(demo)
+    crc = episode_file.write_episode_file(
+        os.path.join(example_path, LOW_DIM_FILE), len(demo), columns, attrs)
+    checksums[LOW_DIM_FILE] = manifest.format_checksum(crc)
+    return checksums
+
+
+class WorkScheduler(object):
+    """Hands out work items to the collection processes.
+
+    Items are either ('variations', task) to find how many variations of a
+    task to collect, or ('episodes', task, variation, start, end) to collect
+    a range of episodes of a variation. A process is given an item of the
+    task it has loaded if there is one, then a task still to be looked at,
+    and otherwise steals from the task with the most work left, so that no
+    process sits idle while another works through a long variation.
+    """
+
+    def __init__(self, num_tasks, episodes_per_item):
+        self._episodes_per_item = max(episodes_per_item, 1)
+        self._pending = [('variations', t) for t in range(num_tasks)]
+        self._running = {}
+        # (task, variation) to the number of its items not finished yet.
+        self._outstanding = {}
+        self.failed = set()
+
+    def add_variations(self, task, episodes):
+        """Adds the episode items of the variations of a task.
+
+        :param episodes: Variation to the ascending episode numbers to
+            collect. Each item is a run of consecutive episode numbers.
+        """
+        for variation, numbers in episodes.items():
+            runs = []
+            for number in numbers:
+                if (len(runs) > 0 and runs[-1][1] == number and
+                        runs[-1][1] - runs[-1][0] < self._episodes_per_item):
+                    runs[-1][1] += 1
+                else:
+                    runs.append([number, number + 1])
+            for start, end in runs:
+                self._pending.append(('episodes', task, variation, start, end))
+            key = (task, variation)
+            self._outstanding[key] = self._outstanding.get(key, 0) + len(runs)
+
+    def next(self, worker, loaded_task=None):
+        """The next item for a worker, or None if there is none for now."""
+        if len(self._pending) == 0:
+            return None
+        index = next((j for j, item in enumerate(self._pending)
+                      if item[0] == 'episodes' and item[1] == loaded_task),
+                     None)
+        if index is None:
+            index = next((j for j, item in enumerate(self._pending)
+                          if item[0] == 'variations'), None)
+        if index is None:
+            left = {}
+            for item in self._pending:
+                left[item[1]] = left.get(item[1], 0) + 1
+            task = max(left, key=left.get)
+            index = max(j for j, item in enumerate(self._pending)
+                        if item[1] == task)
+        item = self._pending.pop(index)
+        self._running[worker] = item
+        return item
+
+    def finish(self, worker, failed=False):
+        """Marks the item of a worker as done.
+
+        :param failed: Whether the item failed, in which case the rest of
+            its variation is not collected.
+        :return: The (task, variation) the item finished, if it was the last
+            item of that variation, otherwise None.
+        """
+        item = self._running.pop(worker, None)
+        if item is None or item[0] != 'episodes':
+            return None
+        key = item[1:3]
+        if failed:
+            self.failed.add(key)
+            dropped = [other for other in self._pending
+                       if other[0] == 'episodes' and other[1:3] == key]
+            self._pending = [other for other in self._pending
+                             if other not in dropped]
+            self._outstanding[key] -= len(dropped)
+        self._outstanding[key] -= 1
+        return key if self._outstanding[key] == 0 else None
+
+    def running(self, worker):
+        return self._running.get(worker)
+
+    def done(self):
+        return len(self._pending) == 0 and len(self._running) == 0
+
+
+class ManifestTracker(object):
+    """Decides when the manifest of a variation can be written.
+
+    That is once all of its items have finished, and every demo they
+    collected has been written. A process reports how many demos it
+    collected for an item when the item ends, but its writer may report
+    some of them written before that, so the demos still to be written are
+    counted per process. The demos of a process that died will never be
+    written, so its counts are dropped.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        # (worker, (task, variation)) to its demos not written yet.
+        self._unwritten = collections.Counter()
+        self._finished = set()
+
+    def add(self, key, entry):
+        """Adds the entry of an episode that is already on disk."""
+        self._entries.setdefault(key, []).append(entry)
+
+    def collected(self, worker, key, num_demos):
+        self._unwritten[worker, key] += num_demos
+
+    def written(self, worker, key, entry=None):
+        """Counts a demo as written, with its entry if it was saved.
+
+        :return: The (key, entries) of the manifests to write.
+        """
+        if entry is not None:
+            self.add(key, entry)
+        self._unwritten[worker, key] -= 1
+        return self._ready([key])
+
+    def finish(self, key):
+        """Marks all of the items of a variation as finished."""
+        self._finished.add(key)
+        return self._ready([key])
+
+    def exited(self, worker):
+        keys = [key for w, key in self._unwritten if w == worker]
+        for key in keys:
+            del self._unwritten[worker, key]
+        return self._ready(keys)
+
+    def _ready(self, keys):
+        # A demo written after its manifest (which should not happen) gets
+        # the manifest written again, rather than being left out of it.
+        return [(key, self._entries.get(key, [])) for key in keys
+                if key in self._finished and not any(
+                    n > 0 for (_, k), n in self._unwritten.items()
+                    if k == key)]
+
+
+def _collect_episodes(i, task_env, task_index, variation, start, end,
+                      writer, seed):
+    """Collects a range of episodes of a variation.
+
+    :param seed: The base seed of the dataset, which the seeds of the
+        episodes are derived from.
+    :param writer: The EpisodeWriter the demos are handed to, so that
+        collection continues while they are written.
+    :return: The number of demos handed to the writer, and the problem that
+        stopped the collection (or None).
+    """
+    task_env.set_variation(variation)
+    seeding.seed_global(seeding.derive_seed(
+        seed, task_env.get_name(), variation))
+    obs, descriptions = task_env.reset()
+
+    variation_path = os.path.join(
+        FLAGS.save_path, task_env.get_name(), VARIATIONS_FOLDER % variation)
+    episodes_path = os.path.join(variation_path, EPISODES_FOLDER)
+    os.makedirs(episodes_path, exist_ok=True)
+
+    # Processes collecting other episodes of the variation write the same.
+    path = os.path.join(variation_path, VARIATION_DESCRIPTIONS)
+    tmp_path = '%s.tmp%d' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(descriptions, f)
+    os.replace(tmp_path, path)
+
+    num_demos = 0
+    for ex_idx in range(start, end):
+        print('Process', i, '// Task:', task_env.get_name(),
+              '// Variation:', variation, '// Demo:', ex_idx)
+        episode_seed = seeding.episode_seed(
+            seed, task_env.get_name(), variation, ex_idx)
+        attempts = FLAGS.demo_attempts
+        while attempts > 0:
+            try:
+                # TODO: for now we do the explicit looping.
+                demo, = task_env.get_demos(
+                    amount=1,
+                    live_demos=True,
+                    seed=seeding.derive_seed(
+                        episode_seed, FLAGS.demo_attempts - attempts))
+            except Exception as e:
+                attempts -= 1
+                if attempts > 0:
+                    continue
+                problem = (
+                    'Process %d failed collecting task %s (variation: %d, '
+                    'example: %d). Skipping this task/variation.\n%s\n' % (
+                        i, task_env.get_name(), variation, ex_idx, str(e))
+                )
+                print(problem)
+                return num_demos, problem
+            # Point clouds are not stored, so do not hold on to them while
+            # the demo waits to be written.
+            for obs in demo:
+                for camera in CAMERAS:
+                    setattr(obs, '%s_point_cloud' % camera, None)
+            episode_path = os.path.join(episodes_path, EPISODE_FOLDER % ex_idx)
+            writer.write(task_index, variation, demo, episode_path)
+            num_demos += 1
+            break
+    return num_demos, None
+
+
+class EpisodeWriter(object):
+    """Writes the demos of a collection process with a pool of threads.
+
+    Encoding the images (PIL and zlib) releases the GIL, so demos are
+    written on other cores while the simulation goes on. Episodes are written
+    to distinct paths, so writers need no locking. At most max_pending demos
+    wait to be written; handing over one more waits for the oldest, so that
+    collection does not run ahead of the writers.
+
+    Each written demo is reported to the main process as ('written', i, task,
+    variation, manifest entry, problem) as soon as it and the demos handed
+    over before it are written, from the writing thread. Other messages of
+    the process go through send, so that they do not interleave.
+    """
+
+    def __init__(self, i, results, num_threads, max_pending):
+        self._i = i
+        self._results = results
+        self._max_pending = max(max_pending, 1)
+        self._pool = ThreadPoolExecutor(max(num_threads, 1))
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._image_levels = parse_image_levels(
+            FLAGS.image_levels, list(map(int, FLAGS.image_size)))
+
+    def send(self, message):
+        """Sends a message to the main process, from any thread."""
+        with self._lock:
+            self._results.send(message)
+
+    def write(self, task_index, variation, demo, episode_path):
+        future = self._pool.submit(
+            save_demo, demo, episode_path, FLAGS.storage_format,
+            self._image_levels, FLAGS.compress_images,
+            FLAGS.deduplicate_frames)
+        with self._lock:
+            self._pending.append((task_index, variation, episode_path, future))
+        future.add_done_callback(lambda _: self._report())
+        while True:
+            with self._lock:
+                if len(self._pending) <= self._max_pending:
+                    break
+                oldest = self._pending[0][-1]
+            # Waits for the oldest without raising its exception, and reports
+            # it in case its callback has not run yet.
+            oldest.exception()
+            self._report()
+
+    def close(self):
+        """Waits for every demo to be written."""
+        self._pool.shutdown()
+        self._report()
+
+    def _report(self):
+        # In order, so a demo waits for those handed over before it.
+        with self._lock:
+            while len(self._pending) > 0 and self._pending[0][-1].done():
+                task_index, variation, episode_path, future = (
+                    self._pending.popleft())
+                try:
+                    entry, problem = future.result(), None
+                except Exception as e:
+                    entry = None
+                    problem = 'Process %d failed writing %s.\n%s\n' % (
+                        self._i, episode_path, str(e))
+                self._results.send(('written', self._i, task_index,
+                                    variation, entry, problem))
 
-def run(i, lock, task_index, variation_count, results, file_lock, tasks):
-    """Each thread will choose one task and variation, and then gather
-    all the episodes_per_task for that variation."""
 
-    # Initialise each thread with random seed
-    np.random.seed(None)
-    num_tasks = len(tasks)
+def run(i, work_queue, tasks, results, seed):
+    """Each process takes work items until there are none left.
 
-    img_size = list(map(int, FLAGS.image_size))
+    :param work_queue: Where this process gets its items from, and None
+        when it should stop.
+    :param results: Where this process reports back to the main process,
+        which also asks it for its next item.
+    :param seed: The base seed of the dataset.
+    """
 
-    obs_config = ObservationConfig()
-    obs_config.set_all(True)
-    obs_config.right_shoulder_camera.image_size = img_size
-    obs_config.left_shoulder_camera.image_size = img_size
-    obs_config.overhead_camera.image_size = img_size
-    obs_config.wrist_camera.image_size = img_size
-    obs_config.front_camera.image_size = img_size
-
-    # Store depth as 0 - 1
-    obs_config.right_shoulder_camera.depth_in_meters = False
-    obs_config.left_shoulder_camera.depth_in_meters = False
-    obs_config.overhead_camera.depth_in_meters = False
-    obs_config.wrist_camera.depth_in_meters = False
-    obs_config.front_camera.depth_in_meters = False
-
-    # We want to save the masks as rgb encodings.
-    obs_config.left_shoulder_camera.masks_as_one_channel = False
-    obs_config.right_shoulder_camera.masks_as_one_channel = False
-    obs_config.overhead_camera.masks_as_one_channel = False
-    obs_config.wrist_camera.masks_as_one_channel = False
-    obs_config.front_camera.masks_as_one_channel = False
-
-    if FLAGS.renderer == 'opengl':
-        obs_config.right_shoulder_camera.render_mode = RenderMode.OPENGL
-        obs_config.left_shoulder_camera.render_mode = RenderMode.OPENGL
-        obs_config.overhead_camera.render_mode = RenderMode.OPENGL
-        obs_config.wrist_camera.render_mode = RenderMode.OPENGL
-        obs_config.front_camera.render_mode = RenderMode.OPENGL
+    obs_config = observation_config()
 
     rlbench_env = Environment(
         action_mode=MoveArmThenGripper(JointVelocity(), Discrete()),
@@ -212,85 +622,36 @@ def run(i, lock, task_index, variation_count, results, file_lock, tasks):
     rlbench_env.launch()
 
     task_env = None
+    loaded_task = None
 
-    tasks_with_problems = results[i] = ''
+    writer = EpisodeWriter(i, results, FLAGS.writer_threads,
+                           FLAGS.write_queue_size)
 
+    writer.send(('ready', i, loaded_task))
     while True:
-        # Figure out what task/variation this thread is going to do
-        with lock:
-
-            if task_index.value >= num_tasks:
-                print('Process', i, 'finished')
-                break
-
-            my_variation_count = variation_count.value
-            t = tasks[task_index.value]
-            task_env = rlbench_env.get_task(t)
+        item = work_queue.get()
+        if item is None:
+            writer.close()
+            print('Process', i, 'finished')
+            break
+        if loaded_task != item[1]:
+            # Loading the task loads its model, so only do it when changing
+            # tasks.
+            task_env = rlbench_env.get_task(tasks[item[1]])
+            loaded_task = item[1]
+        if item[0] == 'variations':
             var_target = task_env.variation_count()
             if FLAGS.variations >= 0:
                 var_target = np.minimum(FLAGS.variations, var_target)
-            if my_variation_count >= var_target:
-                # If we have reached the required number of variations for this
-                # task, then move on to the next task.
-                variation_count.value = my_variation_count = 0
-                task_index.value += 1
-
-            variation_count.value += 1
-            if task_index.value >= num_tasks:
-                print('Process', i, 'finished')
-                break
-            t = tasks[task_index.value]
-
-        task_env = rlbench_env.get_task(t)
-        task_env.set_variation(my_variation_count)
-        obs, descriptions = task_env.reset()
-
-        variation_path = os.path.join(
-            FLAGS.save_path, task_env.get_name(),
-            VARIATIONS_FOLDER % my_variation_count)
-
-        check_and_make(variation_path)
-
-        with open(os.path.join(
-                variation_path, VARIATION_DESCRIPTIONS), 'wb') as f:
-            pickle.dump(descriptions, f)
-
-        episodes_path = os.path.join(variation_path, EPISODES_FOLDER)
-        check_and_make(episodes_path)
-
-        abort_variation = False
-        for ex_idx in range(FLAGS.episodes_per_task):
-            print('Process', i, '// Task:', task_env.get_name(),
-                  '// Variation:', my_variation_count, '// Demo:', ex_idx)
-            attempts = 10
-            while attempts > 0:
-                try:
-                    # TODO: for now we do the explicit looping.
-                    demo, = task_env.get_demos(
-                        amount=1,
-                        live_demos=True)
-                except Exception as e:
-                    attempts -= 1
-                    if attempts > 0:
-                        continue
-                    problem = (
-                        'Process %d failed collecting task %s (variation: %d, '
-                        'example: %d). Skipping this task/variation.\n%s\n' % (
-                            i, task_env.get_name(), my_variation_count, ex_idx,
-                            str(e))
-                    )
-                    print(problem)
-                    tasks_with_problems += problem
-                    abort_variation = True
-                    break
-                episode_path = os.path.join(episodes_path, EPISODE_FOLDER % ex_idx)
-                with file_lock:
-                    save_demo(demo, episode_path)
-                break
-            if abort_variation:
-                break
-
-    results[i] = tasks_with_problems
+            writer.send(('variations', i, loaded_task, task_env.get_name(),
+                         int(var_target)))
+        else:
+            _, _, variation, start, end = item
+            num_demos, problem = _collect_episodes(
+                i, task_env, loaded_task, variation, start, end, writer,
+                seed)
+            writer.send(('episodes', i, loaded_task, num_demos, problem))
+
     rlbench_env.shutdown()
 
 
@@ -305,30 +666,222 @@ def main(argv):
                 raise ValueError('Task %s not recognised!.' % t)
         task_files = FLAGS.tasks
 
-    tasks = [task_file_to_task_class(t) for t in task_files]
+    retry = None
+    if FLAGS.retry_failed:
+        with open(os.path.join(FLAGS.save_path, FAILED_VARIATIONS)) as f:
+            failures = json.load(f)
+        # Task to the failed variations, or None when all of them failed.
+        retry = {}
+        for failure in failures:
+            variations = retry.setdefault(failure['task'], set())
+            if failure['variation'] is None or variations is None:
+                retry[failure['task']] = None
+            else:
+                variations.add(failure['variation'])
+        task_files = [t for t in task_files if t in retry]
+    resume = FLAGS.resume or FLAGS.retry_failed
 
-    manager = Manager()
+    tasks = [task_file_to_task_class(t) for t in task_files]
+    # Fail early, rather than in every process.
+    parse_image_levels(FLAGS.image_levels, list(map(int, FLAGS.image_size)))
+    for camera in FLAGS.cameras:
+        if camera not in CAMERAS:
+            raise ValueError('Camera %s not recognised!' % camera)
+    for modality in FLAGS.modalities:
+        if modality not in ['rgb', 'depth', 'mask']:
+            raise ValueError('Modality %s not recognised!' % modality)
 
-    result_dict = manager.dict()
-    file_lock = manager.Lock()
+    seed = FLAGS.seed if FLAGS.seed is not None else seeding.new_seed()
+    print('Seed:', seed)
 
-    task_index = manager.Value('i', 0)
-    variation_count = manager.Value('i', 0)
-    lock = manager.Lock()
+    scheduler = WorkScheduler(len(tasks), FLAGS.episodes_per_item)
+    work_queues = [Queue() for _ in range(FLAGS.processes)]
 
     check_and_make(FLAGS.save_path)
 
-    processes = [Process(
-        target=run, args=(
-            i, lock, task_index, variation_count, result_dict, file_lock,
-            tasks))
-        for i in range(FLAGS.processes)]
-    [t.start() for t in processes]
+    # Every process reports back through its own pipe, which sends
+    # synchronously, so nothing it reported is lost if it dies. Its pipe
+    # closes when it exits (after writing all of its demos).
+    receivers = {}
+
+    def start_process(i):
+        receiver, sender = Pipe(duplex=False)
+        process = Process(target=run,
+                          args=(i, work_queues[i], tasks, sender, seed))
+        process.start()
+        sender.close()
+        receivers[receiver] = i
+        return process
+
+    processes = [start_process(i) for i in range(FLAGS.processes)]
+
+    # Collection processes waiting for an item, while others may still add
+    # work, and those that are still running.
+    idle = {}
+    alive = set(range(len(processes)))
+    collecting = True
+    task_names = {}
+    tracker = ManifestTracker()
+    failures = []
+    num_episodes = 0
+    start = time.time()
+
+    def write_manifests(ready):
+        for (task_index, variation), entries in ready:
+            variation_path = os.path.join(
+                FLAGS.save_path, task_names[task_index],
+                VARIATIONS_FOLDER % variation)
+            # Missing if its process died before collecting anything.
+            os.makedirs(variation_path, exist_ok=True)
+            manifest.write_manifest(variation_path, entries)
+
+    def add_variations(task_index, num_variations):
+        variations = range(num_variations)
+        if retry is not None and retry[task_files[task_index]] is not None:
+            variations = sorted(
+                retry[task_files[task_index]] & set(variations))
+        episodes = {}
+        for variation in variations:
+            key = (task_index, variation)
+            missing = list(range(FLAGS.episodes_per_task))
+            if resume:
+                entries, missing = _episodes_to_collect(
+                    os.path.join(FLAGS.save_path, task_names[task_index],
+                                 VARIATIONS_FOLDER % variation),
+                    FLAGS.episodes_per_task, FLAGS.resume_checksums)
+                for entry in entries:
+                    tracker.add(key, entry)
+            if len(missing) > 0:
+                episodes[variation] = missing
+            else:
+                write_manifests(tracker.finish(key))
+        scheduler.add_variations(task_index, episodes)
+
+    def finish(i, failed=False):
+        finished = scheduler.finish(i, failed)
+        if finished is not None:
+            write_manifests(tracker.finish(finished))
+
+    def fail(task_index, variation, problem):
+        print(problem)
+        failures.append({
+            'task': task_names.get(task_index, task_files[task_index]),
+            'variation': variation,
+            'problem': problem})
+
+    def handle(message):
+        nonlocal num_episodes
+        kind, i, task_index = message[:3]
+        if kind == 'written':
+            variation, entry, problem = message[3:]
+            if entry is not None:
+                num_episodes += 1
+                print('%d episodes written // %.0f episodes/hour' % (
+                    num_episodes, num_episodes / _hours_since(start)))
+            if problem is not None:
+                fail(task_index, variation, problem)
+            write_manifests(tracker.written(i, (task_index, variation), entry))
+        else:
+            if kind == 'variations':
+                task_names[task_index] = message[3]
+                add_variations(task_index, message[4])
+                finish(i)
+            elif kind == 'episodes':
+                num_demos, problem = message[3:]
+                item = scheduler.running(i)
+                tracker.collected(i, item[1:3], num_demos)
+                if problem is not None:
+                    fail(item[1], item[2], problem)
+                finish(i, failed=problem is not None)
+            idle[i] = task_index
+
+    def exited(i):
+        alive.discard(i)
+        write_manifests(tracker.exited(i))
+        item = scheduler.running(i)
+        if item is not None:
+            fail(item[1], item[2] if item[0] == 'episodes' else None,
+                 'Process %d died while working on %s.\n' % (i, item))
+            finish(i, failed=True)
+
+    while len(receivers) > 0:
+        for receiver in wait(list(receivers)):
+            try:
+                message = receiver.recv()
+            except EOFError:
+                exited(receivers.pop(receiver))
+                continue
+            handle(message)
+        if collecting:
+            for i, task_index in list(idle.items()):
+                item = scheduler.next(i, task_index) if i in alive else None
+                if item is not None:
+                    del idle[i]
+                    work_queues[i].put(item)
+            if len(alive) == 0 or (
+                    scheduler.done() and all(i in idle for i in alive)):
+                collecting = False
+                for work_queue in work_queues:
+                    work_queue.put(None)
+
     [t.join() for t in processes]
 
-    print('Data collection done!')
-    for i in range(FLAGS.processes):
-        print(result_dict[i])
+    hours = _hours_since(start)
+    print('Data collection done! %d episodes in %.2f hours (%.0f '
+          'episodes/hour).' % (num_episodes, hours, num_episodes / hours))
+    for failure in failures:
+        print(failure['problem'])
+    with open(os.path.join(FLAGS.save_path, FAILED_VARIATIONS), 'w') as f:
+        json.dump(failures, f, indent=2)
+    if len(failures) > 0:
+        print('%d task variations failed. Run again with --retry_failed to '
+              'collect only those.' % len(failures))
+
+
+def _completed_episodes(variation_path, checksums=False):
+    """Finds the complete episodes of a variation.
+
+    :return: Episode number to the manifest entry of the episode, for the
+        episodes that pass manifest.verify_episode. Episodes written before
+        there were footers are not included, as they have no entry.
+    """
+    episodes_path = os.path.join(variation_path, EPISODES_FOLDER)
+    if not os.path.isdir(episodes_path):
+        return {}
+    name_format = re.compile(EPISODE_FOLDER.replace('%d', r'(\d+)'))
+    for name in os.listdir(episodes_path):
+        match = re.fullmatch(r'(.*)\.old\d+', name)
+        if match is not None and name_format.fullmatch(match.group(1)):
+            _recover_episode(os.path.join(episodes_path, match.group(1)))
+    completed = {}
+    for name in os.listdir(episodes_path):
+        match = name_format.fullmatch(name)
+        if match is None:
+            continue
+        example_path = os.path.join(episodes_path, name)
+        try:
+            footer = manifest.read_episode_footer(example_path)
+        except ValueError:
+            continue
+        if (footer is not None and
+                manifest.verify_episode(example_path, checksums) is None):
+            completed[int(match.group(1))] = footer['entry']
+    return completed
+
+
+def _episodes_to_collect(variation_path, num_episodes, checksums=False):
+    """Splits the episodes of a variation into complete and missing ones.
+
+    :return: The manifest entries of the complete episodes, and the
+        ascending numbers of the episodes still to collect.
+    """
+    completed = _completed_episodes(variation_path, checksums)
+    return ([completed[n] for n in range(num_episodes) if n in completed],
+            [n for n in range(num_episodes) if n not in completed])
+
+
+def _hours_since(start):
+    return max(time.time() - start, 1e-6) / 3600
 
 
 if __name__ == '__main__':